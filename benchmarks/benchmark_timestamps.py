@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+"""
+Compare the time needed to convert the "start_time=" time stamps of fastq headers with dateutil (one at the time)
+and with NanoQC.parse_timestamps (whole batch at once).
+Usage: python benchmarks/benchmark_timestamps.py [number_of_time_stamps]
+"""
+
+import os
+import sys
+import random
+from time import time
+from dateutil.parser import parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nanoqc.nanoQC import NanoQC
+
+
+def make_time_stamps(n):
+    time_stamps = list()
+    for i in range(n):
+        seconds = random.randint(0, 72 * 3600)
+        time_stamps.append('2018-06-{:02d}T{:02d}:{:02d}:{:02d}Z'.format(1 + seconds // 86400,
+                                                                         seconds // 3600 % 24,
+                                                                         seconds // 60 % 60,
+                                                                         seconds % 60).encode())
+    return time_stamps
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    random.seed(42)
+    time_stamps = make_time_stamps(n)
+
+    start_time = time()
+    dateutil_seconds = [int(parse(t).timestamp()) for t in time_stamps]
+    dateutil_time = time() - start_time
+
+    start_time = time()
+    numpy_seconds = NanoQC.parse_timestamps(time_stamps)
+    numpy_time = time() - start_time
+
+    assert numpy_seconds.tolist() == dateutil_seconds
+
+    print('%d time stamps' % n)
+    print('dateutil.parser.parse:  %.3fs (%.0f per second)' % (dateutil_time, n / dateutil_time))
+    print('NanoQC.parse_timestamps: %.3fs (%.0f per second)' % (numpy_time, n / numpy_time))
+    print('Speedup: %.0fx' % (dateutil_time / numpy_time))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+Compare the cost of sending the parsing results of the workers back to the parent process with dictionaries of
+FastqObjects (one Python object per read) and with ReadTables (one typed numpy array per metric).
+The time includes the pickling done in the worker, the unpickling and the merge done in the parent. The time spent
+in the pipe itself grows with the pickled size, which is also reported.
+Usage: python benchmarks/benchmark_transfer.py [number_of_reads] [number_of_batches]
+"""
+
+import os
+import sys
+import pickle
+import numpy as np
+from time import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from nanoqc.nanoQC import FastqObjects, ReadTable
+
+
+def make_columns(n, seed):
+    rng = np.random.default_rng(seed)
+    return (rng.integers(200, 50000, n), rng.uniform(5, 15, n).round(2), rng.uniform(30, 60, n).round(1),
+            rng.integers(1527811200, 1527811200 + 48 * 3600, n), rng.integers(1, 513, n))
+
+
+def make_dict(n, seed):
+    d = dict()
+    for i, (length, phred, gc, t, channel) in enumerate(zip(*[c.tolist() for c in make_columns(n, seed)])):
+        d['%d_%d' % (seed, i)] = FastqObjects('sample', length, 'pass', phred, gc,
+                                              datetime.fromtimestamp(t, timezone.utc), str(channel))
+    return d
+
+
+def make_table(n, seed):
+    return ReadTable.from_sample('sample', 'pass', *make_columns(n, seed))
+
+
+def merge_dicts(results):
+    d = dict()
+    for r in results:
+        d.update(r)
+    return d
+
+
+def transfer(batches, merge):
+    start_time = time()
+    pickled = [pickle.dumps(b, protocol=pickle.HIGHEST_PROTOCOL) for b in batches]  # In the workers
+    merged = merge([pickle.loads(p) for p in pickled])  # In the parent
+    return merged, time() - start_time, sum(len(p) for p in pickled)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    n_batches = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    d, dict_time, dict_size = transfer([make_dict(n, i) for i in range(n_batches)], merge_dicts)
+    t, table_time, table_size = transfer([make_table(n, i) for i in range(n_batches)], ReadTable.concatenate)
+    assert len(d) == len(t) == n * n_batches
+
+    print('%d batches of %d reads' % (n_batches, n))
+    print('dict of FastqObjects: %.3fs, %.1f MB pickled' % (dict_time, dict_size / 1e6))
+    print('ReadTable:            %.3fs, %.1f MB pickled' % (table_time, table_size / 1e6))
+    print('Speedup: %.0fx' % (dict_time / table_time))
@@ -1,27 +1,61 @@
 #!/usr/local/env python
 
+import io
 import os
 import sys
 import gzip
+import bz2
+import lzma
+import mmap
 import base64
 import pathlib
+import shutil
+import hashlib
 import logging
 import numpy as np
 import pandas as pd
-from time import time
+from time import time, sleep
 import seaborn as sns
 import multiprocessing as mp
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import matplotlib.gridspec as gridspec
 from matplotlib.ticker import FuncFormatter, MultipleLocator
-from collections import defaultdict, OrderedDict
+from collections import OrderedDict
 from argparse import ArgumentParser
 from dateutil.parser import parse
-from itertools import islice
+from datetime import datetime, timezone
 from math import ceil
 from math import sqrt
-import subprocess
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import struct
+import re
+
+# Use a faster zlib implementation to decompress the fastq.gz files when one is installed
+try:
+    from isal import igzip as fast_gzip  # Intel ISA-L
+except ImportError:
+    try:
+        from zlib_ng import gzip_ng as fast_gzip  # zlib-ng
+    except ImportError:
+        fast_gzip = gzip
+
+# Same for the raw deflate streams of the BGZF blocks of the BAM files
+try:
+    from isal import isal_zlib as fast_zlib
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as fast_zlib
+    except ImportError:
+        import zlib as fast_zlib
+
+# Zstandard compressed sequencing summaries are only supported when the zstandard module is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 __author__ = 'duceppemo'
@@ -41,9 +75,12 @@ __version__ = '0.3.3'
 # output files are all fastq_bunchofotherjunk, so nanoQC thinks it's only one sample, even if many.
 
 class ImageForHTML:
-    def __init__(self, image_title, image_base64_string):
+    def __init__(self, image_title, image_base64_string, file_name=None, png=None):
         self.image_title = image_title
         self.image_base64_string = image_base64_string
+        # PNG file still to write in the output folder, None once written or if not written at all
+        self.file_name = file_name
+        self.png = png
 
 
 class FastqObjects(object):
@@ -58,16 +95,1127 @@ class FastqObjects(object):
         self.channel = channel
 
 
-class SummaryObjects(object):
-    def __init__(self, name, length, channel, events, average_phred, time_stamp, flag):
-        # Create seq object with its attributes
-        self.name = name
-        self.channel = channel
-        self.events = events
-        self.time_stamp = time_stamp
-        self.length = length
-        self.flag = flag
-        self.average_phred = average_phred
+class ReadTable(object):
+    """
+    Per read metrics stored as one typed numpy array per attribute instead of one object per read.
+    The sample names and the flags are dictionary-encoded: each read stores the index of its value in
+    self.sample_names and self.flag_names.
+    """
+
+    def __init__(self, length=None, average_phred=None, gc=None, time_stamp=None, channel=None,
+                 sample=None, flag=None, sample_names=None, flag_names=None):
+        self.length = np.asarray(length if length is not None else [], dtype=np.uint32)
+        self.average_phred = np.asarray(average_phred if average_phred is not None else [], dtype=np.float32)
+        self.gc = np.asarray(gc if gc is not None else [], dtype=np.float32)
+        self.time_stamp = np.asarray(time_stamp if time_stamp is not None else [], dtype=np.int64)  # epoch seconds
+        self.channel = np.asarray(channel if channel is not None else [], dtype=np.uint16)
+        self.sample = np.asarray(sample if sample is not None else [], dtype=np.uint16)
+        self.flag = np.asarray(flag if flag is not None else [], dtype=np.uint8)
+        self.sample_names = list(sample_names) if sample_names is not None else list()
+        self.flag_names = list(flag_names) if flag_names is not None else list()
+
+    def __len__(self):
+        return self.flag.size
+
+    @classmethod
+    def from_sample(cls, name, flag, length, average_phred, gc, time_stamp, channel):
+        """
+        Make a table where all the reads belong to the same sample and have the same flag
+        """
+        n = len(length)
+        return cls(length=length, average_phred=average_phred, gc=gc, time_stamp=time_stamp, channel=channel,
+                   sample=np.zeros(n, dtype=np.uint16), flag=np.zeros(n, dtype=np.uint8),
+                   sample_names=[name], flag_names=[flag])
+
+    @classmethod
+    def concatenate(cls, tables):
+        """
+        Merge many tables in a single one
+        :param tables: list of ReadTable
+        :return: ReadTable
+        """
+        if not tables:
+            return cls()
+
+        # Re-encode the samples and flags of every table with the merged list of names
+        sample_names = list()
+        flag_names = list()
+        samples = list()
+        flags = list()
+        for table in tables:
+            for name in table.sample_names:
+                if name not in sample_names:
+                    sample_names.append(name)
+            for name in table.flag_names:
+                if name not in flag_names:
+                    flag_names.append(name)
+            sample_codes = np.array([sample_names.index(name) for name in table.sample_names], dtype=np.uint16)
+            flag_codes = np.array([flag_names.index(name) for name in table.flag_names], dtype=np.uint8)
+            samples.append(sample_codes[table.sample] if len(table) else table.sample)
+            flags.append(flag_codes[table.flag] if len(table) else table.flag)
+
+        return cls(length=np.concatenate([table.length for table in tables]),
+                   average_phred=np.concatenate([table.average_phred for table in tables]),
+                   gc=np.concatenate([table.gc for table in tables]),
+                   time_stamp=np.concatenate([table.time_stamp for table in tables]),
+                   channel=np.concatenate([table.channel for table in tables]),
+                   sample=np.concatenate(samples),
+                   flag=np.concatenate(flags),
+                   sample_names=sample_names,
+                   flag_names=flag_names)
+
+    def subset(self, mask):
+        """
+        Keep only the reads selected by a boolean mask or an array of indices
+        """
+        return ReadTable(length=self.length[mask], average_phred=self.average_phred[mask], gc=self.gc[mask],
+                         time_stamp=self.time_stamp[mask], channel=self.channel[mask],
+                         sample=self.sample[mask], flag=self.flag[mask],
+                         sample_names=self.sample_names, flag_names=self.flag_names)
+
+    def flag_mask(self, flag):
+        """
+        Boolean array of the reads having the flag
+        """
+        if flag not in self.flag_names:
+            return np.zeros(len(self), dtype=bool)
+        return self.flag == self.flag_names.index(flag)
+
+    def sample_mask(self, name):
+        """
+        Boolean array of the reads belonging to the sample
+        """
+        if name not in self.sample_names:
+            return np.zeros(len(self), dtype=bool)
+        return self.sample == self.sample_names.index(name)
+
+    @staticmethod
+    def mix(x):
+        """
+        splitmix64 finalizer: uniformly distributed 64-bit hashes of 64-bit integers
+        :param x: numpy array of uint64
+        """
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+    def priority_keys(self, seed):
+        """
+        Random priority of every read for the reservoir samples. The priority is a hash of the read metrics, so a read
+        gets the same priority whatever the worker that parsed it and the order of the reads.
+        :param seed: integer changing all the priorities
+        :return: numpy array of uint64
+        """
+        keys = self.mix(self.time_stamp.astype(np.uint64) ^ np.uint64(seed))
+        keys = self.mix(keys ^ (self.channel.astype(np.uint64) << np.uint64(32) | self.length))
+        return self.mix(keys ^ (self.gc.view(np.uint32).astype(np.uint64) << np.uint64(32)
+                                | self.average_phred.view(np.uint32)))
+
+    @staticmethod
+    def smallest(keys, size):
+        """
+        :return: sorted numpy array of the positions of the smallest keys
+        """
+        if keys.size <= size:
+            return np.arange(keys.size)
+        return np.sort(np.argpartition(keys, size)[:size])
+
+    def reservoir(self, size, seed):
+        """
+        Uniform random sample of the reads, for the plots drawing every read. The reads having the smallest priority
+        keys are kept, which gives the same sample as the reservoir of a ReadStats.
+        :param size: number of reads in the sample
+        :param seed: seed of the priority keys
+        :return: ReadTable
+        """
+        if len(self) <= size:
+            return self
+        return self.subset(self.smallest(self.priority_keys(seed), size))
+
+    def to_arrays(self):
+        """
+        :return: dictionary of numpy arrays, to save the table with numpy.savez
+        """
+        return dict(length=self.length, average_phred=self.average_phred, gc=self.gc, time_stamp=self.time_stamp,
+                    channel=self.channel, sample=self.sample, flag=self.flag,
+                    sample_names=np.array(self.sample_names, dtype=str), flag_names=np.array(self.flag_names, dtype=str))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Make a table from the arrays saved by self.to_arrays
+        """
+        return cls(length=arrays['length'], average_phred=arrays['average_phred'], gc=arrays['gc'],
+                   time_stamp=arrays['time_stamp'], channel=arrays['channel'], sample=arrays['sample'],
+                   flag=arrays['flag'], sample_names=arrays['sample_names'].tolist(),
+                   flag_names=arrays['flag_names'].tolist())
+
+    def decoded_samples(self):
+        return np.asarray(self.sample_names, dtype=object)[self.sample]
+
+    def decoded_flags(self):
+        return np.asarray(self.flag_names, dtype=object)[self.flag]
+
+    def nbytes(self):
+        return sum(column.nbytes for column in [self.length, self.average_phred, self.gc, self.time_stamp,
+                                                self.channel, self.sample, self.flag])
+
+    # Data for the plots. ReadStats has the same methods, computed from its accumulators.
+
+    def start_time(self):
+        """
+        Time stamp of the first read, in seconds since epoch
+        """
+        return int(self.time_stamp.min())
+
+    def flag_count(self, flag):
+        return int(np.count_nonzero(self.flag_mask(flag)))
+
+    def run_hours(self):
+        """
+        :return: numpy array of the hours since the start of the run of every read, rounded
+        """
+        return np.round((self.time_stamp - self.start_time()) / 3600).astype(np.int64)
+
+    def yield_curve(self, flag, sample=None, bases=False):
+        """
+        Cumulative number of reads or base pairs over time
+        :param flag: 'pass' or 'fail'
+        :param sample: only count the reads of this sample, from its first read. All the samples from the start of
+                       the run if None.
+        :param bases: count the base pairs instead of the reads
+        :return: tuple of numpy arrays of the hours and the cumulative values
+        """
+        mask = self.flag_mask(flag)
+        if sample is not None:
+            mask &= self.sample_mask(sample)
+        time_stamps = self.time_stamp[mask]
+        if not time_stamps.size:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+
+        order = np.argsort(time_stamps, kind='stable')
+        start = time_stamps[order[0]] if sample is not None else self.start_time()
+        hours = (time_stamps[order] - start) / 3600
+        if bases:
+            return hours, np.cumsum(self.length[mask][order], dtype=np.int64)
+        return hours, np.arange(1, hours.size + 1)  # 1 time point equals 1 read
+
+    def sample_totals(self, flag):
+        """
+        :return: tuple of the sample names, and numpy arrays of their number of reads and base pairs having the flag
+        """
+        mask = self.flag_mask(flag)
+        n_samples = len(self.sample_names)
+        reads = np.bincount(self.sample[mask], minlength=n_samples)
+        bases = np.bincount(self.sample[mask], weights=self.length[mask], minlength=n_samples).astype(np.int64)
+        return self.sample_names, reads, bases
+
+    def distribution(self, column, flag):
+        """
+        Values of a metric for the reads having the flag, to draw histograms
+        :param column: 'length' or 'average_phred' (rounded to 0.1)
+        :param flag: 'pass' or 'fail'
+        :return: tuple of numpy array of the values and their weights. Weights are None: one value per read.
+        """
+        values = getattr(self, column)[self.flag_mask(flag)]
+        if column == 'average_phred':
+            values = np.round(values.astype(np.float64), 1)
+        return values, None
+
+    def joint_distribution(self, column, flag):
+        """
+        Length and another metric of the reads having the flag, to draw 2D histograms
+        :param column: 'average_phred' or 'gc'
+        :param flag: 'pass' or 'fail'
+        :return: tuple of numpy arrays of the lengths and the values
+        """
+        mask = self.flag_mask(flag)
+        return self.length[mask], getattr(self, column)[mask]
+
+    def minute_counts(self, flag=None):
+        """
+        :param flag: 'pass' or 'fail'. All the reads if None.
+        :return: tuple of numpy arrays of the minutes since the start of the run and their weights. Weights are None:
+                 one value per read.
+        """
+        time_stamps = self.time_stamp if flag is None else self.time_stamp[self.flag_mask(flag)]
+        return np.round((time_stamps - self.start_time()) / 60).astype(np.int64), None
+
+    def channel_counts(self, flag):
+        """
+        :return: numpy array of the number of reads having the flag, indexed by channel number
+        """
+        return np.bincount(self.channel[self.flag_mask(flag)], minlength=int(self.channel.max()) + 1)
+
+    def hourly_means(self, column, flag, sample=None):
+        """
+        Mean of a metric in bins of one hour since the start of the run
+        :param column: 'gc'
+        :param flag: 'pass' or 'fail'
+        :param sample: only the reads of this sample. All the samples if None.
+        :return: tuple of numpy arrays of the hours, the means and their 95% confidence intervals
+        """
+        mask = self.flag_mask(flag)
+        if sample is not None:
+            mask &= self.sample_mask(sample)
+        hours = self.run_hours()[mask]
+        values = getattr(self, column)[mask].astype(np.float64)
+        return self.binned_means(np.bincount(hours), np.bincount(hours, weights=values),
+                                 np.bincount(hours, weights=values ** 2))
+
+    def hourly_histograms(self, column, flag):
+        """
+        Histograms of a metric in bins of one hour since the start of the run, with the bins of ReadStats
+        :param column: 'average_phred' or 'gc'
+        :param flag: 'pass' or 'fail'
+        :return: tuple of numpy arrays of the hours, the values of the histogram bins and the counts (hour, bin)
+        """
+        step, n_bins = ReadStats.HOURLY_BINS[column]
+        hours = self.run_hours()
+        mask = self.flag_mask(flag)
+        bins = ReadStats.bin(getattr(self, column)[mask].astype(np.float64), step, n_bins)
+        counts = np.bincount(hours[mask] * n_bins + bins, minlength=(int(hours.max()) + 1) * n_bins)
+        return np.arange(hours.max() + 1), np.arange(n_bins) * step, counts.reshape(-1, n_bins)
+
+    @staticmethod
+    def binned_means(counts, sums, squares):
+        """
+        :param counts: numpy array of the number of values in each bin
+        :param sums: numpy array of the sum of the values in each bin
+        :param squares: numpy array of the sum of the squared values in each bin
+        :return: tuple of numpy arrays of the bins having values, their means and their 95% confidence intervals
+        """
+        bins = np.flatnonzero(counts)
+        counts = counts[bins]
+        means = sums[bins] / counts
+        variances = np.maximum(squares[bins] / counts - means ** 2, 0)
+        return bins, means, 1.96 * np.sqrt(variances / counts)
+
+
+class PlotInputs(object):
+    """
+    Inputs of all the plots of a report, computed together from a ReadTable.
+    Every plot registers what it needs in NanoQC.PLOT_INPUTS. The shared columns are then derived once, in one
+    vectorised pass: the time since the start of the run, the reads sorted by time for all the yield curves, the
+    minutes and hours, and the counts per channel, per sample and per hour in a single bincount each. The plots get
+    ready-made arrays through the same methods as ReadTable, and a result asked by several plots is only computed once.
+    """
+
+    def __init__(self, table, needs, sample_size=200000, seed=0):
+        """
+        :param table: ReadTable
+        :param needs: set of the inputs needed by the plots, from NanoQC.PLOT_INPUTS
+        :param sample_size: number of reads in the random sample of the reads, if needed
+        :param seed: seed of the random sample
+        """
+        self.table = table
+        self.needs = needs
+        self.results = dict()
+        self.flag_counts = np.bincount(table.flag, minlength=len(table.flag_names))
+        seconds = table.time_stamp - table.start_time()
+        hourly_columns = [need[1] for need in needs if isinstance(need, tuple) and need[0] == 'hourly_means']
+        histogram_columns = [need[1] for need in needs if isinstance(need, tuple) and need[0] == 'hourly_histograms']
+
+        if 'yields' in needs:
+            order = np.argsort(seconds, kind='stable')
+            self.sorted_seconds = seconds[order]
+            self.sorted_flag = table.flag[order]
+            self.sorted_sample = table.sample[order]
+            self.sorted_length = table.length[order]
+        if 'minutes' in needs:
+            self.minutes = np.round(seconds / 60).astype(np.int64)
+        if 'hours' in needs or hourly_columns or histogram_columns:
+            self.hours = np.round(seconds / 3600).astype(np.int64)
+        if 'channels' in needs:
+            n_channels = int(table.channel.max()) + 1
+            self.channels = np.bincount(table.flag.astype(np.int64) * n_channels + table.channel,
+                                        minlength=len(table.flag_names) * n_channels).reshape(-1, n_channels)
+        if 'reservoir' in needs:
+            self.sampling = (sample_size, seed)
+            self.sampled_reads = table.reservoir(sample_size, seed)
+        if 'samples' in needs:
+            n_samples = len(table.sample_names)
+            index = table.flag.astype(np.int64) * n_samples + table.sample
+            size = len(table.flag_names) * n_samples
+            self.sample_reads = np.bincount(index, minlength=size).reshape(-1, n_samples)
+            self.sample_bases = np.bincount(index, weights=table.length,
+                                            minlength=size).astype(np.int64).reshape(-1, n_samples)
+
+        # Sums per flag, sample and hour, for the hourly means of a column
+        self.hourly = dict()
+        for column in hourly_columns:
+            shape = (len(table.flag_names), len(table.sample_names), int(self.hours.max()) + 1)
+            index = (table.flag.astype(np.int64) * shape[1] + table.sample) * shape[2] + self.hours
+            values = getattr(table, column).astype(np.float64)
+            self.hourly[column] = [np.bincount(index, weights=weights, minlength=np.prod(shape)).reshape(shape)
+                                   for weights in (None, values, values ** 2)]
+
+        # Histograms per flag, hour and bin of a column, for the violins over time
+        self.histograms = dict()
+        for column in histogram_columns:
+            step, n_bins = ReadStats.HOURLY_BINS[column]
+            shape = (len(table.flag_names), int(self.hours.max()) + 1, n_bins)
+            bins = ReadStats.bin(getattr(table, column).astype(np.float64), step, n_bins)
+            index = (table.flag.astype(np.int64) * shape[1] + self.hours) * shape[2] + bins
+            self.histograms[column] = np.bincount(index, minlength=np.prod(shape)).reshape(shape)
+
+    def __getattr__(self, name):
+        # Columns and other methods of the table
+        if name.startswith('__') or 'table' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.table, name)
+
+    def __len__(self):
+        return len(self.table)
+
+    # Attributes holding the precomputed arrays of every input
+    ARRAYS = {'yields': ('sorted_seconds', 'sorted_flag', 'sorted_sample', 'sorted_length'),
+              'minutes': ('minutes',),
+              'hours': ('hours',),
+              'channels': ('channels',),
+              'samples': ('sample_reads', 'sample_bases'),
+              'reservoir': ('sampling', 'sampled_reads')}
+
+    def select(self, needs):
+        """
+        Copy of the inputs holding only what some plots need, to send them to another process. The table only keeps
+        its flag column and the columns needed, the other columns are removed so a plot using a column it didn't
+        register fails instead of drawing nothing.
+        :param needs: set of the inputs needed, from NanoQC.PLOT_INPUTS
+        :return: PlotInputs
+        """
+        selected = object.__new__(PlotInputs)
+        selected.needs = set(needs)
+        selected.results = dict()
+        selected.flag_counts = self.flag_counts
+        for need in needs:
+            for name in PlotInputs.ARRAYS.get(need, ()):
+                setattr(selected, name, getattr(self, name))
+        selected.hourly = {column: sums for column, sums in self.hourly.items() if ('hourly_means', column) in needs}
+        selected.histograms = {column: counts for column, counts in self.histograms.items()
+                               if ('hourly_histograms', column) in needs}
+
+        columns = set(need[1] for need in needs if isinstance(need, tuple) and need[0] == 'column')
+        table = ReadTable(flag=self.table.flag, sample_names=self.table.sample_names,
+                          flag_names=self.table.flag_names)
+        for column in ('length', 'average_phred', 'gc', 'time_stamp', 'channel', 'sample'):
+            if column in columns:
+                setattr(table, column, getattr(self.table, column))
+            else:
+                delattr(table, column)
+        selected.table = table
+        return selected
+
+    def memoized(self, key, compute):
+        if key not in self.results:
+            self.results[key] = compute()
+        return self.results[key]
+
+    def flag_index(self, flag):
+        return self.table.flag_names.index(flag) if flag in self.table.flag_names else None
+
+    def flag_count(self, flag):
+        f = self.flag_index(flag)
+        return 0 if f is None else int(self.flag_counts[f])
+
+    def run_hours(self):
+        if 'hours' not in self.needs:
+            return self.table.run_hours()
+        return self.hours
+
+    def yield_curve(self, flag, sample=None, bases=False):
+        if 'yields' not in self.needs:
+            return self.table.yield_curve(flag, sample=sample, bases=bases)
+
+        def compute():
+            f = self.flag_index(flag)
+            if f is None or (sample is not None and sample not in self.sample_names):
+                return np.zeros(0), np.zeros(0, dtype=np.int64)
+            mask = self.sorted_flag == f
+            if sample is not None:
+                mask &= self.sorted_sample == self.sample_names.index(sample)
+            seconds = self.sorted_seconds[mask]
+            if not seconds.size:
+                return np.zeros(0), np.zeros(0, dtype=np.int64)
+            hours = (seconds - (seconds[0] if sample is not None else 0)) / 3600
+            if bases:
+                return hours, np.cumsum(self.sorted_length[mask], dtype=np.int64)
+            return hours, np.arange(1, hours.size + 1)  # 1 time point equals 1 read
+        return self.memoized(('yield_curve', flag, sample, bases), compute)
+
+    def sample_totals(self, flag):
+        if 'samples' not in self.needs:
+            return self.table.sample_totals(flag)
+        f = self.flag_index(flag)
+        if f is None:
+            return self.sample_names, np.zeros(len(self.sample_names), dtype=np.int64), \
+                np.zeros(len(self.sample_names), dtype=np.int64)
+        return self.sample_names, self.sample_reads[f], self.sample_bases[f]
+
+    def minute_counts(self, flag=None):
+        if 'minutes' not in self.needs:
+            return self.table.minute_counts(flag)
+        return (self.minutes if flag is None else self.minutes[self.flag_mask(flag)]), None
+
+    def channel_counts(self, flag):
+        if 'channels' not in self.needs:
+            return self.table.channel_counts(flag)
+        f = self.flag_index(flag)
+        return np.zeros(self.channels.shape[1], dtype=np.int64) if f is None else self.channels[f]
+
+    def hourly_means(self, column, flag, sample=None):
+        if column not in self.hourly:
+            return self.table.hourly_means(column, flag, sample=sample)
+        f = self.flag_index(flag)
+        if f is None or (sample is not None and sample not in self.sample_names):
+            return np.zeros(0, dtype=np.intp), np.zeros(0), np.zeros(0)
+        if sample is None:
+            sums = [accumulator[f].sum(axis=0) for accumulator in self.hourly[column]]
+        else:
+            sums = [accumulator[f, self.sample_names.index(sample)] for accumulator in self.hourly[column]]
+        return ReadTable.binned_means(*sums)
+
+    def hourly_histograms(self, column, flag):
+        if column not in self.histograms:
+            return self.table.hourly_histograms(column, flag)
+        step, n_bins = ReadStats.HOURLY_BINS[column]
+        histograms = self.histograms[column]
+        f = self.flag_index(flag)
+        counts = histograms[f] if f is not None else np.zeros(histograms.shape[1:], dtype=np.int64)
+        return np.arange(histograms.shape[1]), np.arange(n_bins) * step, counts
+
+    def distribution(self, column, flag):
+        return self.memoized(('distribution', column, flag), lambda: self.table.distribution(column, flag))
+
+    def reservoir(self, size, seed):
+        if 'reservoir' in self.needs and (size, seed) == self.sampling:
+            return self.sampled_reads
+        return self.memoized(('reservoir', size, seed), lambda: self.table.reservoir(size, seed))
+
+
+class ReadStats(object):
+    """
+    Fixed-size accumulators of the per read metrics, used instead of a ReadTable in streaming mode. The memory used
+    depends on the run duration, the number of samples and channels, but not on the number of reads.
+    The reads and base pairs are counted per sample, flag and minute. The phred scores, %GC and lengths are
+    counted in histograms fine enough to draw the fastq plots and to get quantiles. Accumulators from different
+    workers are merged by adding them.
+    A uniform random sample of the reads (reservoir) is also kept for the plots drawing every read. Every read gets a
+    random priority key and the reads with the smallest keys are kept, so reservoirs merge by keeping the smallest
+    keys again.
+    """
+
+    MINUTE = 60  # Time resolution of the yields, in seconds
+    QUARTER = 900  # Time resolution of the distributions over time, in seconds
+    QUALITY_STEP = 0.1  # Phred score histograms, from 0 to 60
+    N_QUALITY = 601
+    GC_STEP = 0.5  # %GC histograms, from 0 to 100
+    N_GC = 201
+    HOURLY_BINS = {'average_phred': (QUALITY_STEP, N_QUALITY), 'gc': (GC_STEP, N_GC)}  # Distributions over time
+    LENGTH_STEP = 0.01  # Length histograms in log10 scale, from 1 bp to 100 Mbp
+    N_LENGTH = 800
+
+    def __init__(self, reservoir_size=200000, seed=0):
+        self.sample_names = list()
+        self.flag_names = list()
+        self.origin = None  # First time bin, in quarters of hour since epoch
+        self.reservoir_size = reservoir_size
+        self.seed = seed
+        self.sampled_reads = ReadTable()
+        self.sampled_keys = np.zeros(0, dtype=np.uint64)
+        self.reads = np.zeros((0, 0, 0), dtype=np.int64)  # sample, flag, minute
+        self.bases = np.zeros((0, 0, 0), dtype=np.int64)  # sample, flag, minute
+        self.gc_sums = np.zeros((0, 0, 0))  # sample, flag, quarter
+        self.gc_squares = np.zeros((0, 0, 0))  # sample, flag, quarter
+        self.quality = np.zeros((0, 0, ReadStats.N_QUALITY), dtype=np.int64)  # flag, quarter, phred score
+        self.gc = np.zeros((0, 0, ReadStats.N_GC), dtype=np.int64)  # flag, quarter, %GC
+        self.length = np.zeros((0, ReadStats.N_LENGTH), dtype=np.int64)  # flag, length
+        self.channels = np.zeros((0, 0), dtype=np.int64)  # flag, channel
+
+    def __len__(self):
+        return int(self.reads.sum())
+
+    @staticmethod
+    def codes(names, new_names):
+        """
+        Position of new names in a list of names. The names not in the list yet are added at the end.
+        :return: numpy array of positions
+        """
+        for name in new_names:
+            if name not in names:
+                names.append(name)
+        return np.array([names.index(name) for name in new_names], dtype=np.intp)
+
+    @staticmethod
+    def pad(array, widths):
+        """
+        Add zeros before and after the first axes of an array
+        :param widths: list of (before, after) tuples, one for each of the first axes
+        """
+        if not any(before or after for before, after in widths):
+            return array
+        return np.pad(array, widths + [(0, 0)] * (array.ndim - len(widths)))
+
+    def resize(self, first_quarter, last_quarter, n_channels):
+        """
+        Grow the accumulators to fit the sample and flag names, a time range and a number of channels
+        """
+        n_quarters = self.gc_sums.shape[2]
+        if self.origin is None:
+            self.origin = first_quarter
+        before = max(self.origin - first_quarter, 0)
+        after = max(last_quarter - (self.origin + n_quarters - 1), 0)
+        samples = (0, len(self.sample_names) - self.reads.shape[0])
+        flags = (0, len(self.flag_names) - self.reads.shape[1])
+        channels = (0, max(n_channels - self.channels.shape[1], 0))
+
+        per_minute = ReadStats.QUARTER // ReadStats.MINUTE
+        self.reads = self.pad(self.reads, [samples, flags, (before * per_minute, after * per_minute)])
+        self.bases = self.pad(self.bases, [samples, flags, (before * per_minute, after * per_minute)])
+        self.gc_sums = self.pad(self.gc_sums, [samples, flags, (before, after)])
+        self.gc_squares = self.pad(self.gc_squares, [samples, flags, (before, after)])
+        self.quality = self.pad(self.quality, [flags, (before, after)])
+        self.gc = self.pad(self.gc, [flags, (before, after)])
+        self.length = self.pad(self.length, [flags])
+        self.channels = self.pad(self.channels, [flags, channels])
+        self.origin -= before
+
+    def sample(self, table, keys):
+        """
+        Add reads to the reservoir and keep the ones with the smallest keys
+        :param table: ReadTable
+        :param keys: numpy array of the priority keys of the reads
+        """
+        if self.sampled_keys.size >= self.reservoir_size:  # Full, only the reads with smaller keys can get in
+            candidates = keys < self.sampled_keys.max(initial=0)
+            if not np.any(candidates):
+                return
+            table = table.subset(candidates)
+            keys = keys[candidates]
+        keys = np.concatenate([self.sampled_keys, keys])
+        kept = ReadTable.smallest(keys, self.reservoir_size)
+        self.sampled_reads = ReadTable.concatenate([self.sampled_reads, table]).subset(kept)
+        self.sampled_keys = keys[kept]
+
+    def append(self, table):
+        """
+        Add the reads of a ReadTable to the accumulators
+        """
+        if not len(table):
+            return
+        self.sample(table, table.priority_keys(self.seed))
+        samples = self.codes(self.sample_names, table.sample_names)[table.sample]
+        flags = self.codes(self.flag_names, table.flag_names)[table.flag]
+        quarters = table.time_stamp // ReadStats.QUARTER
+        self.resize(int(quarters.min()), int(quarters.max()), int(table.channel.max()) + 1)
+        quarters = quarters - self.origin
+        minutes = table.time_stamp // ReadStats.MINUTE - self.origin * (ReadStats.QUARTER // ReadStats.MINUTE)
+
+        quality = table.average_phred.astype(np.float64)
+        gc = np.nan_to_num(table.gc.astype(np.float64))  # The summary files have no GC content
+        log_length = np.log10(np.maximum(table.length, 1))
+
+        np.add.at(self.reads, (samples, flags, minutes), 1)
+        np.add.at(self.bases, (samples, flags, minutes), table.length)
+        np.add.at(self.gc_sums, (samples, flags, quarters), gc)
+        np.add.at(self.gc_squares, (samples, flags, quarters), gc ** 2)
+        np.add.at(self.quality, (flags, quarters, self.bin(quality, ReadStats.QUALITY_STEP, ReadStats.N_QUALITY)), 1)
+        np.add.at(self.gc, (flags, quarters, self.bin(gc, ReadStats.GC_STEP, ReadStats.N_GC)), 1)
+        np.add.at(self.length, (flags, self.bin(log_length, ReadStats.LENGTH_STEP, ReadStats.N_LENGTH, True)), 1)
+        np.add.at(self.channels, (flags, table.channel), 1)
+
+    @staticmethod
+    def bin(values, step, n_bins, floor=False):
+        """
+        :return: numpy array of the histogram bin of every value. Values are rounded to the step, or floored.
+        """
+        bins = np.floor(values / step) if floor else np.round(values / step)
+        return np.clip(bins, 0, n_bins - 1).astype(np.intp)
+
+    def add(self, other):
+        """
+        Add the accumulators of another ReadStats to these ones
+        """
+        if other.origin is None:
+            return
+        self.sample(other.sampled_reads, other.sampled_keys)
+        samples = self.codes(self.sample_names, other.sample_names)
+        flags = self.codes(self.flag_names, other.flag_names)
+        n_quarters = other.gc_sums.shape[2]
+        self.resize(other.origin, other.origin + n_quarters - 1, other.channels.shape[1])
+        start = other.origin - self.origin
+        end = start + n_quarters
+        per_minute = ReadStats.QUARTER // ReadStats.MINUTE
+
+        self.reads[:, :, start * per_minute:end * per_minute][np.ix_(samples, flags)] += other.reads
+        self.bases[:, :, start * per_minute:end * per_minute][np.ix_(samples, flags)] += other.bases
+        self.gc_sums[:, :, start:end][np.ix_(samples, flags)] += other.gc_sums
+        self.gc_squares[:, :, start:end][np.ix_(samples, flags)] += other.gc_squares
+        self.quality[:, start:end][flags] += other.quality
+        self.gc[:, start:end][flags] += other.gc
+        self.length[flags] += other.length
+        self.channels[:, :other.channels.shape[1]][flags] += other.channels
+
+    @classmethod
+    def concatenate(cls, stats):
+        """
+        Merge many accumulators in a single one
+        :param stats: list of ReadStats
+        :return: ReadStats
+        """
+        merged = cls(*(stats[0].reservoir_size, stats[0].seed) if stats else ())
+        for other in stats:
+            merged.add(other)
+        return merged
+
+    ACCUMULATORS = ('reads', 'bases', 'gc_sums', 'gc_squares', 'quality', 'gc', 'length', 'channels')
+
+    # Accumulators used by every input of NanoQC.PLOT_INPUTS, besides the reads per minute used by all the plots
+    INPUTS = {'yields': ('bases',),
+              'samples': ('bases',),
+              'channels': ('channels',),
+              'reservoir': ('sampled_reads', 'sampled_keys'),
+              ('column', 'length'): ('length',),
+              ('column', 'average_phred'): ('quality',),
+              ('hourly_histograms', 'average_phred'): ('quality',),
+              ('hourly_histograms', 'gc'): ('gc',),
+              ('hourly_means', 'gc'): ('gc_sums', 'gc_squares')}
+
+    def select(self, needs):
+        """
+        Copy of the accumulators holding only what some plots need, to send them to another process, like
+        PlotInputs.select. The reads per minute are always kept, they give the number of reads and the start of the
+        run. The other accumulators are left out, so a plot using an input it didn't register fails.
+        :param needs: set of the inputs needed, from NanoQC.PLOT_INPUTS
+        :return: ReadStats
+        """
+        selected = object.__new__(ReadStats)
+        selected.sample_names = self.sample_names
+        selected.flag_names = self.flag_names
+        selected.origin = self.origin
+        selected.reservoir_size = self.reservoir_size
+        selected.seed = self.seed
+        selected.reads = self.reads
+        for need in needs:
+            for name in ReadStats.INPUTS.get(need, ()):
+                setattr(selected, name, getattr(self, name))
+        return selected
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ReadStats.ACCUMULATORS)
+
+    def to_arrays(self):
+        """
+        :return: dictionary of numpy arrays, to save the accumulators with numpy.savez
+        """
+        arrays = {name: getattr(self, name) for name in ReadStats.ACCUMULATORS}
+        arrays['origin'] = np.array(-1 if self.origin is None else self.origin, dtype=np.int64)
+        arrays['sample_names'] = np.array(self.sample_names, dtype=str)
+        arrays['flag_names'] = np.array(self.flag_names, dtype=str)
+        arrays['reservoir'] = np.array([self.reservoir_size, self.seed], dtype=np.int64)
+        arrays['sampled_keys'] = self.sampled_keys
+        arrays.update(('sampled_' + name, array) for name, array in self.sampled_reads.to_arrays().items())
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Make accumulators from the arrays saved by self.to_arrays
+        """
+        stats = cls(*arrays['reservoir'].tolist())
+        for name in ReadStats.ACCUMULATORS:
+            setattr(stats, name, arrays[name])
+        stats.sampled_keys = arrays['sampled_keys']
+        stats.sampled_reads = ReadTable.from_arrays({name[len('sampled_'):]: array for name, array in arrays.items()
+                                                     if name.startswith('sampled_') and name != 'sampled_keys'})
+        stats.origin = None if int(arrays['origin']) < 0 else int(arrays['origin'])
+        stats.sample_names = arrays['sample_names'].tolist()
+        stats.flag_names = arrays['flag_names'].tolist()
+        return stats
+
+    # Data for the plots, like the methods of ReadTable
+
+    def flag_index(self, flag):
+        return self.flag_names.index(flag) if flag in self.flag_names else None
+
+    def reservoir(self, size, seed):
+        """
+        Uniform random sample of the reads, like ReadTable.reservoir
+        :param size: number of reads in the sample, no more than the size of the reservoir
+        :param seed: seed of the priority keys. Must be the seed of the reservoir.
+        :return: ReadTable
+        """
+        if seed != self.seed:
+            raise Exception('The reads were sampled with seed {}, not {}'.format(self.seed, seed))
+        return self.sampled_reads.subset(ReadTable.smallest(self.sampled_keys, size))
+
+    def first_minute(self):
+        return int(np.flatnonzero(self.reads.sum(axis=(0, 1)))[0])
+
+    def start_time(self):
+        """
+        Start of the minute of the first read, in seconds since epoch
+        """
+        return (self.origin * (ReadStats.QUARTER // ReadStats.MINUTE) + self.first_minute()) * ReadStats.MINUTE
+
+    def quarter_hours(self):
+        """
+        :return: numpy array of the hour since the start of the run of every quarter of hour, rounded
+        """
+        n_quarters = self.reads.shape[2] // (ReadStats.QUARTER // ReadStats.MINUTE)
+        centers = (self.origin + np.arange(n_quarters) + 0.5) * ReadStats.QUARTER
+        return np.maximum(np.round((centers - self.start_time()) / 3600), 0).astype(np.intp)
+
+    def flag_count(self, flag):
+        f = self.flag_index(flag)
+        return 0 if f is None else int(self.reads[:, f].sum())
+
+    def yield_curve(self, flag, sample=None, bases=False):
+        f = self.flag_index(flag)
+        if f is None or (sample is not None and sample not in self.sample_names):
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        values = (self.bases if bases else self.reads)[:, f]
+        counts = self.reads[:, f]
+        if sample is not None:
+            values = values[self.sample_names.index(sample)]
+            counts = counts[self.sample_names.index(sample)]
+        else:
+            values = values.sum(axis=0)
+            counts = counts.sum(axis=0)
+
+        minutes = np.flatnonzero(counts)
+        if not minutes.size:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        start = minutes[0] if sample is not None else self.first_minute()
+        return (minutes - start) / 60, np.cumsum(values[minutes])
+
+    def sample_totals(self, flag):
+        f = self.flag_index(flag)
+        if f is None:
+            return self.sample_names, np.zeros(len(self.sample_names), dtype=np.int64), \
+                np.zeros(len(self.sample_names), dtype=np.int64)
+        return self.sample_names, self.reads[:, f].sum(axis=1), self.bases[:, f].sum(axis=1)
+
+    def distribution(self, column, flag):
+        f = self.flag_index(flag)
+        if column == 'average_phred':
+            counts = self.quality[f].sum(axis=0) if f is not None else np.zeros(0, dtype=np.int64)
+            values = np.arange(counts.size) * ReadStats.QUALITY_STEP
+        else:  # length, bin centers
+            counts = self.length[f] if f is not None else np.zeros(0, dtype=np.int64)
+            values = 10 ** ((np.arange(counts.size) + 0.5) * ReadStats.LENGTH_STEP)
+        bins = np.flatnonzero(counts)
+        return values[bins], counts[bins]
+
+    def minute_counts(self, flag=None):
+        per_minute = self.reads.sum(axis=0)
+        if flag is None:
+            per_minute = per_minute.sum(axis=0)
+        elif self.flag_index(flag) is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        else:
+            per_minute = per_minute[self.flag_index(flag)]
+        minutes = np.flatnonzero(per_minute)
+        return minutes - self.first_minute(), per_minute[minutes]
+
+    def channel_counts(self, flag):
+        f = self.flag_index(flag)
+        return self.channels[f] if f is not None else np.zeros(self.channels.shape[1], dtype=np.int64)
+
+    def hourly_means(self, column, flag, sample=None):
+        f = self.flag_index(flag)
+        if f is None or (sample is not None and sample not in self.sample_names):
+            return np.zeros(0, dtype=np.intp), np.zeros(0), np.zeros(0)
+        samples = slice(None) if sample is None else [self.sample_names.index(sample)]
+        per_minute = ReadStats.QUARTER // ReadStats.MINUTE
+        counts = self.reads[samples, f].sum(axis=0).reshape(-1, per_minute).sum(axis=1)
+        sums = self.gc_sums[samples, f].sum(axis=0)
+        squares = self.gc_squares[samples, f].sum(axis=0)
+        hours = self.quarter_hours()
+        return ReadTable.binned_means(np.bincount(hours, weights=counts), np.bincount(hours, weights=sums),
+                                      np.bincount(hours, weights=squares))
+
+    def hourly_histograms(self, column, flag):
+        """
+        Histograms of a metric in bins of one hour since the start of the run
+        :param column: 'average_phred' or 'gc'
+        :param flag: 'pass' or 'fail'
+        :return: tuple of numpy arrays of the hours, the values of the histogram bins and the counts (hour, bin)
+        """
+        if column == 'average_phred':
+            histograms, step = self.quality, ReadStats.QUALITY_STEP
+        else:  # gc
+            histograms, step = self.gc, ReadStats.GC_STEP
+        hours = self.quarter_hours()
+        counts = np.zeros((hours.max() + 1, histograms.shape[2]), dtype=np.int64)
+        f = self.flag_index(flag)
+        if f is not None:
+            np.add.at(counts, hours, histograms[f])
+        return np.arange(counts.shape[0]), np.arange(counts.shape[1]) * step, counts
+
+
+class GzipStream(io.RawIOBase):
+    """
+    Read-only file object of a decompressed gzip file, or of another compressed file with the matching opener.
+    The decompression is done by a background thread that feeds a bounded queue of decompressed blocks, so it
+    overlaps with the parsing of the previous blocks. The decompressed file is never fully held in memory nor written
+    to disk.
+    """
+
+    def __init__(self, path, block_size=1024 * 1024, queue_size=16, opener=None):
+        super().__init__()
+        self.block = b''
+        self.offset = 0
+        self.finished = False
+        self.queue = Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.decompress, args=(path, block_size, opener or fast_gzip.open),
+                                       daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def opener(path):
+        """
+        :param path: file path
+        :return: function opening the file for decompression, from its extension, or None if not compressed
+        """
+        if path.endswith('.gz'):
+            return fast_gzip.open
+        elif path.endswith('.bz2'):
+            return bz2.open
+        elif path.endswith('.xz'):
+            return lzma.open
+        elif path.endswith('.zst'):
+            if zstandard is None:
+                raise Exception('The zstandard module is needed to read {}'.format(path))
+            return zstandard.open
+        return None
+
+    def decompress(self, path, block_size, opener):
+        try:
+            with opener(path, 'rb') as file_handle:
+                while not self.stopped.is_set():
+                    data = file_handle.read(block_size)
+                    self.put(data)
+                    if not data:  # End of file
+                        break
+        except Exception as e:
+            self.put(e)  # Raised in the reading thread
+
+    def put(self, item):
+        # Don't wait forever for room in the queue if the file was closed before being read entirely
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        """
+        :param size: maximum number of bytes to return. Return the rest of the current block if negative.
+        :return: bytes. Can be less than size, empty at the end of the file.
+        """
+        if self.offset >= len(self.block):
+            if self.finished:
+                return b''
+            self.block = self.queue.get()
+            self.offset = 0
+            if isinstance(self.block, Exception):
+                self.finished = True
+                raise self.block
+            if not self.block:
+                self.finished = True
+                return b''
+
+        if self.offset == 0 and (size < 0 or size >= len(self.block)):
+            data = self.block  # No copy
+        else:
+            end = len(self.block) if size < 0 else self.offset + size
+            data = self.block[self.offset:end]
+        self.offset += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+        super().close()
+
+
+class ParseCache(object):
+    """
+    Cache folder of the parsing results, one .npz file of numpy arrays per file or byte range of a file, and one
+    SummarySidecar folder per sequencing summary file.
+    A result is found by a hash of the path, size and modification time of the file, the byte range and the parser
+    settings, so it is never used after the file changed. The least recently used results are removed when the cache
+    gets bigger than its maximum size.
+    """
+
+    def __init__(self, folder, max_size):
+        """
+        :param folder: cache folder, created if it doesn't exist
+        :param max_size: maximum size of the cache folder, in bytes
+        """
+        self.folder = folder
+        self.max_size = max_size
+
+    def key(self, f, start, length, settings):
+        """
+        :param f: fastq file
+        :param start: start of the byte range
+        :param length: length of the byte range. The whole file if None.
+        :param settings: tuple of the parser version and the settings changing the results
+        :return: string identifying the result
+        """
+        stat = os.stat(f)
+        return repr((os.path.abspath(f), stat.st_size, stat.st_mtime_ns, start, length) + tuple(settings))
+
+    def path(self, key):
+        return os.path.join(self.folder, hashlib.sha1(key.encode()).hexdigest() + '.npz')
+
+    def load(self, key, cls):
+        """
+        :param key: string made by self.key
+        :param cls: ReadTable or ReadStats
+        :return: the cached result, or None if not in the cache
+        """
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                if str(arrays['key']) != key:
+                    return None
+                result = cls.from_arrays(arrays)
+            os.utime(path)  # Most recently used
+            return result
+        except (OSError, KeyError, ValueError):  # Not cached, removed by another process or incomplete
+            return None
+
+    def save(self, key, result):
+        """
+        Add a result to the cache. It is written to a temporary file first, so other processes never load an
+        incomplete file.
+        :param key: string made by self.key
+        :param result: ReadTable or ReadStats
+        """
+        pathlib.Path(self.folder).mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            # The accumulators of a ReadStats are mostly zeros and compress 100 times. The columns of a ReadTable
+            # don't compress much and load faster uncompressed.
+            savez = np.savez_compressed if isinstance(result, ReadStats) else np.savez
+            with open(tmp_path, 'wb') as f:
+                savez(f, key=np.array(key), **result.to_arrays())
+            os.replace(tmp_path, path)
+        except OSError as e:  # Cache folder full or read only, parse again next time
+            logging.warning('Could not cache the parsing results: {}'.format(e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self):
+        """
+        Remove the least recently used results until the cache fits in its maximum size
+        """
+        if not os.path.isdir(self.folder):
+            return
+        entries = list()
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            elif entry.name.endswith(SummarySidecar.EXTENSION) and entry.is_dir():
+                size = sum(column.stat().st_size for column in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                if path.endswith(SummarySidecar.EXTENSION):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class SummarySidecar(object):
+    """
+    Parsed columns of a sequencing summary file, saved in the cache folder in a "<hash>.nanoqc" folder of .npy files,
+    one per column. The columns are memory-mapped when loaded, so a summary of any size is available at once and only
+    the pages used by the plots are read from disk. The sidecars count in the maximum size of the cache.
+    A sidecar is found by a hash of the path, size, modification time and header of the file and the parser settings,
+    so it is never used after the file changed.
+    """
+
+    EXTENSION = '.nanoqc'
+
+    def __init__(self, cache, summary):
+        """
+        :param cache: ParseCache
+        :param summary: sequencing summary file
+        """
+        self.cache = cache
+        self.summary = summary
+
+    def key(self, header, settings):
+        """
+        :param header: bytes of the first line of the summary file
+        :param settings: tuple of the parser version and the settings changing the results
+        :return: string identifying the parsed columns
+        """
+        stat = os.stat(self.summary)
+        return repr((os.path.abspath(self.summary), stat.st_size, stat.st_mtime_ns,
+                     hashlib.sha1(header).hexdigest()) + tuple(settings))
+
+    def path(self, key):
+        return os.path.join(self.cache.folder, hashlib.sha1(key.encode()).hexdigest() + SummarySidecar.EXTENSION)
+
+    def load(self, key):
+        """
+        :param key: string made by self.key
+        :return: ReadTable of memory-mapped columns, or None if there is no sidecar for this key
+        """
+        folder = self.path(key)
+        try:
+            if str(np.load(os.path.join(folder, 'key.npy'))) != key:
+                return None
+            arrays = {entry.name[:-len('.npy')]: np.load(entry.path, mmap_mode='r')
+                      for entry in os.scandir(folder) if entry.name.endswith('.npy')}
+            os.utime(folder)  # Most recently used
+            return ReadTable.from_arrays(arrays)
+        except (OSError, KeyError, ValueError):  # No sidecar, or removed by another process
+            return None
+
+    def save(self, key, table):
+        """
+        Write the sidecar. It is written to a temporary folder first, so other processes never load an incomplete
+        sidecar.
+        :param key: string made by self.key
+        :param table: ReadTable
+        """
+        folder = self.path(key)
+        tmp_folder = '{}.{}.tmp'.format(folder, os.getpid())
+        try:
+            pathlib.Path(tmp_folder).mkdir(parents=True, exist_ok=True)
+            for name, array in table.to_arrays().items():
+                np.save(os.path.join(tmp_folder, name + '.npy'), array)
+            np.save(os.path.join(tmp_folder, 'key.npy'), np.array(key))  # Last, so it means the sidecar is complete
+            shutil.rmtree(folder, ignore_errors=True)
+            os.replace(tmp_folder, folder)
+        except OSError as e:  # Cache folder full or read only, parse again next time
+            logging.warning('Could not cache the parsed summary {}: {}'.format(self.summary, e))
+            shutil.rmtree(tmp_folder, ignore_errors=True)
 
 
 class Layout(object):
@@ -80,20 +1228,105 @@ class Layout(object):
 
 class NanoQC(object):
 
-    def __init__(self, input_folder, sequencing_summary, output_folder, threads=mp.cpu_count()):
+    # Probability of a base call error for every possible quality character (Phred+33)
+    ERROR_PROBABILITIES = np.power(10.0, -np.clip(np.arange(256) - 33, 0, None) / 10)
+
+    # Version of the parsers, part of the cache keys. Increment it when a change of the parsers changes their results.
+    PARSER_VERSION = 3
+
+    # Columns of the sequencing summary files, found by name in the header. The first name found is used.
+    SUMMARY_COLUMNS = {'length': ('sequence_length_template', 'sequence_length'),
+                       'average_phred': ('mean_qscore_template', 'mean_qscore'),
+                       'time_stamp': ('start_time',),
+                       'channel': ('channel',),
+                       'flag': ('passes_filtering',),
+                       'sample': ('barcode_arrangement', 'barcode')}
+    OPTIONAL_SUMMARY_COLUMNS = ('flag', 'sample')
+
+    # Plots of the report, in order
+    FASTQ_PLOTS = ('total_reads_vs_time', 'total_bp_vs_time', 'reads_vs_bp_per_sample', 'reads_per_sample_vs_time',
+                   'bp_per_sample_vs_time', 'phred_score_distribution', 'length_distribution',
+                   'pores_output_vs_time_all', 'quality_vs_time', 'quality_vs_length_hex', 'channel_output_all',
+                   'gc_vs_time', 'gc_vs_length_hex', 'pores_gc_output_vs_time_all',
+                   'pores_gc_output_vs_time_per_sample')
+    # The summary files have no GC content
+    SUMMARY_PLOTS = tuple(name for name in FASTQ_PLOTS if 'gc' not in name)
+    # What every plot needs from a ReadTable, computed once for all the plots by PlotInputs
+    # ('column', name) is a column of the table used as is. 'reservoir' is the random sample of the reads.
+    PLOT_INPUTS = {'total_reads_vs_time': ('yields',),
+                   'total_bp_vs_time': ('yields',),
+                   'reads_vs_bp_per_sample': ('samples',),
+                   'reads_per_sample_vs_time': ('yields',),
+                   'bp_per_sample_vs_time': ('yields',),
+                   'phred_score_distribution': (('column', 'average_phred'),),
+                   'length_distribution': ('samples', ('column', 'length')),
+                   'pores_output_vs_time_all': ('minutes',),
+                   'quality_vs_time': (('hourly_histograms', 'average_phred'),),
+                   'quality_vs_length_hex': ('reservoir',),
+                   'channel_output_all': ('channels',),
+                   'gc_vs_time': (('hourly_histograms', 'gc'),),
+                   'gc_vs_length_hex': ('reservoir',),
+                   'pores_gc_output_vs_time_all': (('hourly_means', 'gc'),),
+                   'pores_gc_output_vs_time_per_sample': (('hourly_means', 'gc'),)}
+
+    # Maximum number of points drawn by the cumulative yield curves, a few per pixel of the figures
+    YIELD_CURVE_POINTS = 2000
+
+    # Keys of the read start time and channel fields in the fastq headers. MinKNOW and Guppy write "key=value"
+    # fields, Dorado writes SAM tags ("XX:T:value")
+    TIME_KEYS = (b'start_time', b'st')
+    CHANNEL_KEYS = (b'ch', b'channel')
+
+    # Number of G and C bases in every byte of a BAM sequence. Each byte holds two bases coded on 4 bits with
+    # "=ACMGRSVTWYHKDBN", so C is 2 and G is 4.
+    BAM_GC_COUNTS = np.array([((b >> 4) in (2, 4)) + ((b & 15) in (2, 4)) for b in range(256)], dtype=np.uint8)
+
+    # Read start time and channel tags of the unaligned BAM files written by Dorado
+    BAM_TIME_TAG = re.compile(rb'stZ([^\x00]*)\x00')
+    BAM_CHANNEL_TAG = re.compile(rb'ch([cCsSiI])')
+    BAM_INTEGER_TYPES = {b'c': '<b', b'C': '<B', b's': '<h', b'S': '<H', b'i': '<i', b'I': '<I'}
+
+    def __init__(self, input_folder, sequencing_summary, output_folder, threads=mp.cpu_count(),
+                 quality_mode='probability', streaming=False, watch=False, interval=300,
+                 cache_folder=None, cache_size=2 * 1024 ** 3, sample_size=200000, seed=0, write_png=True):
 
         """Define objects based on supplied arguments"""
         self.input_folder = input_folder
         self.input_summary = sequencing_summary
         self.output_folder = output_folder
 
+        # How the average phred score of a read is computed: 'probability' or 'arithmetic'
+        self.quality_mode = quality_mode
+
+        # Aggregate the reads in fixed-size accumulators (ReadStats) instead of storing them (ReadTable).
+        # Always done in watch mode, so the cost of a refresh doesn't grow with the reads already parsed.
+        self.streaming = streaming or watch
+
+        # Number of reads drawn by the plots showing every read (scatter plots, densities) and seed of the sampling
+        self.sample_size = sample_size
+        self.seed = seed
+
+        # Write every plot in its own PNG file next to the report. The report alone is written if False.
+        self.write_png = write_png
+
+        # Parsing results of the fastq files already seen. No cache if cache_folder is None.
+        self.cache = ParseCache(cache_folder, cache_size) if cache_folder else None
+
+        # Watch the input folder for new fastq files and refresh the report every interval (in seconds)
+        self.watch = watch
+        self.interval = interval
+        self.parsed_files = dict()  # path: (size, modification time) when parsed
+        self.polled_files = dict()  # path: (size, modification time) at the last poll, not parsed yet
+
+        # Layout of the fastq headers, detected from the first header parsed
+        self.header_format = None
+
+        # Time taken to draw every plot of the last report, in seconds
+        self.plot_times = OrderedDict()
+
         # Shared data structure(s)
-        # self.sample_dict = dict()
-        # self.summary_dict = dict()
-        # self.sample_dict = nested_dict()
-        # self.summary_dict = nested_dict()
-        self.sample_dict = defaultdict()
-        self.summary_dict = defaultdict()
+        self.read_table = ReadTable()
+        self.summary_table = ReadTable()
 
         # Create a list of fastq files in input folder
         self.input_fastq_list = list()
@@ -105,6 +1338,16 @@ class NanoQC(object):
         self.cpu = threads
         # self.my_queue = Queue(maxsize=0)
 
+    def __getstate__(self):
+        # The workers of the pool only need the settings. Don't send them the file list and the results every task.
+        state = self.__dict__.copy()
+        state['input_fastq_list'] = list()
+        state['parsed_files'] = dict()
+        state['polled_files'] = dict()
+        state['read_table'] = ReadTable()
+        state['summary_table'] = ReadTable()
+        return state
+
     def run(self):
         """
         Run everything
@@ -119,25 +1362,29 @@ class NanoQC(object):
         self.check_args()
 
         # Select appropriate parser based on input type
-        if self.input_folder:
+        if self.input_folder and self.watch:
+            self.watch_fastq_files()
+        elif self.input_folder:
             self.find_fastq_files()
             # self.parse_fastq(self.input_fastq_list, self.sample_dict)
-            self.parse_fastq_parallel(self.input_fastq_list, self.sample_dict)
+            self.read_table = self.parse_fastq_parallel(self.input_fastq_list)
             # Check if there is data
-            if not self.sample_dict:
+            if not len(self.read_table):
                 raise Exception('No data!')
             else:
-                plots = self.make_fastq_plots(self.sample_dict)  # make the plots for fastq files
+                plots = self.make_plots(self.read_table, NanoQC.FASTQ_PLOTS)  # make the plots for fastq files
                 logging.info('Writing HTML reports...')
                 self.write_html_report(plots)
         else:  # elif self.input_summary:
-            self.parse_summary(self.summary_dict)
+            self.summary_table = self.parse_summary()
 
             # Check if there is data
-            if not self.summary_dict:
+            if not len(self.summary_table):
                 raise Exception('No data!')
             else:
-                self.make_summary_plots(self.summary_dict)
+                plots = self.make_plots(self.summary_table, NanoQC.SUMMARY_PLOTS)
+                logging.info('Writing HTML reports...')
+                self.write_html_report(plots)
 
         # import pprint
         # pp = pprint.PrettyPrinter(indent=4)
@@ -175,7 +1422,7 @@ class NanoQC(object):
         :return:
         """
 
-        if self.input_folder and self.summary_dict:
+        if self.input_folder and self.input_summary:
             print('Please use only one input type ("-f" or "-s")')
             # parser.print_help(sys.stderr)  # This doesn't work - I think the parser would have to be passed into this to make it work
             sys.exit(1)
@@ -191,17 +1438,101 @@ class NanoQC(object):
         else:
             pathlib.Path(self.output_folder).mkdir(parents=True, exist_ok=True)  # Create if if it does not exist
 
-    def find_fastq_files(self):
+    def list_fastq_files(self):
+        fastq_files = list()
         for root, directories, filenames in os.walk(self.input_folder):
             for filename in filenames:
                 absolute_path = os.path.join(root, filename)
-                if os.path.isfile(absolute_path) and filename.endswith(('.fastq','.fastq.gz')):
-                    self.input_fastq_list.append(absolute_path)
+                if os.path.isfile(absolute_path) and filename.endswith(('.fastq', '.fastq.gz', '.bam')):
+                    fastq_files.append(absolute_path)
+        return fastq_files
+
+    def find_fastq_files(self):
+        self.input_fastq_list.extend(self.list_fastq_files())
 
         # check if input_fastq_list is not empty
         if not self.input_fastq_list:
             raise Exception("No fastq file found in %s!" % self.input_folder)
 
+    def poll_fastq_files(self):
+        """
+        Find the fastq files of the input folder that are complete and not parsed yet, and the files that grew since
+        they were parsed. The basecaller may still be writing a file: it is only considered complete when its size
+        and modification time didn't change since the last poll, or when it wasn't modified for a whole interval.
+        Only the bytes appended to a file that grew are parsed.
+        :return: tuple of the list of fastq files to parse and the list of (file, start, length) byte ranges appended
+                 to the files already parsed
+        """
+        now = time()
+        polled_files = dict()
+        new_files = list()
+        appended = list()
+        for f in self.list_fastq_files():
+            try:
+                stat = os.stat(f)
+            except FileNotFoundError:  # Removed or renamed since the folder was listed
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            complete = self.polled_files.get(f) == signature or stat.st_mtime < now - self.interval
+            if f not in self.parsed_files:
+                if complete:
+                    new_files.append(f)
+                    self.parsed_files[f] = signature
+                else:
+                    polled_files[f] = signature
+            elif self.parsed_files[f] != signature:
+                parsed_size = self.parsed_files[f][0]
+                if stat.st_size < parsed_size:
+                    logging.warning('{} was rewritten after being parsed. Its new reads are ignored.'.format(f))
+                    self.parsed_files[f] = signature
+                elif stat.st_size == parsed_size:  # Only touched
+                    self.parsed_files[f] = signature
+                elif complete:
+                    appended.append((f, parsed_size, stat.st_size - parsed_size))
+                    self.parsed_files[f] = signature
+                else:
+                    polled_files[f] = signature
+        self.polled_files = polled_files
+        return new_files, appended
+
+    def refresh(self):
+        """
+        Parse the new fastq files and the reads appended to the files already parsed, add them to the aggregated
+        reads and rewrite the report
+        :return: number of new or grown fastq files parsed
+        """
+        new_files, appended = self.poll_fastq_files()
+        if not new_files and not appended:
+            return 0
+
+        self.input_fastq_list.extend(new_files)
+        self.read_table = ReadStats.concatenate([self.read_table, self.parse_fastq_parallel(new_files, appended)])
+        if len(self.read_table):
+            plots = self.make_plots(self.read_table, NanoQC.FASTQ_PLOTS)
+            logging.info('Writing HTML reports...')
+            self.write_html_report(plots)
+        return len(new_files) + len(appended)
+
+    def watch_fastq_files(self):
+        """
+        Watch the input folder during a run. Only the new fastq files are parsed, and the report is refreshed every
+        interval until interrupted with Ctrl-C.
+        """
+        self.read_table = ReadStats(self.sample_size, self.seed)
+        logging.info('Watching {} for new fastq files every {}...'.format(self.input_folder,
+                                                                          self.elapsed_time(self.interval)))
+        try:
+            while True:
+                start_time = time()
+                n_files = self.refresh()
+                if n_files:
+                    logging.info('Report updated with {} new or grown fastq file(s), {:,} reads in total'.format(
+                        n_files, len(self.read_table)))
+                plt.close('all')
+                sleep(max(self.interval - (time() - start_time), 0))
+        except KeyboardInterrupt:
+            logging.info('Stopped watching {}'.format(self.input_folder))
+
     def hbytes(self, num):
         """
         Convert bytes to KB, MB, GB or TB
@@ -227,48 +1558,25 @@ class NanoQC(object):
         time_string = ''.join('{}{}'.format(int(np.round(value)), name) for name, value in periods if value)
         return time_string
 
-    def optimal_line_number(self, f, cpu):
-        # Determine optimal number of lines in the fastq file to put in a chunk
-        total_lines = 0
-        with open(f, 'rb', 1024 * 1024) as file_handle:  # 1MB buffer
-            while True:
-                buffer = file_handle.read(1024 * 1024)  # 1MB buffer
-                if not buffer:
-                    break
-                total_lines += buffer.count(b'\n')
-
-        # make sure its a multiple of 4
-        optimal = int(round(total_lines / cpu, 0))
-        optimal += optimal % 4
-
-        return optimal
-
-    # Iterator that yields start and end locations of a file chunk of default size 1MB.
-    def chunkify(self, f):
+    # Iterator that yields start and end locations of a file chunk. Chunks always start at a fastq entry.
+    def chunkify(self, f, size=None):
         file_end = os.path.getsize(f)
 
-        # Adjust size of chunks so its equal to number of CPUs
-        size = 1024 * 1024 * 4 # default was 1MB
-        # size = ceil(file_end / self.cpu)
+        # Make a few chunks per CPU so the workers stay busy, but keep them big enough to be worth a task
+        if size is None:
+            size = max(ceil(file_end / (self.cpu * 4)), 1024 * 1024 * 16)
 
-        with open(f, 'rb', size) as file_handle:
+        with open(f, 'rb', 1024 * 1024) as file_handle:
             chunk_end = file_handle.tell()
             while True:
                 chunk_start = chunk_end
                 file_handle.seek(size, 1)
                 self.find_end_of_chunk(file_handle)
-                chunk_end = file_handle.tell()
+                chunk_end = min(file_handle.tell(), file_end)
                 yield chunk_start, chunk_end - chunk_start
                 if chunk_end >= file_end:
                     break
 
-    def make_chunks(self, file_handle, size):
-        while True:
-            chunk = list(islice(file_handle, size))
-            if not chunk:
-                break
-            yield chunk
-
     # read chunk
     def read_chunk(self, f, chunk_info):
         with open(f, 'rb', 1024 * 1024) as file_handle:
@@ -277,13 +1585,101 @@ class NanoQC(object):
 
     # End of chunk
     def find_end_of_chunk(self, file_handle):
-        line = file_handle.readline()  # incomplete line
-        position = file_handle.tell()
-        line = file_handle.readline()
-        while line and b'runid' not in line:  # find the start of sequence
+        """
+        Move the file handle to the start of the next fastq entry.
+        A header line can't be recognized on its own because quality lines can also start with "@".
+        An entry is only accepted when its third line starts with "+" and its sequence and quality have the same
+        length, which works whatever the format of the header.
+        :param file_handle: file opened in binary mode, positioned anywhere in the file
+        :return:
+        """
+        file_handle.readline()  # incomplete line
+        positions = list()
+        lines = list()
+        while True:
             position = file_handle.tell()
             line = file_handle.readline()
-        file_handle.seek(position)  # revert one line
+            if not line:  # end of file
+                return
+            positions.append(position)
+            lines.append(line.rstrip(b'\r\n'))
+            if len(lines) == 4:
+                if lines[0].startswith(b'@') and lines[2].startswith(b'+') and len(lines[1]) == len(lines[3]):
+                    file_handle.seek(positions[0])  # revert to the header
+                    return
+                del positions[0]
+                del lines[0]
+
+    @staticmethod
+    def parse_timestamps(time_strings):
+        """
+        Convert a batch of time stamps to seconds since epoch.
+        The "YYYY-MM-DDTHH:MM:SSZ" format written by MinKNOW and the basecallers is converted with numpy for the whole
+        batch at once, as well as its variants with a fraction of second or a "+HH:MM" offset written by Dorado.
+        The fractions of second are dropped. Any other format falls back to dateutil, one time stamp at the time.
+        Time stamps without a time zone are assumed to be UTC.
+        :param time_strings: list of time stamps as bytes
+        :return: numpy int64 array of seconds since epoch
+        """
+        n = len(time_strings)
+        seconds = np.zeros(n, dtype=np.int64)
+        if n == 0:
+            return seconds
+
+        stamps = np.array(time_strings, dtype=bytes)
+        width = stamps.dtype.itemsize
+        fast = np.zeros(n, dtype=bool)
+        if width >= 20:
+            chars = stamps.view(np.uint8).reshape(n, width)
+            digits = chars[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]].astype(np.int64) - 48  # '0'
+            fast = np.all((digits >= 0) & (digits <= 9), axis=1)
+            fast &= (chars[:, 4] == 45) & (chars[:, 7] == 45)  # '-'
+            fast &= (chars[:, 10] == 84)  # 'T'
+            fast &= (chars[:, 13] == 58) & (chars[:, 16] == 58)  # ':'
+
+            # Time zone after the seconds and their optional fraction: 'Z' or an offset, then nothing
+            zone = np.full(n, 19)
+            if width > 20:
+                is_digit = (chars[:, 20:] >= 48) & (chars[:, 20:] <= 57)
+                n_fraction_digits = np.cumprod(is_digit, axis=1).sum(axis=1)
+                zone = np.where(chars[:, 19] == 46, 20 + n_fraction_digits, 19)  # '.'
+            zone_chars = np.take_along_axis(np.pad(chars, ((0, 0), (0, 7))), zone[:, None] + np.arange(7), axis=1)
+            offset_digits = zone_chars[:, [1, 2, 4, 5]].astype(np.int64) - 48
+            is_utc = (zone_chars[:, 0] == 90) & (zone_chars[:, 1] == 0)  # 'Z'
+            is_offset = ((zone_chars[:, 0] == 43) | (zone_chars[:, 0] == 45)) & (zone_chars[:, 3] == 58)  # '+-' ':'
+            is_offset &= np.all((offset_digits >= 0) & (offset_digits <= 9), axis=1) & (zone_chars[:, 6] == 0)
+            fast &= is_utc | is_offset
+            offset = np.where(is_offset, (offset_digits[:, 0] * 10 + offset_digits[:, 1]) * 3600
+                              + (offset_digits[:, 2] * 10 + offset_digits[:, 3]) * 60, 0)
+            offset = np.where(zone_chars[:, 0] == 45, -offset, offset)
+
+            year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+            month = digits[:, 4] * 10 + digits[:, 5]
+            day = digits[:, 6] * 10 + digits[:, 7]
+            hour = digits[:, 8] * 10 + digits[:, 9]
+            minute = digits[:, 10] * 10 + digits[:, 11]
+            second = digits[:, 12] * 10 + digits[:, 13]
+            fast &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+            fast &= (hour < 24) & (minute < 60) & (second < 61)
+
+            # Days since epoch from the civil date
+            # http://howardhinnant.github.io/date_algorithms.html#days_from_civil
+            year = year - (month <= 2)
+            era = year // 400
+            year_of_era = year - era * 400
+            day_of_year = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+            day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+            days = era * 146097 + day_of_era - 719468
+            seconds = np.where(fast, days * 86400 + hour * 3600 + minute * 60 + second - offset, 0)
+
+        # Unrecognized formats
+        for i in np.flatnonzero(~fast).tolist():
+            time_stamp = parse(time_strings[i])
+            if time_stamp.tzinfo is None:
+                time_stamp = time_stamp.replace(tzinfo=timezone.utc)
+            seconds[i] = int(time_stamp.timestamp() // 1)
+
+        return seconds
 
     def parse_fastq_to_dict(self, l, my_dict, name, flag):
         header, seq, extra, qual = l  # get each component of list in a variable
@@ -291,247 +1687,632 @@ class NanoQC(object):
         # Sequence ID
         seq_id = header.split()[0][1:]
 
-        # Read Time stamp
-        time_string = header.split()[4].split(b'=')[1]
-        time_string = parse(time_string)
+        # Read Time stamp and channel
+        time_string, channel = self.parse_header(header, name)
+        time_string = datetime.fromtimestamp(int(self.parse_timestamps([time_string])[0]), timezone.utc)
 
         # Sequence length
         length = len(seq)
 
         # Average phred score - might be faster to initialize whole list at once rather than appending all the time
         # Looks to be a very minor speedup
-        phred_list = [None] * length
-        for i in range(len(qual)):
-            phred_list[i] = qual[i]
-        # for letter in qual:
-            # phred_list.append(ord(letter))
-            # phred_list.append(letter)
-        # print(phred_list)
-        average_phred = sum(phred_list) / len(phred_list) - 33
+        if self.quality_mode == 'arithmetic':
+            phred_list = [None] * length
+            for i in range(len(qual)):
+                phred_list[i] = qual[i]
+            # for letter in qual:
+                # phred_list.append(ord(letter))
+                # phred_list.append(letter)
+            # print(phred_list)
+            average_phred = sum(phred_list) / len(phred_list) - 33
+        else:
+            average_phred = -10 * np.log10(NanoQC.ERROR_PROBABILITIES[np.frombuffer(qual, dtype=np.uint8)].mean())
 
         # GC percentage
         g_count = float(seq.count(b'G'))
         c_count = float(seq.count(b'C'))
         gc = round((g_count + c_count) / float(length) * 100, 1)
 
-        # Channel
-        channel = header.split()[3].split(b'=')[1]
-
         seq = FastqObjects(name, length, flag, average_phred, gc, time_string, channel)
 
         my_dict[seq_id] = seq
 
-    def parse_fastq_to_dict_islice(self, l, d, name, flag):
-        l = map(str.strip, l)
-        header, seq, extra, qual = l  # get each component of list in a variable
-
-        # Sequence ID
-        seq_id = header.split()[0][1:]
-
-        # Read Time stamp
-        time_string = header.split()[4].split('=')[1]
-        time_string = parse(time_string)
+    @staticmethod
+    def split_header_token(token):
+        """
+        Split a fastq header token in its key and value
+        :param token: "key=value" or "XX:T:value" (SAM tag)
+        :return: tuple of key and value. The key is None if the token is not a field.
+        """
+        if b'=' in token:
+            key, _, value = token.partition(b'=')
+            return key, value
+        if len(token) > 5 and token[2:3] == b':' and token[4:5] == b':':
+            return token[:2], token[5:]
+        return None, token
+
+    def parse_header(self, header, name):
+        """
+        Get the start time and channel of a read from its header, whatever the order of the fields
+        :param header: fastq header line, as bytes
+        :param name: name of the sample
+        :return: tuple of the start time and channel, as bytes
+        """
+        fields = dict(self.split_header_token(token) for token in header.split()[1:])
+        time_string = next((fields[key] for key in NanoQC.TIME_KEYS if key in fields), None)
+        channel = next((fields[key] for key in NanoQC.CHANNEL_KEYS if key in fields), None)
+        if time_string is None or channel is None:
+            raise Exception('No start time or channel found in fastq header of sample "{}": {}'.format(
+                name, header.decode(errors='replace')))
+        return time_string, channel
+
+    def detect_header_format(self, tokens):
+        """
+        Find the position of the start time and channel fields in a split fastq header
+        :param tokens: fastq header split on white spaces
+        :return: tuple of the number of tokens, (position, prefix) of the start time and (position, prefix) of the
+                 channel. None if a field is missing.
+        """
+        time_field = None
+        channel_field = None
+        for i, token in enumerate(tokens[1:], 1):
+            key, value = self.split_header_token(token)
+            prefix = token[:len(token) - len(value)]
+            if key in NanoQC.TIME_KEYS and time_field is None:
+                time_field = (i, prefix)
+            elif key in NanoQC.CHANNEL_KEYS and channel_field is None:
+                channel_field = (i, prefix)
+        if time_field is None or channel_field is None:
+            return None
+        return len(tokens), time_field, channel_field
 
-        # Sequence length
-        length = len(seq)
+    @staticmethod
+    def header_columns(tokens, n_reads, header_format):
+        """
+        Take the start time and channel of every read from the tokens of all the headers of a block, if they all
+        follow the same layout
+        :param tokens: the headers of all the reads, split on white spaces
+        :param n_reads: number of headers
+        :param header_format: as returned by detect_header_format
+        :return: tuple of numpy arrays of the start times and the channels, as bytes. None if any header differs.
+        """
+        n_tokens, (time_index, time_prefix), (channel_index, channel_prefix) = header_format
+        if len(tokens) != n_reads * n_tokens:
+            return None
+
+        columns = list()
+        for index, prefix in [(time_index, time_prefix), (channel_index, channel_prefix)]:
+            column = np.array(tokens[index::n_tokens], dtype=bytes)
+            width = column.dtype.itemsize
+            if width <= len(prefix) or not np.all(np.char.startswith(column, prefix)):
+                return None
+            # Remove the prefix of all the values at once
+            chars = np.ascontiguousarray(column.view(np.uint8).reshape(n_reads, width)[:, len(prefix):])
+            columns.append(chars.view('S{}'.format(width - len(prefix))).ravel())
+        return tuple(columns)
+
+    def parse_headers(self, arr, starts, ends, name):
+        """
+        Get the start time and channel of all the reads of a block.
+        All the headers are split at once. The layout found in the first header is kept and used as long as the
+        following headers match it. Headers that don't match are parsed one at the time.
+        :param arr: numpy array of the bytes of the block
+        :param starts: start positions of the headers, after the '@'
+        :param ends: end positions of the headers
+        :param name: name of the sample
+        :return: tuple of numpy arrays of the start times and the channels, as bytes
+        """
+        n_reads = starts.size
+
+        # Copy all the headers in a single string, keeping the character following each of them as separator
+        lengths = ends + 1 - starts
+        offsets = np.cumsum(lengths) - lengths  # Position of each header in the string
+        positions = np.arange(int(lengths.sum())) + np.repeat(starts - offsets, lengths)
+        tokens = arr[positions].tobytes().split()
+
+        if self.header_format is not None:
+            columns = self.header_columns(tokens, n_reads, self.header_format)
+            if columns is not None:
+                return columns
+
+        header_format = self.detect_header_format(bytes(arr[starts[0]:ends[0]]).split())
+        if header_format is not None:
+            columns = self.header_columns(tokens, n_reads, header_format)
+            if columns is not None:
+                self.header_format = header_format
+                return columns
+
+        # Headers with different layouts
+        fields = [self.parse_header(bytes(arr[starts[i]:ends[i]]), name) for i in range(n_reads)]
+        return (np.array([time_string for time_string, channel in fields], dtype=bytes),
+                np.array([channel for time_string, channel in fields], dtype=bytes))
+
+    def parse_fastq_block(self, buf, tables, name, flag):
+        """
+        Parse all the complete fastq entries of a block of bytes at once.
+        Record boundaries, lengths, average phred scores, GC and header fields are computed over the whole block.
+        :param buf: bytes or memoryview from a fastq file, starting at the beginning of an entry
+        :param tables: list to store the ReadTable of the block, or ReadStats to add it to
+        :param name: name of the sample
+        :param flag: 'pass' or 'fail'
+        :return: number of bytes consumed. The remaining bytes belong to an incomplete entry.
+        """
+        arr = np.frombuffer(buf, dtype=np.uint8)
+
+        # Every entry is 4 lines, so the end of the last complete entry is the (4 * n)th new line
+        newlines = np.flatnonzero(arr == 10)
+        n_reads = newlines.size // 4
+        if n_reads == 0:
+            return 0
+        line_ends = newlines[:n_reads * 4].reshape(n_reads, 4)
+        line_starts = np.empty_like(line_ends)
+        line_starts[0, 0] = 0
+        line_starts[1:, 0] = line_ends[:-1, 3] + 1
+        line_starts[:, 1:] = line_ends[:, :3] + 1
+        consumed = int(line_ends[-1, 3]) + 1
+
+        # Sanity check on the record structure
+        if not (np.all(arr[line_starts[:, 0]] == 64) and np.all(arr[line_starts[:, 2]] == 43)):  # '@' and '+'
+            raise Exception('Malformed fastq entry found in sample "{}"'.format(name))
+
+        # Don't count the carriage returns of Windows line endings
+        line_ends = line_ends - (arr[line_ends - 1] == 13)
+
+        seq_starts = line_starts[:, 1]
+        qual_starts = line_starts[:, 3]
+        lengths = line_ends[:, 1] - seq_starts
+        qual_lengths = line_ends[:, 3] - qual_starts
+
+        # Sum over the [start, end) span of every read. Every other slice of reduceat is the gap between two spans.
+        # Empty spans return the value at their start with reduceat, hence the masking.
+        qual_spans = np.column_stack((qual_starts, line_ends[:, 3])).ravel()
+        average_phreds = self.average_phred_scores(arr, qual_spans, qual_lengths)
+
+        seq_spans = np.column_stack((seq_starts, line_ends[:, 1])).ravel()
+        is_gc = ((arr == 71) | (arr == 67)).view(np.uint8)  # 'G' or 'C'
+        gc_counts = np.add.reduceat(is_gc, seq_spans, dtype=np.int64)[::2] * (lengths > 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gcs = np.where(lengths > 0, np.round(gc_counts / lengths * 100, 1), 0)
+
+        # Time stamp and channel from the headers, skipping the '@'
+        time_strings, channels = self.parse_headers(arr, line_starts[:, 0] + 1, line_ends[:, 0], name)
+        time_stamps = self.parse_timestamps(time_strings)
+        channels = channels.astype(np.uint16)
+
+        tables.append(ReadTable.from_sample(name, flag, lengths, average_phreds, gcs, time_stamps, channels))
+
+        return consumed
+
+    def average_phred_scores(self, arr, qual_spans, qual_lengths):
+        """
+        Average phred score of every read of a block.
+        In 'probability' mode, the quality characters are converted to error probabilities with a lookup table,
+        averaged and converted back to a phred score, like the basecallers do. In 'arithmetic' mode, the quality
+        characters are averaged directly, which overstates the quality of the reads.
+        :param arr: numpy array of the bytes of the block
+        :param qual_spans: interleaved start and end positions of the quality line of every read
+        :param qual_lengths: length of the quality line of every read
+        :return: numpy array of average phred scores
+        """
+        if self.quality_mode == 'arithmetic':
+            qual_sums = np.add.reduceat(arr, qual_spans, dtype=np.int64)[::2] * (qual_lengths > 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(qual_lengths > 0, qual_sums / qual_lengths - 33, 0)
 
-        # Average phred score
-        phred_list = list()
-        for letter in qual:
-            phred_list.append(ord(letter))
-            # phred_list.append(letter)
-        average_phred = sum(phred_list) / len(phred_list) - 33
+        probabilities = NanoQC.ERROR_PROBABILITIES.astype(np.float32)[arr]
+        error_sums = np.add.reduceat(probabilities, qual_spans, dtype=np.float64)[::2] * (qual_lengths > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(qual_lengths > 0, -10 * np.log10(error_sums / qual_lengths), 0)
 
-        # GC percentage
-        g_count = float(seq.count('G'))
-        c_count = float(seq.count('C'))
-        gc = int(round((g_count + c_count) / float(length) * 100))
+    def parse_fastq_blocks(self, file_handle, name, flag, size=1024 * 1024 * 16, length=None):
+        """
+        Read a fastq file by large blocks and parse each of them with self.parse_fastq_block
+        :param file_handle: file opened in binary mode, positioned at the start of a fastq entry
+        :param name: name of the sample
+        :param flag: 'pass' or 'fail'
+        :param size: number of bytes to read at the time
+        :param length: maximum number of bytes to read. Read until the end of the file if None.
+        :return: ReadTable, or ReadStats in streaming mode
+        """
+        tables = ReadStats(self.sample_size, self.seed) if self.streaming else list()
+        leftover = b''
+        while True:
+            if length is not None:
+                if length <= 0:
+                    break
+                data = file_handle.read(min(size, length))
+                length -= len(data)
+            else:
+                data = file_handle.read(size)
+            if not data:
+                break
+            buf = leftover + data if leftover else data
+            consumed = self.parse_fastq_block(buf, tables, name, flag)
+            leftover = buf[consumed:]
 
-        seq = FastqObjects(name, length, flag, average_phred, gc, time_string)
-        d[seq_id] = seq
+        # Last entry may not end with a new line
+        if leftover.strip():
+            if not leftover.endswith(b'\n'):
+                leftover += b'\n'
+            consumed = self.parse_fastq_block(leftover, tables, name, flag)
+            if consumed != len(leftover):
+                raise Exception('Truncated fastq entry found at the end of sample "{}"'.format(name))
 
-    def parse_fastq_to_dict_islice_pool(self, l, name, flag):
-        my_dict = {}
-        l = map(str.strip, l)
-        header, seq, extra, qual = l  # get each component of list in a variable
+        return tables if self.streaming else ReadTable.concatenate(tables)
 
-        # Sequence ID
-        seq_id = header.split()[0][1:]
-
-        # Read Time stamp
-        time_string = header.split()[4].split('=')[1]
-        time_string = parse(time_string)
-
-        # Sequence length
-        length = len(seq)
-
-        # Average phred score
-        phred_list = list()
-        for letter in qual:
-            phred_list.append(ord(letter))
-            # phred_list.append(letter)
-        average_phred = sum(phred_list) / len(phred_list) - 33
-
-        # GC percentage
-        g_count = float(seq.count('G'))
-        c_count = float(seq.count('C'))
-        gc = int(round((g_count + c_count) / float(length) * 100))
-
-        seq = FastqObjects(name, length, flag, average_phred, gc, time_string)
-        my_dict[seq_id] = seq
-
-        return my_dict
-
-    def get_chunk_data(self, f, name, flag, chunk_info):
-        my_dict = {}
-
-        while True:
-            data = self.read_chunk(f, chunk_info)
-            lines = []
-            my_data = data.split(b'\n')
-            data = None
-
-            for line in my_data:
-                if not line:  # end of file?
+    @staticmethod
+    def close_map(mapped, view=None):
+        """
+        Release the view of a memory map and unmap it
+        :param mapped: mmap of a file
+        :param view: memoryview of the mmap, if any
+        """
+        if view is not None:
+            view.release()
+        try:
+            mapped.close()
+        except BufferError:
+            # Arrays of the block being parsed when an exception was raised still point to the map. It is unmapped
+            # when they are freed along with the exception, and the exception is the error worth reporting.
+            pass
+
+    def parse_fastq_mmap(self, f, name, flag, start=0, length=None, size=1024 * 1024 * 16):
+        """
+        Parse an uncompressed fastq file through a memory map. The blocks handed to self.parse_fastq_block are views
+        of the mapped file, so the data is never copied. Workers parsing different chunks of the same file all map the
+        same pages of the page cache.
+        :param f: file path
+        :param name: name of the sample
+        :param flag: 'pass' or 'fail'
+        :param start: position of the first fastq entry to parse
+        :param length: number of bytes to parse. Parse until the end of the file if None.
+        :param size: number of bytes to parse at the time
+        :return: ReadTable, or ReadStats in streaming mode
+        """
+        tables = ReadStats(self.sample_size, self.seed) if self.streaming else list()
+        with open(f, 'rb') as file_handle:
+            file_end = os.fstat(file_handle.fileno()).st_size
+            if file_end == 0:
+                return ReadStats(self.sample_size, self.seed) if self.streaming else ReadTable()
+            mapped = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        end = file_end if length is None else min(start + length, file_end)
+        view = memoryview(mapped)
+        try:
+            block_size = size
+            while start < end:
+                block_end = min(start + block_size, end)
+                consumed = self.parse_fastq_block(view[start:block_end], tables, name, flag)
+                if consumed:
+                    start += consumed
+                    block_size = size
+                elif block_end < end:
+                    block_size *= 2  # Entry bigger than the block
+                else:
                     break
-                line = line.rstrip()
 
-                if lines and b'runid' in line:  # new entry
-                    self.parse_fastq_to_dict(lines, my_dict, name, flag)
-                    lines = []
-                lines.append(line)
-            self.parse_fastq_to_dict(lines, my_dict, name, flag)  # For the last entry
+            # Last entry may not end with a new line
+            leftover = bytes(view[start:end])
+            if leftover.strip():
+                if not leftover.endswith(b'\n'):
+                    leftover += b'\n'
+                consumed = self.parse_fastq_block(leftover, tables, name, flag)
+                if consumed != len(leftover):
+                    raise Exception('Truncated fastq entry found at the end of sample "{}"'.format(name))
+        finally:
+            NanoQC.close_map(mapped, view)
 
-            my_data = None
+        return tables if self.streaming else ReadTable.concatenate(tables)
 
-            return my_dict
+    # Unaligned BAM files
 
-    def get_chunk_data_process(self, f, name, flag, q):
-        my_dict = {}
-        chunk_info = q.get()
+    @staticmethod
+    def bgzf_block_size(data, position):
+        """
+        :param data: BAM file content (mmap)
+        :param position: position of a BGZF block header
+        :return: tuple of the size of the block and of its header, or None if there is no BGZF block at the position
+        """
+        header = data[position:position + 12]
+        if len(header) < 12 or header[:4] != b'\x1f\x8b\x08\x04':  # gzip member with extra fields
+            return None
+        extra_length = struct.unpack_from('<H', header, 10)[0]
+        extra = data[position + 12:position + 12 + extra_length]
+        i = 0
+        while i + 4 <= len(extra):  # Look for the 'BC' subfield holding the block size
+            subfield_length = struct.unpack_from('<H', extra, i + 2)[0]
+            if extra[i:i + 2] == b'BC' and subfield_length == 2 and i + 6 <= len(extra):
+                return struct.unpack_from('<H', extra, i + 4)[0] + 1, 12 + extra_length
+            i += 4 + subfield_length
+        return None
+
+    def find_bgzf_block(self, data, position, file_end):
+        """
+        Find the first BGZF block starting at or after a position. A match of the gzip magic number is only accepted
+        if the next block also starts where the block ends.
+        :return: position of the block, or file_end if there is none
+        """
+        while position < file_end:
+            position = data.find(b'\x1f\x8b\x08\x04', position, file_end)
+            if position < 0:
+                return file_end
+            block = self.bgzf_block_size(data, position)
+            if block is not None:
+                next_position = position + block[0]
+                if next_position == file_end or self.bgzf_block_size(data, next_position) is not None:
+                    return position
+            position += 1
+        return file_end
+
+    def read_bgzf_blocks(self, data, position, file_end):
+        """
+        Decompress BGZF blocks one after the other
+        :param data: BAM file content (mmap)
+        :param position: position of the first block
+        :param file_end: size of the file
+        :return: iterator of tuples of the block position and its decompressed bytes
+        """
+        while position < file_end:
+            block = self.bgzf_block_size(data, position)
+            if block is None:
+                raise Exception('Corrupted BGZF block found at position {}'.format(position))
+            block_size, header_size = block
+            yield position, fast_zlib.decompress(data[position + header_size:position + block_size - 8], -15)
+            position += block_size
 
-        while True:
-            data = self.read_chunk(f, chunk_info)
-            lines = []
-            my_data = data.split(b'\n')
-            data = None
+    @staticmethod
+    def bam_header_size(buf):
+        """
+        :param buf: decompressed bytes of the start of a BAM file
+        :return: size of the BAM header, or None if buf doesn't hold all of it
+        """
+        if len(buf) < 12:
+            return None
+        if buf[:4] != b'BAM\x01':
+            raise Exception('Not a BAM file')
+        position = 8 + struct.unpack_from('<i', buf, 4)[0]  # Header text
+        if position + 4 > len(buf):
+            return None
+        n_references = struct.unpack_from('<i', buf, position)[0]
+        position += 4
+        for _ in range(n_references):
+            if position + 4 > len(buf):
+                return None
+            position += 4 + struct.unpack_from('<i', buf, position)[0] + 4  # Name and length
+        return position if position <= len(buf) else None
 
-            for line in my_data:
-                if not line:  # end of file?
+    @staticmethod
+    def is_bam_record(buf, position):
+        """
+        Check if the fixed fields of a BAM record at a position are consistent
+        :return: True, False, or None if buf is too short to tell
+        """
+        if position + 36 > len(buf):
+            return None
+        block_size, reference, read_position, name_length = struct.unpack_from('<iiiB', buf, position)
+        n_cigar_op, bam_flag, sequence_length, mate_reference = struct.unpack_from('<HHii', buf, position + 16)
+        if reference < -1 or read_position < -1 or mate_reference < -1 or name_length < 2 or sequence_length < 0:
+            return False
+        if 32 + name_length + 4 * n_cigar_op + (sequence_length + 1) // 2 + sequence_length > block_size:
+            return False
+        if position + 36 + name_length > len(buf):
+            return None
+        read_name = buf[position + 36:position + 36 + name_length]
+        return read_name[-1] == 0 and all(33 <= c <= 126 for c in read_name[:-1])
+
+    def find_bam_record(self, buf, position, end):
+        """
+        Find the first BAM record starting at or after a position. BAM records have no separator, so a position is
+        only accepted when the records chained from it (up to 4) are all consistent.
+        :param buf: decompressed bytes
+        :param end: last position to try
+        :return: position of the record, or None if there is none before end
+        """
+        for candidate in range(position, min(end, len(buf))):
+            record = candidate
+            checked = 0
+            for _ in range(4):
+                valid = self.is_bam_record(buf, record)
+                if not valid:
                     break
-                line = line.rstrip()
-
-                if lines and b'runid' in line:  # new entry
-                    self.parse_fastq_to_dict(lines, my_dict, name, flag)
-                    lines = []
-                lines.append(line)
-            self.parse_fastq_to_dict(lines, my_dict, name, flag)  # For the last entry
-
-            my_data = None
-
-            return my_dict
-
-    def get_chunk_data_queue(self, f, name, flag, q):
-        my_dict = {}
+                checked += 1
+                record += 4 + struct.unpack_from('<i', buf, record)[0]
+            # The chain may stop at the end of buf
+            if valid is not False and checked:
+                return candidate
+        return None
+
+    def bam_tags(self, buf, tag_starts, record_ends, pattern):
+        """
+        Find a tag in the optional fields of every BAM record of a block. The tags are found in the whole block at
+        once with a regular expression. The records where the tag is missing or appears more than once (the bytes
+        of another tag may look like a tag) are walked field by field.
+        :param buf: decompressed bytes
+        :param tag_starts: numpy array of the position of the optional fields of every record
+        :param record_ends: numpy array of the end of every record
+        :param pattern: compiled regular expression of the tag, from the class constants
+        :return: list of the match of every record, or None if the record has no such tag
+        """
+        matches = [None] * tag_starts.size
+        found = list(pattern.finditer(buf, int(tag_starts[0]), int(record_ends[-1])))
+        records = np.searchsorted(tag_starts, [m.start() for m in found], side='right') - 1
+        counts = np.bincount(records, minlength=tag_starts.size)
+        for m, record in zip(found, records.tolist()):
+            if m.start() < record_ends[record]:
+                matches[record] = m
+        for record in np.flatnonzero(counts != 1).tolist():
+            matches[record] = self.walk_bam_tags(buf, int(tag_starts[record]), int(record_ends[record]), pattern)
+        return matches
 
-        while True:
-            chunk_info = q.get()
-            if chunk_info is None:
-                break
-            # print(f, chunk_info)  # debug
-            data = self.read_chunk(f, chunk_info)
-            lines = []
-            my_data = data.split(b'\n')
-            data = None
-
-            for line in my_data:
-                if not line:  # end of file?
-                    break
-                line = line.rstrip()
+    @staticmethod
+    def walk_bam_tags(buf, position, end, pattern):
+        """
+        Find a tag by reading the optional fields of a BAM record one at the time
+        :return: match of the tag, or None
+        """
+        sizes = {b'A': 1, b'c': 1, b'C': 1, b's': 2, b'S': 2, b'i': 4, b'I': 4, b'f': 4}
+        while position + 3 <= end:
+            match = pattern.match(buf, position, end)
+            if match is not None:
+                return match
+            value_type = buf[position + 2:position + 3]
+            if value_type in sizes:
+                position += 3 + sizes[value_type]
+            elif value_type in (b'Z', b'H'):
+                position = buf.index(b'\x00', position + 3, end) + 1
+            elif value_type == b'B':
+                element_type, count = struct.unpack_from('<ci', buf, position + 3)
+                position += 8 + sizes[element_type] * count
+            else:
+                raise Exception('Unknown BAM tag type {}'.format(value_type))
+        return None
 
-                if lines and b'runid' in line:  # new entry
-                    self.parse_fastq_to_dict(lines, my_dict, name, flag)
-                    lines = []
-                lines.append(line)
-            self.parse_fastq_to_dict(lines, my_dict, name, flag)  # For the last entry
+    def parse_bam_records(self, buf, offsets, tables, name, flag):
+        """
+        Compute the metrics of a batch of BAM records at once, from the binary fields, with numpy
+        :param buf: decompressed bytes
+        :param offsets: numpy array of the position of every record in buf
+        :param tables: list to store the ReadTable of the batch, or ReadStats to add it to
+        :param name: name of the sample
+        :param flag: 'pass' or 'fail'
+        """
+        arr = np.frombuffer(buf, dtype=np.uint8)
 
-            my_data = None
+        def field(position, dtype):
+            size = np.dtype(dtype).itemsize
+            return arr[position[:, None] + np.arange(size)].copy().view(dtype).ravel()
 
-            self.sample_dict.update(my_dict)
-            q.task_done()
+        # Skip the secondary and supplementary alignments of aligned BAM files, their read is already counted
+        offsets = offsets[(field(offsets + 18, '<u2') & 0x900) == 0]
+        if not offsets.size:
+            return
 
-    def get_chunk_data_map(self, f, name, flag, chunk_info):
-        my_dict = {}
+        record_ends = offsets + 4 + field(offsets, '<i4')
+        name_lengths = arr[offsets + 12].astype(np.int64)
+        n_cigar_ops = field(offsets + 16, '<u2').astype(np.int64)
+        lengths = field(offsets + 20, '<i4').astype(np.int64)
+        seq_starts = offsets + 36 + name_lengths + 4 * n_cigar_ops
+        qual_starts = seq_starts + (lengths + 1) // 2
+        tag_starts = qual_starts + lengths
+
+        # The qualities are phred scores, not characters
+        qual_spans = np.column_stack((qual_starts, tag_starts)).ravel()
+        average_phreds = self.average_phred_scores(arr + np.uint8(33), qual_spans, lengths)
+
+        seq_spans = np.column_stack((seq_starts, qual_starts)).ravel()
+        gc_counts = np.add.reduceat(NanoQC.BAM_GC_COUNTS[arr], seq_spans, dtype=np.int64)[::2] * (lengths > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gcs = np.where(lengths > 0, np.round(gc_counts / lengths * 100, 1), 0)
+
+        # Start time and channel tags
+        time_strings = list()
+        channels = np.zeros(offsets.size, dtype=np.uint16)
+        time_tags = self.bam_tags(buf, tag_starts, record_ends, NanoQC.BAM_TIME_TAG)
+        channel_tags = self.bam_tags(buf, tag_starts, record_ends, NanoQC.BAM_CHANNEL_TAG)
+        for i, (time_tag, channel_tag) in enumerate(zip(time_tags, channel_tags)):
+            if time_tag is None or channel_tag is None:
+                read_name = bytes(buf[offsets[i] + 36:offsets[i] + 35 + name_lengths[i]]).decode()
+                raise Exception('No "st" or "ch" tag found for read {} of sample "{}"'.format(read_name, name))
+            time_strings.append(time_tag.group(1))
+            channels[i] = struct.unpack_from(NanoQC.BAM_INTEGER_TYPES[channel_tag.group(1)], buf, channel_tag.end())[0]
+        time_stamps = self.parse_timestamps(time_strings)
+
+        tables.append(ReadTable.from_sample(name, flag, lengths, average_phreds, gcs, time_stamps, channels))
+
+    def parse_bam(self, f, name, flag, start=0, length=None, size=1024 * 1024 * 16):
+        """
+        Parse an unaligned BAM file, or the BGZF blocks starting in a byte range of it.
+        A worker parses the records starting in the blocks of its range, and decompresses the next blocks if its last
+        record doesn't end in its range. As the ranges don't start at a record, the first record of a range is found
+        by checking the consistency of the records.
+        :param f: file path
+        :param name: name of the sample
+        :param flag: 'pass' or 'fail'
+        :param start: start of the byte range
+        :param length: length of the byte range. Parse the whole file if None.
+        :param size: number of decompressed bytes to parse at the time
+        :return: ReadTable, or ReadStats in streaming mode
+        """
+        tables = ReadStats(self.sample_size, self.seed) if self.streaming else list()
+        with open(f, 'rb') as file_handle:
+            file_end = os.fstat(file_handle.fileno()).st_size
+            if file_end == 0:
+                return tables if self.streaming else ReadTable()
+            mapped = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        end = file_end if length is None else min(start + length, file_end)
+        try:
+            first_block = 0 if start == 0 else self.find_bgzf_block(mapped, start, file_end)
+
+            buf = b''
+            owned = 0  # Bytes of buf decompressed from the blocks of the range. Records starting after are not ours.
+            past_end = False  # All the blocks of the range are decompressed
+            position = None  # Position of the next record in buf, once found
+            blocks = self.read_bgzf_blocks(mapped, first_block, file_end)
+            while True:
+                # Decompress enough blocks. Past the range, only as many as needed to complete the last record.
+                data = list()
+                data_size = len(buf)
+                exhausted = True
+                for block_start, block in blocks:
+                    data.append(block)
+                    data_size += len(block)
+                    if block_start < end:
+                        owned = data_size
+                    else:
+                        past_end = True
+                    if data_size - len(buf) >= size or past_end:
+                        exhausted = False
+                        break
+                past_end = past_end or exhausted
+                buf = buf + b''.join(data)
 
-        while True:
-            data = self.read_chunk(f, chunk_info)
-            lines = []
-            my_data = data.split(b'\n')
-            data = None
+                # Find the first record
+                if position is None:
+                    if first_block == 0:
+                        position = self.bam_header_size(buf)
+                    else:
+                        position = self.find_bam_record(buf, 0, owned)
+                    if position is None:
+                        if exhausted and first_block == 0:
+                            raise Exception('Truncated BAM header found in sample "{}"'.format(name))
+                        if past_end:
+                            break  # No record starts in the range
+                        continue
+
+                # Complete records starting in the range
+                offsets = list()
+                while position < owned and position + 4 <= len(buf):
+                    record_end = position + 4 + struct.unpack_from('<i', buf, position)[0]
+                    if record_end > len(buf):
+                        break
+                    offsets.append(position)
+                    position = record_end
+                if offsets:
+                    self.parse_bam_records(buf, np.array(offsets, dtype=np.int64), tables, name, flag)
 
-            for line in my_data:
-                if not line:  # end of file?
+                if position >= owned and past_end:
                     break
-                line = line.rstrip()
-
-                if lines and b'runid' in line:  # new entry
-                    self.parse_fastq_to_dict(lines, my_dict, name, flag)
-                    lines = []
-                lines.append(line)
-            self.parse_fastq_to_dict(lines, my_dict, name, flag)  # For the last entry
-
-            my_data = None
+                if exhausted:
+                    raise Exception('Truncated BAM record found at the end of sample "{}"'.format(name))
+                buf = buf[position:]
+                owned -= position
+                position = 0
+        finally:
+            NanoQC.close_map(mapped)
 
-            return my_dict
+        return tables if self.streaming else ReadTable.concatenate(tables)
 
-    def get_chunk_data_new(self, f, chunk_info, chunk_data):
-        data = self.read_chunk(f, chunk_info)
-        chunk_data.append(data.split(b'\n'))
-
-        return chunk_data
-
-    def process_chunk(self, name, flag, chunk):
+    def get_chunk_data(self, f, name, flag, chunk_info):
         """
-        Put a fastq entry in a list and send it to self.parse_fastq_to_dict
+        Parse a chunk of an uncompressed fastq file
         :param f: file path
-        :param name: name of the file, typically 'barcodeXX'
+        :param name: name of the sample
         :param flag: 'pass' or 'fail'
-        :param chunk: a tuple containing a multiple of 4 lines
-        :return: dictioanry with relevant information
+        :param chunk_info: tuple of the start position and the size of the chunk, as yielded by self.chunkify
+        :return: ReadTable of the chunk, or ReadStats in streaming mode
         """
-        my_dict = {}
-
-        while True:
-            lines = []
-            for line in chunk:
-                if not line:  # end of file?
-                    continue
-                line = line.rstrip()
-
-                # if lines and b'runid' in line:  # new entry -> specific to nanopore
-                if len(lines) == 4:
-                    self.parse_fastq_to_dict(lines, my_dict, name, flag)
-                    lines = []
-                lines.append(line)
-            self.parse_fastq_to_dict(lines, my_dict, name, flag)  # For the last entry
-
-            return my_dict
-
-    def process_chunk_new(self, chunk, name, flag):
-        lines = []
-        my_dict = {}
-        for line in chunk:
-            if not line:  # end of file?
-                break
-            line = line.rstrip()
-
-            if lines and b'runid' in line:  # new entry
-                self.parse_fastq_to_dict(lines, my_dict, name, flag)
-                lines = []
-            lines.append(line)
-        self.parse_fastq_to_dict(lines, my_dict, name, flag)  # For the last entry
-
-        return my_dict
+        return self.parse_fastq_mmap(f, name, flag, start=chunk_info[0], length=chunk_info[1])
 
     def parse_fastq(self, l, d):
         """
@@ -549,29 +2330,12 @@ class NanoQC(object):
             name = os.path.basename(f).split('.')[0].split('_')[0]  # basename before 1st "_" -> sample name
             # name = file.name.split('/')[-2]  # Parent folder name
 
-            filename = os.path.basename(f)
-            filename_no_gz = '.'.join(filename.split('.')[:-1])
-            gz_flag = 0
-
             start_time = time()
-            if f.endswith('.fastq.gz'):
-                print("Decompressing {} to '/tmp'".format(os.path.basename(f)))
-                p1 = subprocess.Popen(['pigz', '-d', '-k', '-f', '-c', f], stdout=subprocess.PIPE)
-                (outs, errs) = p1.communicate()
-                with open('/tmp/' + filename_no_gz, 'b+w', 1024 * 1024) as tmp_file:
-                    tmp_file.write(outs)
-                f = "/tmp/" + filename_no_gz
-                gz_flag = 1
-            if f.endswith(".fastq"):
-                pass
-            else:
+            if not f.endswith(('.fastq', '.fastq.gz')):
                 raise Exception('Wrong file extension. Please use ".fastq" or ".fastq.gz"')
 
             # get some stats about the input file
-            if gz_flag == 1:
-                stat_info = os.stat('/tmp/' + filename_no_gz)
-            else:
-                stat_info = os.stat(f)
+            stat_info = os.stat(f)
 
             file_size = self.hbytes(stat_info.st_size)
 
@@ -587,221 +2351,13 @@ class NanoQC(object):
                 print("Parsing sample \"%s\" from \"%s\" folder (%s). Assuming \"pass\" reads..."
                       % (name, flag, file_size), end="", flush=True)
 
-            ####################################
-            # Multiprocessing -> pool.apply_async
-
-            # pool = mp.Pool(self.cpu)
-            # # # lines_per_chunk = self.optimal_line_number(f, self.cpu)
-            # lines_per_chunk = 4
-            # #
-            # jobs = []
-            # with open(f, 'rb', 1024 * 1024) as file_handle:
-            #     # for chunk in self.make_chunks(file_handle, 40):
-            #     #     job = pool.apply_async(self.process_chunk, args=(name, flag, chunk))
-            #     #     jobs.append(job)
-            #     for chunk in zip_longest(*[file_handle] * lines_per_chunk, fillvalue=None):
-            #         job = pool.apply_async(self.process_chunk, args=(name, flag, chunk))
-            #         jobs.append(job)
-            # #     for chunk_info in self.chunkify(f):
-            # #         job = pool.apply_async(self.get_chunk_data, args=(f, name, flag, chunk_info))
-            # #         jobs.append(job)
-            # # # with open(f, 'rb', 1024 * 1024) as file_handle:
-            # # #     for chunk in self.make_chunks(file_handle, lines_per_chunk):
-            # # #         job = pool.apply_async(self.process_chunk, args=(name, flag, chunk))
-            # # #         jobs.append(job)
-            # #
-            # output = []
-            # for job in jobs:
-            #     output.append(job.get())
-            #
-            # jobs.clear()
-            #
-            # pool.close()
-            # pool.join()
-            #
-            # # Update self.sample_dict with results from every chunk
-            # reads = 0
-            # for dictionary in output:
-            #     # Count number of reads in the sample
-            #     reads += len(dictionary)
-            #     d.update(dictionary)  # Do the merge
-            #
-            # output.clear()
-            #########################################
-
-            ####################################
-            # Multiprocessing -> pool.map
-
-            # pool = mp.Pool(self.cpu)
-            # # pool = mp.Pool(4)
-            #
-            # chunk_info_list = []
-            # for chunk_info in self.chunkify(f):
-            #     chunk_info_list.append(chunk_info)
-            # func = partial(self.get_chunk_data, f, name, flag)
-            # results = pool.map_async(func, chunk_info_list)
-            # # results = pool.starmap_async(func, chunk_info_list)
-            #
-            # pool.close()
-            # pool.join()
-            # # pool.terminate()  # Needed to do proper garbage collection?
-            #
-            # # Update self.sample_dict with results from every chunk
-            # reads = 0
-            # for dictionary in results.get():
-            #     # Count number of reads in the sample
-            #     reads += len(dictionary)
-            #     d.update(dictionary)  # Do the merge
-            #########################################
-
-            #########################################
-            # Process
-            # q = mp.Queue()
-            # jobs = []
-            # for i in range(self.cpu):
-            #     p = mp.Process(target=self.get_chunk_data_process, args=(f, name, flag, q,))
-            #     jobs.append(p)
-            #     p.start()
-            #
-            # for chunk_info in self.chunkify(f):
-            #     q.put(chunk_info)
-            #
-            # for proc in jobs:
-            #     proc.join()
-            #
-            # # Update self.sample_dict with results from every chunk
-            # reads = 0
-            # for dictionary in return_dict.values():
-            #     # Count number of reads in the sample
-            #     reads += len(dictionary)
-            #     d.update(dictionary)  # Do the merge
-            #########################################
-
-            #########################################
-            # asyncio
-            import asyncio
-
-
-            #########################################
-
-            #########################################
-            # islice
-            # pool = mp.Pool(self.cpu)
-            # # lines_per_chunk = self.optimal_line_number(f, self.cpu)
-            # lines_per_chunk = 40
-            #
-            # jobs = []
-            # with open(f, 'rb') as file_handle:
-            #     for chunk in zip_longest(*[file_handle] * lines_per_chunk, fillvalue=None):
-            #         job = pool.apply_async(self.process_chunk, args=(name, flag, chunk))
-            #         jobs.append(job)
-            #
-            # output = []
-            # for job in jobs:
-            #     output.append(job.get())
-            #
-            # jobs.clear()
-            #
-            # pool.close()
-            # pool.join()
-            #
-            # # Update self.sample_dict with results from every chunk
-            # reads = 0
-            # for dictionary in output:
-            #     # Count number of reads in the sample
-            #     reads += len(dictionary)
-            #     d.update(dictionary)  # Do the merge
-            #
-            # output.clear()
-            #########################################
-
-            #########################################
-            # pool = mp.Pool(self.cpu)
-            # # lines_per_chunk = self.optimal_line_number(f, self.cpu)
-            # lines_per_chunk = 40
-            #
-            # chunk_list = []
-            # with open(f, 'rb') as file_handle:
-            #     for chunk in zip_longest(*[file_handle] * lines_per_chunk, fillvalue=None):
-            #         chunk_list.append(chunk)
-            #
-            # results = []
-            #
-            # func = partial(self.process_chunk, name, flag)
-            # results = pool.map_async(func, chunk_list, chunksize=1)
-            # # results = pool.map(func, chunk_list)
-            #
-            # pool.close()
-            # pool.join()
-            #
-            # # Update self.sample_dict with results from every chunk
-            # reads = 0
-            # for dictionary in results.get():
-            #     # Count number of reads in the sample
-            #     reads += len(dictionary)
-            #     d.update(dictionary)  # Do the merge
-            #########################################
-
-            #########################################
-            # put chunk in list
-            # pool = mp.Pool(self.cpu)
-            #
-            # chunk_data = []
-            # for c in self.chunkify(f):
-            #     self.get_chunk_data_new(f, c, chunk_data)
-            #
-            # jobs = []
-            # for chunk in chunk_data:
-            #     job = pool.apply_async(self.process_chunk_new, args=(chunk, name, flag,))
-            #     jobs.append(job)
-            #
-            # output = []
-            # for job in jobs:
-            #     output.append(job.get())
-            #
-            # pool.close()
-            # pool.join()
-            #
-            # # Merge dictionary
-            # reads = 0
-            # # print("Merging processes outputs")
-            # for dictionary in output:
-            #     # Count number of reads in the sample
-            #     reads += len(dictionary)
-            #     d.update(dictionary)  # Do the merge
-
-            #########################################
-
-            #########################################
-            # Threading approach
-
-            # # Setup some threads
-            # threads = []
-            # for i in range(self.cpu):
-            #     t = threading.Thread(target=self.get_chunk_data_queue, args=(f, name, flag, self.my_queue))
-            #     t.setDaemon(True)
-            #     t.start()
-            #     threads.append(t)
-            #
-            # # Feed the threads
-            # for chunk_info in self.chunkify(f):
-            #     self.my_queue.put(chunk_info)
-            #
-            # # Wait for queue to be empty
-            # self.my_queue.join()
-            #
-            # #Stop the workers
-            # for i in range(self.cpu):
-            #     self.my_queue.put(None)
-            # for t in threads:
-            #     t.join()
-            #########################################
-
             #########################################
             # Line by line approach
 
             reads = 0
-            with open(f, 'rb', 1024 * 1024) as file_handle:
+            # Compressed files are decompressed on the fly
+            with io.BufferedReader(GzipStream(f), 1024 * 1024) if f.endswith('.gz') \
+                    else open(f, 'rb', 1024 * 1024) as file_handle:
                 lines = []
                 for line in file_handle:
                     if not line:  # end of file?
@@ -816,76 +2372,142 @@ class NanoQC(object):
                 self.parse_fastq_to_dict(lines, d, name, flag)
             #########################################
 
-            #########################################
-            # linear with chunks
-            # results = []
-            # for chunk_info in self.chunkify(f):
-            #     res = self.get_chunk_data(f, name, flag, chunk_info)
-            #     results.append(res)
-            #
-            # # Update self.sample_dict with results from every chunk
-            # reads = 0
-            # for dictionary in results:
-            #     # Count number of reads in the sample
-            #     reads += len(dictionary)
-            #     d.update(dictionary)  # Do the merge
-            #########################################
-
-            #########################################
-            # Serial, 4 lines at the time
-            # n_lines = 4
-            # with open(f, 'r') as file_handle:
-            #     for chunk in zip_longest(*[iter(file_handle)] * n_lines, fillvalue=None):
-            #         self.parse_fastq_to_dict_islice(chunk, d, name, flag)
-            #
-            # reads = len(d.keys())
-            #########################################
-
             end_time = time()
             interval = end_time - start_time
             print("took {} ({} reads)".format(self.elapsed_time(interval), reads))
 
-            #  Remove tmp file
-            if gz_flag == 1:
-                os.remove('/tmp/' + filename_no_gz)
-
-    def parse_file(self, f):
+    def get_name_and_flag(self, f):
+        """
+        Get the sample name and the pass/fail flag of a fastq file from its path
+        :param f: file path
+        :return: tuple of the sample name and flag
+        """
         name = os.path.basename(f).split('.')[0].split('_')[0]  # basename before 1st "_" -> sample name
 
-        # get some stats about the input file
-        stat_info = os.stat(f)
-        file_size = self.hbytes(stat_info.st_size)
-
         flag = 'pass'  # Default value
         if 'fail' in f:
             flag = 'fail'  # Check in path for the word "fail"
 
+        return name, flag
+
+    def parse_file(self, f):
+        name, flag = self.get_name_and_flag(f)
+
         # Parse
-        my_dict = {}
-        with gzip.open(f, 'rb', 1024 * 1024) if f.endswith('gz') else open(f, 'rb', 1024 * 1024) as file_handle:
-            lines = []
-            for line in file_handle:
-                if not line:  # end of file?
-                    break
-                line = line.rstrip()
-                if len(lines) == 4:
-                    self.parse_fastq_to_dict(lines, my_dict, name, flag)
-                    lines = []
-                lines.append(line)
-            self.parse_fastq_to_dict(lines, my_dict, name, flag)
+        if f.endswith('.bam'):
+            return self.parse_bam(f, name, flag)
+        if not f.endswith('gz'):
+            return self.parse_fastq_mmap(f, name, flag)
+        with GzipStream(f) as file_handle:
+            return self.parse_fastq_blocks(file_handle, name, flag)
+
+    def plan_tasks(self, l, min_size=1024 * 1024 * 16):
+        """
+        Split the parsing of the fastq files in tasks of similar sizes for the pool of workers.
+        Files bigger than the task size are split in byte ranges (gzipped files can't be split and make a task on
+        their own). Smaller files are grouped together. The tasks are sorted largest first, so no worker is left
+        with a big task at the end while the others are idle.
+        With the cache, the files are split in ranges of min_size instead, so a file gets the same ranges, and the
+        same cache keys, whatever the number of threads and the other files parsed.
+        :param l: A list of fastq files
+        :param min_size: minimum size of a task, in bytes
+        :return: list of tasks. A task is a list of (file, start, length) tuples; length is None for whole files.
+        """
+        # Gzipped and BAM files take about 3 times longer to parse than their size suggests, because of the
+        # decompression
+        costs = {f: os.path.getsize(f) * (3 if f.endswith(('.gz', '.bam')) else 1) for f in l}
+        task_size = max(ceil(sum(costs.values()) / (self.cpu * 4)), min_size)
+        split_size = min_size if self.cache is not None else task_size
+
+        tasks = list()  # (cost, task)
+        batch = list()
+        batch_cost = 0
+        for f in sorted(l, key=lambda x: costs[x], reverse=True):
+            if costs[f] > split_size and f.endswith('.bam'):
+                # The workers find the BGZF blocks and the BAM records of any byte range
+                size = ceil(split_size / 3)
+                for start in range(0, os.path.getsize(f), size):
+                    tasks.append((size * 3, [(f, start, size)]))
+            elif costs[f] > split_size and not f.endswith('.gz'):
+                for start, length in self.chunkify(f, size=split_size):
+                    tasks.append((length, [(f, start, length)]))
+            elif costs[f] >= task_size:
+                tasks.append((costs[f], [(f, 0, None)]))
+            else:
+                batch.append((f, 0, None))
+                batch_cost += costs[f]
+                if batch_cost >= task_size:
+                    tasks.append((batch_cost, batch))
+                    batch = list()
+                    batch_cost = 0
+        if batch:
+            tasks.append((batch_cost, batch))
+
+        tasks.sort(key=lambda x: x[0], reverse=True)
+        return [task for cost, task in tasks]
+
+    def parse_task(self, task):
+        """
+        Parse the files and byte ranges of a task made by self.plan_tasks
+        :param task: list of (file, start, length) tuples
+        :return: ReadTable, or ReadStats in streaming mode
+        """
+        tables = list()
+        for f, start, length in task:
+            tables.append(self.parse_range(f, start, length))
+        return (ReadStats if self.streaming else ReadTable).concatenate(tables)
 
-        return my_dict
+    def parse_range(self, f, start, length):
+        """
+        Parse a fastq file or a byte range of it, or load the result from the cache when the file didn't change
+        :param f: fastq file
+        :param start: position of the first fastq entry to parse
+        :param length: number of bytes to parse. The whole file if None.
+        :return: ReadTable, or ReadStats in streaming mode
+        """
+        if self.cache is not None:
+            key = self.cache.key(f, start, length, (NanoQC.PARSER_VERSION, self.quality_mode, self.streaming,
+                                                    self.sample_size, self.seed))
+            cached = self.cache.load(key, ReadStats if self.streaming else ReadTable)
+            if cached is not None:
+                return cached
+
+        if length is None:
+            result = self.parse_file(f)
+        elif f.endswith('.bam'):
+            name, flag = self.get_name_and_flag(f)
+            result = self.parse_bam(f, name, flag, start=start, length=length)
+        elif f.endswith('.gz'):
+            # Gzip members appended to a file already parsed, in watch mode
+            name, flag = self.get_name_and_flag(f)
+            members = self.read_chunk(f, (start, length))
+            with GzipStream(f, opener=lambda path, mode: fast_gzip.open(io.BytesIO(members), mode)) as file_handle:
+                result = self.parse_fastq_blocks(file_handle, name, flag)
+        else:
+            name, flag = self.get_name_and_flag(f)
+            result = self.get_chunk_data(f, name, flag, (start, length))
+
+        if self.cache is not None:
+            self.cache.save(key, result)
+        return result
 
-    def parse_fastq_parallel(self, l, d):
+    def parse_fastq_parallel(self, l, ranges=()):
+        """
+        Parse the fastq files with a pool of workers
+        :param l: A list of fastq files
+        :param ranges: list of (file, start, length) byte ranges to parse too, one task each. In watch mode, the reads
+                       appended to the files already parsed.
+        :return: ReadTable with all the reads, or ReadStats in streaming mode
+        """
         print("Parsing fastq files...", end="", flush=True)
         start_time = time()
 
-        # Parse the files in parallel
+        # Parse the files in parallel, largest tasks first
         pool = mp.Pool(self.cpu)
 
         jobs = []
-        for f in l:
-            job = pool.apply_async(self.parse_file, [f])
+        for task in self.plan_tasks(l) + [[r] for r in ranges]:
+            job = pool.apply_async(self.parse_task, [task])
             jobs.append(job)
 
         results = []
@@ -896,268 +2518,208 @@ class NanoQC(object):
         pool.join()
         # pool.terminate()  # Needed to do proper garbage collection?
 
-        # Update self.sample_dict with results from every chunk
-        read_counter = 0
-        for dictionary in results:
-            read_counter += len(dictionary.keys())
-            d.update(dictionary)  # Do the merge
-
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s for %d reads" % (self.elapsed_time(interval), read_counter))
-
-    # Fastq plots
-
-    def make_fastq_plots(self, d):
-
-        plots = list()
-        print("\nMaking plots:")
-
-        print('\tPlotting total_reads_vs_time...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_total_reads_vs_time(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting total_bp_vs_time...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_total_bp_vs_time(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting reads_vs_bp_per_sample...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_reads_vs_bp_per_sample(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting reads_per_sample_vs_time...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_reads_per_sample_vs_time(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting bp_per_sample_vs_time...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_bp_per_sample_vs_time(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting phred_score_distribution...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_phred_score_distribution(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting length_distribution...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_length_distribution(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        # print('\tPlotting pores_output_vs_time_total...', end="", flush=True)
-        # start_time = time()
-        # self.plot_pores_output_vs_time_total(d)
-        # end_time = time()
-        # interval = end_time - start_time
-        # print(" took %s" % self.elapsed_time(interval))
+        # Merge the results from every chunk
+        table = (ReadStats if self.streaming else ReadTable).concatenate(results)
 
-        print('\tPlotting pores_output_vs_time_all...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_pores_output_vs_time_all(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
+        # Keep the cache under its maximum size
+        if self.cache is not None:
+            self.cache.evict()
 
-        print('\tPlotting quality_vs_time...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_quality_vs_time(d))
         end_time = time()
         interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
+        print(" took %s for %d reads" % (self.elapsed_time(interval), len(table)))
 
-        # print('\tPlotting quality_vs_length_scatter...', end="", flush=True)
-        # start_time = time()
-        # self.plot_quality_vs_length_scatter(d)
-        # end_time = time()
-        # interval = end_time - start_time
-        # print(" took %s" % self.elapsed_time(interval))
+        return table
 
-        print('\tPlotting quality_vs_length_hex...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_quality_vs_length_hex(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        # print('\tPlotting quality_vs_length_kde...', end="", flush=True)
-        # start_time = time()
-        # self.plot_quality_vs_length_kde(d)
-        # # self.test_plot(d)
-        # end_time = time()
-        # interval = end_time - start_time
-        # print(" took %s" % self.elapsed_time(interval))
+    # Plots
 
-        print('\tPlotting channel_output_all...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_channel_output_all(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
+    def make_dataframe(self, t, columns):
+        """
+        Make a pandas dataframe from columns of a ReadTable, with a 'flag' column added at the end
+        :param t: ReadTable
+        :param columns: ordered dictionary of column names and numpy arrays
+        :return: pandas dataframe
+        """
+        df = pd.DataFrame(columns)
+        df['flag'] = t.decoded_flags()
+        return df
 
-        print('\tPlotting gc_vs_time...', end="", flush=True)
+    def make_plots(self, t, names):
+        """
+        Draw the plots. They all take their data from the plot methods of the table, whatever the input. The inputs
+        of the plots drawn from a ReadTable are planned and computed together first.
+        The plots are drawn in parallel by a pool of workers. Each worker only gets the inputs of its plot.
+        :param t: ReadTable or ReadStats, from the fastq files or from the summary file
+        :param names: names of the plots, from NanoQC.FASTQ_PLOTS or NanoQC.SUMMARY_PLOTS
+        :return: list of the plots, in the order of names, for the HTML report
+        """
+        print("\nMaking plots:")
         start_time = time()
-        plots.append(self.plot_gc_vs_time(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
+        if isinstance(t, ReadTable):
+            t = PlotInputs(t, set(need for name in names for need in NanoQC.PLOT_INPUTS.get(name, ())),
+                           self.sample_size, self.seed)
+        inputs = [t.select(NanoQC.PLOT_INPUTS.get(name, ())) for name in names]
+        print('\tPreparing the plot data took %s' % self.elapsed_time(time() - start_time))
+
+        if self.cpu > 1 and len(names) > 1:
+            pool = mp.Pool(min(self.cpu, len(names)))
+            jobs = [pool.apply_async(self.render_plot, [name, plot_inputs]) for name, plot_inputs in zip(names, inputs)]
+            results = (job.get() for job in jobs)
+        else:
+            pool = None
+            results = (self.render_plot(name, plot_inputs) for name, plot_inputs in zip(names, inputs))
 
-        print('\tPlotting gc_vs_length_hex...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_gc_vs_length_hex(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
+        # In the order of the report, as they are done. The PNG files are written in the background meanwhile.
+        plots = list()
+        writes = list()
+        with ThreadPoolExecutor(1) as writer:
+            for name, (plot, interval) in zip(names, results):
+                plots.append(plot)
+                if plot.png is not None:
+                    writes.append(writer.submit(self.write_plot, plot))
+                self.plot_times[name] = interval
+                print('\tPlotting {}... took {}'.format(name, self.elapsed_time(interval)))
+            for write in writes:
+                write.result()  # Raise the errors of the writes, if any
+        if pool is not None:
+            pool.close()
+            pool.join()
+        return plots
 
-        print('\tPlotting pores_gc_output_vs_time_all...', end="", flush=True)
+    def render_plot(self, name, t):
+        """
+        Draw a plot. Runs in the workers of the pool.
+        :param name: name of the plot
+        :param t: inputs of the plot
+        :return: tuple of the plot and the time taken to draw it, in seconds
+        """
         start_time = time()
-        plots.append(self.plot_pores_gc_output_vs_time_all(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
+        plot = getattr(self, 'plot_' + name)(t)
+        plt.close('all')
+        return plot, time() - start_time
 
-        print('\tPlotting pores_gc_output_vs_time_per_sample...', end="", flush=True)
-        start_time = time()
-        plots.append(self.plot_pores_gc_output_vs_time_per_sample(d))
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
+    def save_plot(self, fig, file_name, title):
+        """
+        Render a figure to PNG in memory, once. The same bytes are embedded in the report and written to the PNG
+        file by the parent process, unless the PNG files are not written.
+        :param fig: matplotlib Figure or seaborn grid
+        :param file_name: name of the PNG file in the output folder
+        :param title: title of the plot in the report
+        :return: ImageForHTML
+        """
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        png = buffer.getvalue()
+        plot = ImageForHTML(image_title=title, image_base64_string=base64.b64encode(png).decode('utf-8'))
+        if self.write_png:
+            plot.file_name = file_name
+            plot.png = png
+        return plot
 
-        return plots
+    def write_plot(self, plot):
+        """
+        Write the PNG file of a plot in the output folder. Runs in a background thread.
+        :param plot: ImageForHTML from save_plot
+        :return:
+        """
+        with open(os.path.join(self.output_folder, plot.file_name), 'wb') as f:
+            f.write(plot.png)
+        plot.png = None  # Only the base64 string is kept for the report
 
-    def plot_total_reads_vs_time(self, d):
+    @staticmethod
+    def decimate(x, y, n_points=None):
+        """
+        Downsample a curve to a number of points with the largest-triangle-three-buckets algorithm, so it looks
+        the same but is drawn much faster. The first and last points are kept. The other points are split in
+        n_points - 2 buckets and the point kept in every bucket makes the largest triangle with the point kept in
+        the previous bucket and the average of the next bucket, so the peaks and steps are not smoothed out.
+        :param x: numpy array of the x values, sorted
+        :param y: numpy array of the y values
+        :param n_points: maximum number of points kept. NanoQC.YIELD_CURVE_POINTS if None.
+        :return: tuple of numpy arrays of the x and y values kept
+        """
+        n_points = n_points or NanoQC.YIELD_CURVE_POINTS
+        if x.size <= n_points or n_points < 3:
+            return x, y
+
+        # Buckets of the points between the first and the last, and their averages
+        edges = np.linspace(1, x.size - 1, n_points - 1).astype(np.int64)
+        xf = x.astype(np.float64)
+        yf = y.astype(np.float64)
+        sizes = np.diff(edges)
+        mean_x = np.append(np.add.reduceat(xf[1:-1], edges[:-1] - 1) / sizes, xf[-1])
+        mean_y = np.append(np.add.reduceat(yf[1:-1], edges[:-1] - 1) / sizes, yf[-1])
+
+        kept = np.empty(n_points, dtype=np.int64)
+        kept[0] = 0
+        kept[-1] = x.size - 1
+        a = 0
+        for b in range(n_points - 2):
+            start, end = edges[b], edges[b + 1]
+            # Twice the area of the triangles, the factor doesn't change the largest
+            areas = np.abs((xf[a] - mean_x[b + 1]) * (yf[start:end] - yf[a])
+                           - (xf[a] - xf[start:end]) * (mean_y[b + 1] - yf[a]))
+            a = start + int(np.argmax(areas))
+            kept[b + 1] = a
+        return x[kept], y[kept]
+
+    def plot_total_reads_vs_time(self, t):
         """
         Plot number of reads against running time. Both Pass and fail reads in the same graph
-        :param d: A dictionary to store the relevant information about each sequence
+        :param t: ReadTable
         :return: A png file with the graph
-        TODO -> use numpy to handle the plot data, on row per sample?
-        name, length, flag, average_phred, gc, time_string
         """
 
         fig, ax = plt.subplots()
-        t_pass = list()  # time
-        t_fail = list()
 
-        for seq_id, seq in d.items():
-            t = seq.time_string
-            if seq.flag == 'pass':
-                t_pass.append(t)
-            else:
-                t_fail.append(t)
-
-        # Find the smallest datetime value
-        t_zero_pass = None
-        t_zero_fail = None
-        if t_pass:
-            t_zero_pass = min(t_pass)
-
-        if t_fail:
-            t_zero_fail = min(t_fail)
-
-        if t_pass and t_fail:
-            t_zero = min(t_zero_pass, t_zero_fail)
-        elif t_pass:
-            t_zero = t_zero_pass
-        elif t_fail:
-            t_zero = t_zero_fail
-        else:
+        if not len(t):
             raise Exception('No data!')
 
-        # Prepare datetime value for plotting
-        # Convert time object in hours from beginning of run
-        y_pass = None
-        y_fail = None
-        if t_pass:
-            t_pass[:] = [x - t_zero for x in t_pass]  # Subtract t_zero for the all time points
-            t_pass.sort()  # Sort
-            t_pass[:] = [x.days * 24 + x.seconds / 3600 for x in t_pass]  # Convert to hours (float)
-            y_pass = range(1, len(t_pass) + 1, 1)  # Create range. 1 time point equals 1 read
-
-        if t_fail:
-            t_fail[:] = [x - t_zero for x in t_fail]
-            t_fail.sort()
-            t_fail[:] = [x.days * 24 + x.seconds / 3600 for x in t_fail]
-            y_fail = range(1, len(t_fail) + 1, 1)
+        # Cumulative number of reads, in hours from beginning of run
+        t_pass, y_pass = self.decimate(*t.yield_curve('pass'))
+        t_fail, y_fail = self.decimate(*t.yield_curve('fail'))
 
         # Create plot
-        if t_pass and t_fail:
+        if t_pass.size and t_fail.size:
             ax.plot(t_pass, y_pass, color='blue')
             ax.plot(t_fail, y_fail, color='red')
             ax.legend(['Pass', 'Fail'])
-        elif t_pass:
+        elif t_pass.size:
             ax.plot(t_pass, y_pass, color='blue')
             ax.legend(['Pass'])
-        elif t_fail:
+        elif t_fail.size:
             ax.plot(t_fail, y_fail, color='red')
             ax.legend(['Fail'])
 
         ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
         ax.set(xlabel='Time (h)', ylabel='Number of reads', title='Total read yield')
         plt.tight_layout()
-        fig.savefig(self.output_folder + "/total_reads_vs_time.png")
-        with open(os.path.join(self.output_folder, 'total_reads_vs_time.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Total Reads Vs Time',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'total_reads_vs_time.png', 'Total Reads Vs Time')
         return plot
 
-    def plot_reads_per_sample_vs_time(self, d):
+    def plot_reads_per_sample_vs_time(self, t):
         """
         Plot yield per sample. Just the pass reads
-        :param d: Dictionary
+        :param t: ReadTable
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
         # fig, ax = plt.subplots()
         # plt.ticklabel_format(style='sci', axis='x', scilimits=(0, 0))
         fig, ax = plt.subplots(figsize=(10, 6))  # In inches
 
-        # Fetch required information
-        my_sample_dict = defaultdict()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                if seq.name not in my_sample_dict:
-                    my_sample_dict[seq.name] = defaultdict()
-                my_sample_dict[seq.name][seq_id] = seq.time_string
-
-        # Order the dictionary by keys
-        od = OrderedDict(sorted(my_sample_dict.items()))
-
-        # Make the plot
+        # Make the plot, samples ordered by name
         legend_names = list()
-        for name, seq_ids in od.items():
+        for name in sorted(t.sample_names):
+            # Hours since the first read of the sample
+            ts_pass, ys_pass = self.decimate(*t.yield_curve('pass', sample=name))
+            if not ts_pass.size:
+                continue
             legend_names.append(name)
-            ts_pass = list()
-            for seq, time_tag in seq_ids.items():
-                ts_pass.append(time_tag)
-
-            ts_zero = min(ts_pass)
-            ts_pass[:] = [x - ts_zero for x in ts_pass]  # Subtract t_zero for the all time points
-            ts_pass.sort()  # Sort
-            ts_pass[:] = [x.days * 24 + x.seconds / 3600 for x in ts_pass]  # Convert to hours (float)
-            ys_pass = range(1, len(ts_pass) + 1, 1)  # Create range. 1 time point equals 1 read
 
             # ax.plot(ts_pass, ys_pass)
             ax.plot(ts_pass, ys_pass,
-                    label="%s (%s)" % (name, "{:,}".format(max(ys_pass))))
+                    label="%s (%s)" % (name, "{:,}".format(ys_pass[-1])))
             # ax.legend(legend_names)
 
         plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
@@ -1167,59 +2729,29 @@ class NanoQC(object):
         # comma-separated numbers to the y axis
         ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
         plt.tight_layout()  #
-        fig.savefig(self.output_folder + "/reads_per_sample_vs_time.png")
-        with open(os.path.join(self.output_folder, 'reads_per_sample_vs_time.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Reads Per Sample Vs Time',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'reads_per_sample_vs_time.png', 'Reads Per Sample Vs Time')
         return plot
 
 
-    def plot_bp_per_sample_vs_time(self, d):
+    def plot_bp_per_sample_vs_time(self, t):
         """
         Read length per sample vs time
-        :param d: Dictionary
+        :param t: ReadTable
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
         fig, ax = plt.subplots(figsize=(10, 6))  # In inches
 
-        # Fetch required information
-        my_sample_dict = defaultdict()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                if seq.name not in my_sample_dict:
-                    my_sample_dict[seq.name] = defaultdict()
-                my_sample_dict[seq.name][seq_id] = (seq.time_string, seq.length)  #tuple
-
-        # Order the dictionary by keys
-        od = OrderedDict(sorted(my_sample_dict.items()))
-
-        # Make the plot
-        for name, seq_ids in od.items():
-            ts_pass = list()
-            for seq, data_tuple in seq_ids.items():
-                ts_pass.append(data_tuple)
-
-            # Prepare x values (time)
-            ts_zero = min(ts_pass, key=lambda x: x[0])[0]  # looking for min of 1st elements of the tuple list
-            ts_pass1 = [tuple(((x - ts_zero), y)) for x, y in ts_pass]  # Subtract t_zero for the all time points
-            ts_pass1.sort(key=lambda x: x[0])  # Sort according to first element in tuples
-            ts_pass2 = [tuple(((x.days * 24 + x.seconds / 3600), y)) for x,y in ts_pass1]  # Convert to hours (float)
-            x_values = [x for x, y in ts_pass2]  # Only get the fist value of the ordered tuples
-
-            # Prepare y values in a cumulative way
-            c = 0
-            y_values = list()
-            for x, y in ts_pass2:
-                y = y + c
-                y_values.append(y)
-                c = y
+        # Make the plot, samples ordered by name
+        for name in sorted(t.sample_names):
+            # Hours since the first read of the sample and cumulative base pairs
+            x_values, y_values = self.decimate(*t.yield_curve('pass', sample=name, bases=True))
+            if not x_values.size:
+                continue
 
             # Plot values per sample
             ax.plot(x_values, y_values,
-                    label="%s (%s)" % (name, "{:,}".format(max(y_values))))
+                    label="%s (%s)" % (name, "{:,}".format(y_values[-1])))
 
         # ax.legend(legend_names, bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
         plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)  # New
@@ -1230,169 +2762,64 @@ class NanoQC(object):
         ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
         plt.tight_layout()
         # Save figure to file
-        fig.savefig(self.output_folder + "/bp_per_sample_vs_time.png")
-        with open(os.path.join(self.output_folder, 'bp_per_sample_vs_time.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Base Pairs Per Sample Vs Time',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'bp_per_sample_vs_time.png', 'Base Pairs Per Sample Vs Time')
         return plot
 
-    def plot_total_bp_vs_time(self, d):
+    def plot_total_bp_vs_time(self, t):
         """
         Sequence length vs time
-        :param d: Dictionary
+        :param t: ReadTable
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
         fig, ax = plt.subplots()
 
-        # Fetch required information
-        ts_pass = list()
-        ts_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                ts_pass.append(tuple((seq.time_string, seq.length)))
-            else:
-                ts_fail.append(tuple((seq.time_string, seq.length)))
-
-        ts_zero_pass = list()
-        ts_zero_fail = list()
-        if ts_pass:
-            ts_zero_pass = min(ts_pass, key=lambda x: x[0])[0]  # looking for min of 1st elements of the tuple list
-
-        if ts_fail:
-            ts_zero_fail = min(ts_fail, key=lambda x: x[0])[0]  # looking for min of 1st elements of the tuple list
-
-        if ts_pass and ts_fail:
-            ts_zero = min(ts_zero_pass, ts_zero_fail)
-        elif ts_pass:
-            ts_zero = ts_zero_pass
-        else:  # elif ts_fail:
-            ts_zero = ts_zero_fail
-
-        x_pass_values = None
-        y_pass_values = None
-        x_fail_values = None
-        y_fail_values = None
-        if ts_pass:
-            ts_pass1 = [tuple(((x - ts_zero), y)) for x, y in ts_pass]  # Subtract t_zero for the all time points
-            ts_pass1.sort(key=lambda x: x[0])  # Sort according to first element in tuple
-            ts_pass2 = [tuple(((x.days * 24 + x.seconds / 3600), y)) for x, y in ts_pass1]  # Convert to hours (float)
-            x_pass_values = [x for x, y in ts_pass2]
-            c = 0
-            y_pass_values = list()
-            for x, y in ts_pass2:
-                y = y + c
-                y_pass_values.append(y)
-                c = y
-        if ts_fail:
-            ts_fail1 = [tuple(((x - ts_zero), y)) for x, y in ts_fail]
-            ts_fail1.sort(key=lambda x: x[0])
-            ts_fail2 = [tuple(((x.days * 24 + x.seconds / 3600), y)) for x, y in ts_fail1]
-            x_fail_values = [x for x, y in ts_fail2]
-            c = 0
-            y_fail_values = list()
-            for x, y in ts_fail2:
-                y = y + c
-                y_fail_values.append(y)
-                c = y
+        # Cumulative base pairs, in hours from beginning of run
+        x_values = dict()
+        y_values = dict()
+        for flag in ['pass', 'fail']:
+            x_values[flag], y_values[flag] = self.decimate(*t.yield_curve(flag, bases=True))
 
         # Print plot
-        if ts_pass and ts_fail:
-            ax.plot(x_pass_values, y_pass_values, color='blue')
-            ax.plot(x_fail_values, y_fail_values, color='red')
+        if x_values['pass'].size and x_values['fail'].size:
+            ax.plot(x_values['pass'], y_values['pass'], color='blue')
+            ax.plot(x_values['fail'], y_values['fail'], color='red')
             ax.legend(['Pass', 'Fail'])
-        elif ts_pass:
-            ax.plot(x_pass_values, y_pass_values, color='blue')
+        elif x_values['pass'].size:
+            ax.plot(x_values['pass'], y_values['pass'], color='blue')
             ax.legend(['Pass'])
-        else:  # elif ts_fail:
-            ax.plot(x_fail_values, y_fail_values, color='red')
+        else:  # elif fail only:
+            ax.plot(x_values['fail'], y_values['fail'], color='red')
             ax.legend(['Fail'])
         ax.set(xlabel='Time (h)', ylabel='Number of base pairs', title='Total yield in base pair')
         ax.ticklabel_format(style='plain')  # Disable the scientific notation on the y-axis
         ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
         plt.tight_layout()
-        fig.savefig(self.output_folder + "/total_bp_vs_time.png")
-        with open(os.path.join(self.output_folder, 'total_bp_vs_time.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Total Base Pairs Vs Time',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'total_bp_vs_time.png', 'Total Base Pairs Vs Time')
         return plot
 
-    def plot_quality_vs_time(self, d):
+    def plot_quality_vs_time(self, t):
         """
         Quality vs time (bins of 1h). Violin plot
-        :param d: Dictionary
+        :param t: ReadTable
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
         fig, ax = plt.subplots(figsize=(10, 6))
 
-        ts_pass = list()
-        ts_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                #         average_phred = round(average_phred_full, 1)
-                ts_pass.append(tuple((seq.time_string, round(seq.average_phred, 1))))
-            else:
-                ts_fail.append(tuple((seq.time_string, round(seq.average_phred, 1))))
-
-        ts_zero_pass = None
-        ts_zero_fail = None
-        if ts_pass:
-            ts_zero_pass = min(ts_pass, key=lambda x: x[0])[0]  # looking for min of 1st elements of the tuple list
-
-        if ts_fail:
-            ts_zero_fail = min(ts_fail, key=lambda x: x[0])[0]  # looking for min of 1st elements of the tuple list
-
-        if ts_pass and ts_fail:
-            ts_zero = min(ts_zero_pass, ts_zero_fail)
-        elif ts_pass:
-            ts_zero = ts_zero_pass
-        else:  # elif ts_fail:
-            ts_zero = ts_zero_fail
-
-        ts_pass3 = list()
-        ts_fail3 = list()
-        if ts_pass:
-            ts_pass1 = [tuple(((x - ts_zero), y)) for x, y in ts_pass]  # Subtract t_zero for the all time points
-            ts_pass1.sort(key=lambda x: x[0])  # Sort according to first element in tuple
-            ts_pass2 = [tuple(((x.days * 24 + x.seconds / 3600), y)) for x, y in ts_pass1]  # Convert to hours (float)
-            ts_pass3 = [tuple((int(np.round(x)), y)) for x, y in ts_pass2]  # Round hours
-
-            df_pass = pd.DataFrame(list(ts_pass3), columns=['Sequencing time interval (h)', 'Phred score'])  # Convert to dataframe
-            df_pass['Flag'] = pd.Series('pass', index=df_pass.index)  # Add a 'Flag' column to the end with 'pass' value
-
-        if ts_fail:
-            ts_fail1 = [tuple(((x - ts_zero), y)) for x, y in ts_fail]
-            ts_fail1.sort(key=lambda x: x[0])
-            ts_fail2 = [tuple(((x.days * 24 + x.seconds / 3600), y)) for x, y in ts_fail1]
-            ts_fail3 = [tuple((int(np.round(x)), y)) for x, y in ts_fail2]
-
-            df_fail = pd.DataFrame(list(ts_fail3), columns=['Sequencing time interval (h)', 'Phred score'])
-            df_fail['Flag'] = pd.Series('fail', index=df_fail.index)  # Add a 'Flag' column to the end with 'fail' value
+        has_pass = t.flag_count('pass') > 0
+        has_fail = t.flag_count('fail') > 0
 
-        # Account if there is no fail data or no pass data
-        if ts_fail3 and ts_pass3:
-            frames = [df_pass, df_fail]
-            data = pd.concat(frames)  # Merge dataframes
-        elif ts_pass3:
-            data = df_pass
-        else:  # elif ts_fail3:
-            data = df_fail
+        # Violins drawn from the hourly histograms, whatever the number of reads
+        self.draw_binned_violins(ax, t, 'average_phred', 'Phred score')
 
         # Account if there is no fail data or no pass data
-        if ts_fail3 and ts_pass3:
-            g = sns.violinplot(x='Sequencing time interval (h)', y='Phred score', data=data, hue='Flag', split=True, inner=None)
-            g.figure.suptitle('Sequence quality over time')
-        elif ts_pass3:
-            g = sns.violinplot(x='Sequencing time interval (h)', y='Phred score', data=data, inner=None)
-            g.figure.suptitle('Sequence quality over time (pass only)')
-        else:  # elif ts_fail3:
-            g = sns.violinplot(x='Sequencing time interval (h)', y='Phred score', data=data, inner=None)
-            g.figure.suptitle('Sequence quality over time (fail only)')
+        if has_fail and has_pass:
+            fig.suptitle('Sequence quality over time')
+        elif has_pass:
+            fig.suptitle('Sequence quality over time (pass only)')
+        else:  # elif has_fail:
+            fig.suptitle('Sequence quality over time (fail only)')
 
         # Major ticks every 4 hours
         # https://jakevdp.github.io/PythonDataScienceHandbook/04.10-customizing-ticks.html
@@ -1404,95 +2831,110 @@ class NanoQC(object):
         ax.xaxis.set_major_formatter(FuncFormatter(my_formater))
         ax.xaxis.set_major_locator(MultipleLocator(4))
 
-        if ts_fail:
+        if has_fail:
             plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
 
         plt.tight_layout(rect=[0, 0, 1, 0.95])  # accounts for the "suptitile" [left, bottom, right, top]
-        fig.savefig(self.output_folder + "/quality_vs_time.png")
-        with open(os.path.join(self.output_folder, 'quality_vs_time.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Quality Vs Time',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'quality_vs_time.png', 'Quality Vs Time')
         return plot
 
-    def plot_phred_score_distribution(self, d):
+    def draw_binned_violins(self, ax, t, column, label):
+        """
+        Draw violins of a metric per hour from hourly histograms. The pass reads are drawn on the left
+        half and the fail reads on the right half, like the split violins of seaborn. Whole violins if only one flag
+        is present.
+        :param ax: matplotlib axes
+        :param t: ReadTable or ReadStats
+        :param column: 'average_phred' or 'gc'
+        :param label: y axis label
+        """
+        flags = [(flag, color) for flag, color in [('pass', 'blue'), ('fail', 'red')] if t.flag_count(flag)]
+        for flag, color in flags:
+            hours, values, counts = t.hourly_histograms(column, flag)
+            legend_label = flag  # On the first violin drawn only
+            for hour, histogram in zip(hours, counts):
+                bins = np.flatnonzero(histogram)
+                if not bins.size:
+                    continue
+                bins = np.arange(bins[0], bins[-1] + 1)
+                width = 0.4 * histogram[bins] / histogram.max()
+                left = hour if flag == 'fail' and len(flags) > 1 else hour - width
+                right = hour if flag == 'pass' and len(flags) > 1 else hour + width
+                ax.fill_betweenx(values[bins], left, right, color=color, alpha=0.6, linewidth=0, label=legend_label)
+                legend_label = None
+        ax.set(xlabel='Sequencing time interval (h)', ylabel=label)
+
+    def plot_phred_score_distribution(self, t):
         """
         Frequency of phred scores
-        :param d: Dictionary
+        :param t: ReadTable
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
         fig, ax = plt.subplots()
 
-        qual_pass = list()
-        qual_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                qual_pass.append(round(seq.average_phred, 1))
-            else:
-                qual_fail.append(round(seq.average_phred, 1))
+        # Phred scores rounded to 0.1, with their number of reads (None if one value per read)
+        qual_pass, weights_pass = t.distribution('average_phred', 'pass')
+        qual_fail, weights_fail = t.distribution('average_phred', 'fail')
 
         mean_pass_qual = None
         mean_fail_qual = None
-        if qual_pass:
-            mean_pass_qual = np.round(np.mean(qual_pass), 1)
+        if qual_pass.size:
+            mean_pass_qual = np.round(np.average(qual_pass, weights=weights_pass), 1)
 
-        if qual_fail:
-            mean_fail_qual = np.round(np.mean(qual_fail), 1)
+        if qual_fail.size:
+            mean_fail_qual = np.round(np.average(qual_fail, weights=weights_fail), 1)
 
         # Print plot
-        if qual_pass and qual_fail:
+        if qual_pass.size and qual_fail.size:
             ax.hist([qual_pass, qual_fail],
-                    bins=np.arange(min(min(qual_pass), min(qual_fail)), max(max(qual_pass), max(qual_fail))),
+                    bins=np.arange(min(qual_pass.min(), qual_fail.min()), max(qual_pass.max(), qual_fail.max())),
+                    weights=None if weights_pass is None else [weights_pass, weights_fail],
                     color=['blue', 'red'],
                     label=["pass (Avg: %s)" % mean_pass_qual, "fail (Avg: %s)" % mean_fail_qual])
-        elif qual_pass:
+        elif qual_pass.size:
             ax.hist(qual_pass,
-                    bins=np.arange(min(qual_pass), max(qual_pass)),
+                    bins=np.arange(qual_pass.min(), qual_pass.max()),
+                    weights=weights_pass,
                     color='blue',
                     label="pass (Avg: %s)" % mean_pass_qual)
         else:
             ax.hist(qual_fail,
-                    bins=np.arange(min(qual_fail), max(qual_fail)),
+                    bins=np.arange(qual_fail.min(), qual_fail.max()),
+                    weights=weights_fail,
                     color='red',
                     label="fail (Avg: %s)" % mean_fail_qual)
         plt.legend()
         ax.set(xlabel='Phred score', ylabel='Frequency', title='Phred score distribution')
         ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
         plt.tight_layout()
-        fig.savefig(self.output_folder + "/phred_score_distribution.png")
-        with open(os.path.join(self.output_folder, 'phred_score_distribution.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Phred Score Distribution',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'phred_score_distribution.png', 'Phred Score Distribution')
         return plot
 
-    def plot_length_distribution(self, d):
+    def plot_length_distribution(self, t):
         """
         Frequency of sizes. Bins auto-sized based on length distribution. Log scale x-axis.
-        :param d: Dictionary
+        :param t: ReadTable
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
-        size_pass = list()
-        size_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                size_pass.append(seq.length)
-            else:
-                size_fail.append(seq.length)
-
-        if size_fail:  # assume "pass" always present
-            min_len = min(min(size_pass), min(size_fail))
-            max_len = max(max(size_pass), max(size_fail))
-            mean_pass_size = np.round(np.mean(size_pass), 1)
-            mean_fail_size = np.round(np.mean(size_fail), 1)
-        elif size_pass:
-            min_len = min(size_pass)
-            max_len = max(size_pass)
-            mean_pass_size = np.round(np.mean(size_pass), 1)
+        # Lengths with their number of reads (None if one value per read)
+        size_pass, weights_pass = t.distribution('length', 'pass')
+        size_fail, weights_fail = t.distribution('length', 'fail')
+
+        # Exact means from the total base pairs, even when the lengths are binned
+        names, reads_pass, bp_pass = t.sample_totals('pass')
+        names, reads_fail, bp_fail = t.sample_totals('fail')
+
+        if size_fail.size:  # assume "pass" always present
+            min_len = int(min(size_pass.min(), size_fail.min()))
+            max_len = int(max(size_pass.max(), size_fail.max()))
+            mean_pass_size = np.round(bp_pass.sum() / reads_pass.sum(), 1)
+            mean_fail_size = np.round(bp_fail.sum() / reads_fail.sum(), 1)
+        elif size_pass.size:
+            min_len = int(size_pass.min())
+            max_len = int(size_pass.max())
+            mean_pass_size = np.round(bp_pass.sum() / reads_pass.sum(), 1)
         else:
             print("No reads detected!")
             return
@@ -1501,48 +2943,35 @@ class NanoQC(object):
         fig, ax = plt.subplots()
         binwidth = int(np.round(10 * np.log10(max_len - min_len)))
         logbins = np.logspace(np.log10(min_len), np.log10(max_len), binwidth)
-        if size_fail:
+        if size_fail.size:
             plt.hist([size_pass, size_fail],
                      bins=logbins,
+                     weights=None if weights_pass is None else [weights_pass, weights_fail],
                      color=['blue', 'red'],
                      label=["pass (Avg: %s)" % mean_pass_size, "fail (Avg: %s)" % mean_fail_size])
         else:
-            plt.hist(size_pass, bins=logbins, color='blue', label="pass (Avg: %s)" % mean_pass_size)
+            plt.hist(size_pass, bins=logbins, weights=weights_pass, color='blue',
+                     label="pass (Avg: %s)" % mean_pass_size)
         plt.legend()
         plt.xscale('log')
         ax.set(xlabel='Read length (bp)', ylabel='Frequency', title='Read length distribution')
         ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
         plt.tight_layout()
-        fig.savefig(self.output_folder + "/length_distribution.png")
-        with open(os.path.join(self.output_folder, 'length_distribution.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Length Distribution',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'length_distribution.png', 'Length Distribution')
         return plot
 
-    def test_plot(self, d):
-        """ TAKES 50 MIN to run! The KDE part takes way too long."""
+    def test_plot(self, t):
+        """ TAKES 50 MIN to run on all the reads! The KDE part takes way too long. Only a sample of reads is used."""
         # from scipy import stat
 
-        qs_pass = list()
-        qs_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                qs_pass.append(tuple((seq.length, seq.average_phred)))
-            else:
-                qs_fail.append(tuple((seq.length, seq.average_phred)))
-
-        df_pass = pd.DataFrame(list(qs_pass), columns=['Length (bp)', 'Phred score'])
-        df_pass['flag'] = pd.Series('pass', index=df_pass.index)  # Add a 'Flag' column to the end with 'pass' value
-
-        df_fail = pd.DataFrame(list(qs_fail), columns=['Length (bp)', 'Phred score'])
-        df_fail['flag'] = pd.Series('fail', index=df_fail.index)  # Add a 'Flag' column to the end with 'fail' value
-
-        df_concatenated = pd.concat([df_pass, df_fail])
+        t = t.reservoir(self.sample_size, self.seed)
+        df_concatenated = self.make_dataframe(t, {'Length (bp)': t.length, 'Phred score': t.average_phred})
+        df_pass = df_concatenated.loc[df_concatenated['flag'] == 'pass']
+        df_fail = df_concatenated.loc[df_concatenated['flag'] == 'fail']
 
         # Find min and max length values
-        min_len = min(df_concatenated.ix[:, 0])
-        max_len = max(df_concatenated.ix[:, 0])
+        min_len = min(df_concatenated.iloc[:, 0])
+        max_len = max(df_concatenated.iloc[:, 0])
         min_exp = np.log10(min_len)
         max_exp = np.log10(max_len)
         min_value = float(10 ** (min_exp - 0.1))
@@ -1551,8 +2980,8 @@ class NanoQC(object):
         len_logbins = np.logspace(min_exp, max_exp, 50)
 
         # Set y-axis limits
-        min_phred = min(df_concatenated.ix[:, 1])
-        max_phred = max(df_concatenated.ix[:, 1])
+        min_phred = min(df_concatenated.iloc[:, 1])
+        max_phred = max(df_concatenated.iloc[:, 1])
         # phred_range = max_phred - min_phred
         phred_bins = np.linspace(min_phred, max_phred, 50)
 
@@ -1627,27 +3056,23 @@ class NanoQC(object):
         z = np.exp(kde_skl.score_samples(xy_sample))
         return xx, yy, np.reshape(z, xx.shape)
 
-    def plot_quality_vs_length_kde(self, d):
+    def plot_quality_vs_length_kde(self, t):
         """
-        seaborn jointplot (length vs quality)
-        :param d: Dictionary
+        seaborn jointplot (length vs quality), from a sample of reads
+        :param t: ReadTable or ReadStats
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
         sns.set(style="ticks")
 
-        my_dict = dict()
-        for seq_id, seq in d.items():
-            my_dict[seq_id] = [seq.length, seq.average_phred, seq.flag]
-
-        df = pd.DataFrame.from_dict(my_dict, orient='index', columns=['Length (bp)', 'Phred score', 'flag'])
+        t = t.reservoir(self.sample_size, self.seed)
+        df = self.make_dataframe(t, {'Length (bp)': t.length, 'Phred score': t.average_phred})
         df_pass = df.loc[df['flag'] == 'pass']
         df_fail = df.loc[df['flag'] == 'fail']
 
         # Set x-axis limits
-        min_len = min(df.ix[:, 0])
-        max_len = max(df.ix[:, 0])
+        min_len = min(df.iloc[:, 0])
+        max_len = max(df.iloc[:, 0])
         min_exp = np.log10(min_len)
         max_exp = np.log10(max_len)
         min_value = float(10 ** (min_exp - 0.1))
@@ -1660,8 +3085,8 @@ class NanoQC(object):
         len_logbins = np.logspace(min_exp, max_exp, 25)
 
         # Set y-axis limits
-        min_phred = min(df.ix[:, 1])
-        max_phred = max(df.ix[:, 1])
+        min_phred = min(df.iloc[:, 1])
+        max_phred = max(df.iloc[:, 1])
 
         # Set bin sized for histogram
         phred_bins = np.linspace(min_phred, max_phred, 15)
@@ -1727,34 +3152,28 @@ class NanoQC(object):
         g.fig.set_figheight(4)
 
         # Save figure to file
-        g.savefig(self.output_folder + "/quality_vs_length_kde.png")
-        with open(os.path.join(self.output_folder, 'quality_vs_length_kde.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Quality Vs Length KDE',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(g, 'quality_vs_length_kde.png', 'Quality Vs Length KDE')
         return plot
 
-    def plot_quality_vs_length_hex(self, d):
+    def plot_quality_vs_length_hex(self, t):
         """
-        seaborn jointplot (length vs quality)
-        :param d: Dictionary
+        seaborn jointplot (length vs quality), from a sample of reads
+        :param t: ReadTable or ReadStats
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
         sns.set(style="ticks")
 
-        my_dict = dict()
-        for seq_id, seq in d.items():
-            my_dict[seq_id] = [seq.length, seq.average_phred, seq.flag]
-
-        df = pd.DataFrame.from_dict(my_dict, orient='index', columns=['Length (bp)', 'Phred score', 'flag'])
-        df_pass = df.loc[df['flag'] == 'pass']
-        df_fail = df.loc[df['flag'] == 'fail']
+        # Lengths and phred scores of the sampled reads
+        t = t.reservoir(self.sample_size, self.seed)
+        x_pass, y_pass = t.joint_distribution('average_phred', 'pass')
+        x_fail, y_fail = t.joint_distribution('average_phred', 'fail')
+        x_all = np.concatenate([x_pass, x_fail])
+        y_all = np.concatenate([y_pass, y_fail])
 
         # Set x-axis limits
-        min_len = min(df['Length (bp)'])
-        max_len = max(df['Length (bp)'])
+        min_len = x_all.min()
+        max_len = x_all.max()
         min_exp = np.log10(min_len)
         max_exp = np.log10(max_len)
         min_value = float(10 ** (min_exp - 0.1))
@@ -1767,23 +3186,22 @@ class NanoQC(object):
         len_logbins = np.logspace(min_exp, max_exp, 25)
 
         # Set y-axis limits
-        min_phred = min(df['Phred score'])
-        max_phred = max(df['Phred score'])
+        min_phred = y_all.min()
+        max_phred = y_all.max()
 
         # Set bin sized for histogram
         phred_bins = np.linspace(min_phred, max_phred, 15)
 
-        # Do the Kernel Density Estimation (KDE)
-        x = df_pass['Length (bp)']
-        y = df_pass['Phred score']
-
         # Create grid object
-        g = sns.JointGrid(x='Length (bp)', y='Phred score', data=df_pass, space=0)
+        g = sns.JointGrid(space=0)
+        g.set_axis_labels('Length (bp)', 'Phred score')
 
-        g.ax_joint.hexbin(x, y, gridsize=50, cmap="Blues", xscale='log', alpha=0.6, mincnt=1, edgecolor='none')
+        g.ax_joint.hexbin(x_pass, y_pass, gridsize=50, cmap="Blues", xscale='log', alpha=0.6, mincnt=1,
+                          edgecolor='none')
         g.ax_joint.axis([min_value, max_value, min_phred, max_phred])
-        g.ax_marg_x.hist(x, histtype='stepfilled', color='blue', alpha=0.6, bins=len_logbins)
-        g.ax_marg_y.hist(y, histtype='stepfilled', color='blue', alpha=0.6, bins=phred_bins, orientation="horizontal")
+        g.ax_marg_x.hist(x_pass, histtype='stepfilled', color='blue', alpha=0.6, bins=len_logbins)
+        g.ax_marg_y.hist(y_pass, histtype='stepfilled', color='blue', alpha=0.6, bins=phred_bins,
+                         orientation="horizontal")
 
         # Set main plot x axis scale to log
         g.ax_joint.set_xscale('log')
@@ -1794,24 +3212,18 @@ class NanoQC(object):
         # Do the same for the fail reads
         ####
 
-        if not df_fail.empty:
-            g.x = df_fail['Length (bp)']
-            g.y = df_fail['Phred score']
-
-            # Do the Kernel Density Estimation (KDE)
-            x = df_fail['Length (bp)']
-            y = df_fail['Phred score']
-
-            g.ax_joint.hexbin(x, y, gridsize=50, cmap="Reds", xscale='log', alpha=0.6, mincnt=1, edgecolor='none')
-            g.ax_marg_x.hist(x, histtype='stepfilled', color='red', alpha=0.6, bins=len_logbins)
-            g.ax_marg_y.hist(y, histtype='stepfilled', color='red', alpha=0.6, bins=phred_bins,
-                             orientation="horizontal")
+        if x_fail.size:
+            g.ax_joint.hexbin(x_fail, y_fail, gridsize=50, cmap="Reds", xscale='log', alpha=0.6, mincnt=1,
+                              edgecolor='none')
+            g.ax_marg_x.hist(x_fail, histtype='stepfilled', color='red', alpha=0.6, bins=len_logbins)
+            g.ax_marg_y.hist(y_fail, histtype='stepfilled', color='red', alpha=0.6,
+                             bins=phred_bins, orientation="horizontal")
 
         # Add legend to the joint plot area
         # https://matplotlib.org/tutorials/intermediate/legend_guide.html
         blue_patch = mpatches.Patch(color='blue', alpha=0.6, label='Pass')
         red_patch = mpatches.Patch(color='red', alpha=0.6, label='Fail')
-        if not df_fail.empty:
+        if x_fail.size:
             g.ax_joint.legend(handles=[blue_patch, red_patch], loc='best')
         else:
             g.ax_joint.legend(handles=[blue_patch], loc='best')
@@ -1824,11 +3236,7 @@ class NanoQC(object):
         g.fig.set_figheight(4)
 
         # Save figure to file
-        g.savefig(self.output_folder + "/quality_vs_length_hex.png")
-        with open(os.path.join(self.output_folder, 'quality_vs_length_hex.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Quality Vs Length Hex',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(g, 'quality_vs_length_hex.png', 'Quality Vs Length Hex')
         return plot
 
     def jointplot_w_hue(self, data, x, y, hue=None, colormap=None,
@@ -1888,8 +3296,8 @@ class NanoQC(object):
         # Set main plot x axis scale to log
         ax_main.set_xscale('log')
         # Set x-axis limits
-        min_len = min(data.ix[:, 0])
-        max_len = max(data.ix[:, 0])
+        min_len = min(data.iloc[:, 0])
+        max_len = max(data.iloc[:, 0])
         min_exp = np.log10(min_len)
         max_exp = np.log10(max_len)
         min_value = float(10 ** (min_exp - 0.1))
@@ -1899,8 +3307,8 @@ class NanoQC(object):
         # Set bin sized for histogram
         len_logbins = np.logspace(min_exp, max_exp, 30)
         # Set y-axis limits
-        min_phred = min(data.ix[:, 1])
-        max_phred = max(data.ix[:, 1])
+        min_phred = min(data.iloc[:, 1])
+        max_phred = max(data.iloc[:, 1])
         # phred_range = max_phred - min_phred
         phred_bins = np.linspace(min_phred, max_phred, 15)
 
@@ -1953,26 +3361,15 @@ class NanoQC(object):
 
         return dict(fig=fig, gridspec=grid)
 
-    def plot_quality_vs_length_scatter(self, d):
-        qs_pass = list()
-        qs_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                qs_pass.append(tuple((seq.length, seq.average_phred)))
-            else:
-                qs_fail.append(tuple((seq.length, seq.average_phred)))
-
-        df_pass = pd.DataFrame(list(qs_pass), columns=['Length (bp)', 'Phred Score'])
-        df_pass['flag'] = pd.Series('pass', index=df_pass.index)  # Add a 'Flag' column to the end with 'pass' value
-
-        df_fail = pd.DataFrame(list(qs_fail), columns=['Length (bp)', 'Phred Score'])
-        df_fail['flag'] = pd.Series('fail', index=df_fail.index)  # Add a 'Flag' column to the end with 'fail' value
-
-        df_concatenated = pd.concat([df_pass, df_fail])
+    def plot_quality_vs_length_scatter(self, t):
+        # One point per read, for a sample of reads
+        t = t.reservoir(self.sample_size, self.seed)
+        df_concatenated = self.make_dataframe(t, {'Length (bp)': t.length, 'Phred Score': t.average_phred})
+        df_pass = df_concatenated.loc[df_concatenated['flag'] == 'pass']
 
         fig = plt.figure(figsize=(10, 6))
 
-        if qs_fail:
+        if len(df_pass) < len(df_concatenated):
             self.jointplot_w_hue(data=df_concatenated, x='Length (bp)', y='Phred Score',
                                  hue='flag', figsize=(10, 6), fig=fig, colormap=['blue', 'red'],
                                  scatter_kws={'s': 1, 'alpha': 0.1})
@@ -1981,38 +3378,23 @@ class NanoQC(object):
                                  hue='flag', figsize=(10, 6), fig=fig, colormap=['blue'],
                                  scatter_kws={'s': 1, 'alpha': 0.1})
 
-        fig.savefig(self.output_folder + "/quality_vs_length_scatter.png")
-        with open(os.path.join(self.output_folder, 'quality_vs_length_scatter.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Quality Vs Length Scatter',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'quality_vs_length_scatter.png', 'Quality Vs Length Scatter')
         return plot
 
-    def plot_test_old(self, d):
+    def plot_test_old(self, t):
         """
-        seaborn jointplot (length vs quality). More manual.
-        :param d:
+        seaborn jointplot (length vs quality). More manual. From a sample of reads.
+        :param t: ReadTable or ReadStats
         :return:
         """
 
         from matplotlib import gridspec
         from scipy.stats import gaussian_kde
 
-        qs_pass = list()
-        qs_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                qs_pass.append(tuple((seq.length, seq.average_phred)))
-            else:
-                qs_fail.append(tuple((seq.length, seq.average_phred)))
-
-        df_pass = pd.DataFrame(list(qs_pass), columns=['Length (bp)', 'Phred Score'])
-        df_pass['flag'] = pd.Series('pass', index=df_pass.index)  # Add a 'Flag' column to the end with 'pass' value
-
-        df_fail = pd.DataFrame(list(qs_fail), columns=['Length (bp)', 'Phred Score'])
-        df_fail['flag'] = pd.Series('fail', index=df_fail.index)  # Add a 'Flag' column to the end with 'fail' value
-
-        df_concatenated = pd.concat([df_pass, df_fail])
+        t = t.reservoir(self.sample_size, self.seed)
+        df_concatenated = self.make_dataframe(t, {'Length (bp)': t.length, 'Phred Score': t.average_phred})
+        df_pass = df_concatenated.loc[df_concatenated['flag'] == 'pass']
+        df_fail = df_concatenated.loc[df_concatenated['flag'] == 'fail']
 
         min_len = pd.DataFrame.min(df_concatenated['Length (bp)'])
         min_exp = np.log10(min_len)
@@ -2095,25 +3477,13 @@ class NanoQC(object):
         # g.savefig(self.output_folder + "/test.png")
         fig.savefig(self.output_folder + "/test.png")
 
-    def plot_reads_vs_bp_per_sample(self, d):
+    def plot_reads_vs_bp_per_sample(self, t):
         # Fetch required information
-        my_sample_dict = defaultdict()  # to get the lengths (bp)
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                if seq.name not in my_sample_dict:
-                    my_sample_dict[seq.name] = defaultdict()
-                if not my_sample_dict[seq.name]:
-                    my_sample_dict[seq.name] = [seq.length]
-                else:
-                    my_sample_dict[seq.name].append(seq.length)
+        names, reads, bp = t.sample_totals('pass')
 
-        # Order the dictionary by keys
-        od = OrderedDict(sorted(my_sample_dict.items()))
-
-        # Create pandas dataframe
-        df = pd.DataFrame(columns=['Sample', 'bp', 'reads'])
-        for name, size_list in od.items():
-            df = df.append({'Sample': name, 'bp': sum(size_list), 'reads': len(size_list)}, ignore_index=True)
+        # Create pandas dataframe, ordered by sample name
+        df = pd.DataFrame({'Sample': names, 'bp': bp, 'reads': reads})
+        df = df[df['reads'] > 0].sort_values('Sample').reset_index(drop=True)
 
         fig, ax1 = plt.subplots(figsize=(10, 6))  # In inches
 
@@ -2140,11 +3510,7 @@ class NanoQC(object):
         ax1.autoscale_view()
 
         plt.tight_layout()
-        fig.savefig(self.output_folder + "/reads_vs_bp_per_sample.png")
-        with open(os.path.join(self.output_folder, 'reads_vs_bp_per_sample.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Reads Vs BP Per Sample',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'reads_vs_bp_per_sample.png', 'Reads Vs BP Per Sample')
         return plot
         #########################################
         # ax = df.plot(kind='bar', secondary_y='reads', title='bp versus reads',
@@ -2172,32 +3538,25 @@ class NanoQC(object):
         # plt.tight_layout()
         # g.savefig(self.output_folder + "/reads_vs_bp_per_sample.png")
 
-    def plot_pores_output_vs_time_total(self, d):
-
-        time_list = list()
-        for seq_id, seq in d.items():
-            time_list.append(seq.time_string)
+    def plot_pores_output_vs_time_total(self, t):
 
-        time_list = sorted(time_list)  # order list
-        time_zero = min(time_list)  # find smallest datetime value
-        time_list1 = [x - time_zero for x in time_list]  # Subtract t_zero for the all time points
-        time_list2 = [x.days * 1440 + x.seconds / 60 for x in time_list1]  # Convert to minutes (float)
-        time_list3 = [int(np.round(x)) for x in time_list2]  # Round minutes
+        # Minutes since t_zero, rounded, with their number of reads (None if one value per read)
+        time_list3, weights = t.minute_counts()
         # Check how many 15-minute bins are required to plot all the data
-        nbins = max(time_list3) / 15 if max(time_list3) % 15 == 0 else int(max(time_list3) / 15) + 1
+        nbins = max(int(ceil(time_list3.max() / 15)), 2)
         # Create the bin boundaries
-        x_bins = np.linspace(min(time_list3), max(time_list3), nbins)  # every 15 min
+        x_bins = np.linspace(time_list3.min(), time_list3.max(), nbins)  # every 15 min
 
         # Generate counts for each bin
-        hist, edges = np.histogram(time_list3, bins=x_bins, density=False)
+        hist, edges = np.histogram(time_list3, bins=x_bins, weights=weights, density=False)
 
         fig, ax = plt.subplots()
 
-        # Plot the data
-        g = sns.scatterplot(data=hist, x_bins=edges, legend=False, size=3, alpha=0.5, linewidth=0)
+        # Plot the data, one point per 15-minute bin
+        ax.scatter(np.arange(hist.size), hist, s=9, alpha=0.5, linewidth=0)
 
         # Adjust format of numbers for y axis: "1000000" -> "1,000,000"
-        g.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
+        ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
 
         # Change x axis labels chunk-of-15-min to hours
         def numfmt(m, pos):  # your custom formatter function: divide by 100.0
@@ -2222,73 +3581,42 @@ class NanoQC(object):
         plt.xlabel('Sequencing time (hours)')
 
         plt.tight_layout()  # Get rid of extra margins around the plot
-        fig = g.get_figure()  # Get figure from FacetGrid
-        fig.savefig(self.output_folder + "/pores_output_vs_time.png")
-        with open(os.path.join(self.output_folder, 'pores_output_vs_time.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Pores Output Vs Time',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'pores_output_vs_time.png', 'Pores Output Vs Time')
         return plot
 
-    def plot_pores_output_vs_time_all(self, d):
+    def plot_pores_output_vs_time_all(self, t):
 
         import matplotlib.lines as mlines
 
         fig, ax = plt.subplots()
 
-        time_list_all = list()
-        time_list_pass = list()
-        time_list_fail = list()
-
-        for seq_id, seq in d.items():
-            time_string = seq.time_string
-            time_list_all.append(time_string)
-            if seq.flag == 'pass':
-                time_list_pass.append(time_string)
-            else:
-                time_list_fail.append(time_string)
-
-        time_zero = min(time_list_all)  # find smallest datetime value
+        # Minutes since t_zero, rounded, with their number of reads (None if one value per read)
+        time_list_all, weights_all = t.minute_counts()
+        time_list_pass, weights_pass = t.minute_counts('pass')
+        time_list_fail, weights_fail = t.minute_counts('fail')
 
         # Plot all
-        # time_list_all = sorted(time_list_all)  # order list
-        time_list_all[:] = [x - time_zero for x in time_list_all]  # Subtract t_zero for the all time points
-        time_list_all[:] = [x.days * 1440 + x.seconds / 60 for x in time_list_all]  # Convert to minutes (float)
-        time_list_all[:] = [int(np.round(x)) for x in time_list_all]  # Round minutes
         # Check how many 15-minute bins are required to plot all the data
-        nbins = max(time_list_all) / 15 if max(time_list_all) % 15 == 0 else int(max(time_list_all) / 15) + 1
+        nbins = max(int(ceil(time_list_all.max() / 15)), 2)
         # Create the bin boundaries
-        x_bins = np.linspace(min(time_list_all), max(time_list_all), nbins)  # every 15 min
+        x_bins = np.linspace(time_list_all.min(), time_list_all.max(), nbins)  # every 15 min
         # Generate counts for each bin
-        hist, edges = np.histogram(time_list_all, bins=x_bins, density=False)
-        # Plot the data
-        g = sns.scatterplot(data=hist, x_bins=edges, size=3, alpha=0.5, linewidth=0,
-                        cmap='Greens')  # , marker='o'
+        hist, edges = np.histogram(time_list_all, bins=x_bins, weights=weights_all, density=False)
+        # Plot the data, one point per 15-minute bin
+        ax.scatter(np.arange(hist.size), hist, s=9, alpha=0.5, linewidth=0, color='green')
 
         # If not fail, just draw the pass. Else, draw total, fail and pass
-        if time_list_fail:  # fail reads might be missing if plotting filtered reads for example.
+        if time_list_fail.size:  # fail reads might be missing if plotting filtered reads for example.
             # Plot fail
-            time_list_fail[:] = [x - time_zero for x in time_list_fail]
-            time_list_fail[:] = [x.days * 1440 + x.seconds / 60 for x in time_list_fail]
-            time_list_fail[:] = [int(np.round(x)) for x in time_list_fail]
-            # nbins = max(time_list_fail) / 15 if max(time_list_fail) % 15 == 0 else int(max(time_list_fail) / 15) + 1
-            # x_bins = np.linspace(min(time_list_fail), max(time_list_fail), nbins)
-            hist, edges = np.histogram(time_list_fail, bins=x_bins, density=False)
-            sns.scatterplot(data=hist, x_bins=edges, size=3, alpha=0.5, linewidth=0,
-                            cmap='Reds')  # , marker='x'
+            hist, edges = np.histogram(time_list_fail, bins=x_bins, weights=weights_fail, density=False)
+            ax.scatter(np.arange(hist.size), hist, s=9, alpha=0.5, linewidth=0, color='red')
 
             # Plot pass - Assume always pass reads present
-            time_list_pass[:] = [x - time_zero for x in time_list_pass]
-            time_list_pass[:] = [x.days * 1440 + x.seconds / 60 for x in time_list_pass]
-            time_list_pass[:] = [int(np.round(x)) for x in time_list_pass]
-            # nbins = max(time_list_pass) / 15 if max(time_list_pass) % 15 == 0 else int(max(time_list_pass) / 15) + 1
-            # x_bins = np.linspace(min(time_list_pass), max(time_list_pass), nbins)
-            hist, edges = np.histogram(time_list_pass, bins=x_bins, density=False)
-            sns.scatterplot(data=hist, x_bins=edges, size=3, alpha=0.5, linewidth=0,
-                                cmap='Blues')  # , marker='^'
+            hist, edges = np.histogram(time_list_pass, bins=x_bins, weights=weights_pass, density=False)
+            ax.scatter(np.arange(hist.size), hist, s=9, alpha=0.5, linewidth=0, color='blue')
 
         # Adjust format of numbers for y axis: "1000000" -> "1,000,000"
-        g.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
+        ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
 
         # Change x axis labels chunk-of-15-min to hours
         def numfmt(m, pos):  # your custom formatter function: divide by 100.0
@@ -2315,7 +3643,7 @@ class NanoQC(object):
         red_x = mlines.Line2D([], [], color='red', alpha=0.6, label='Fail', marker='o',
                               markersize=5, linestyle='None')
 
-        if time_list_fail:
+        if time_list_fail.size:
             ax.legend(handles=[green_circle, blue_triangle, red_x], loc='upper right')
         else:
             green_circle = mlines.Line2D([], [], color='green', alpha=0.6, label='Pass', marker='o',
@@ -2328,36 +3656,25 @@ class NanoQC(object):
         plt.xlabel('Sequencing time (hours)')
 
         plt.tight_layout()  # Get rid of extra margins around the plot
-        fig = g.get_figure()  # Get figure from FacetGrid
-        fig.savefig(self.output_folder + "/pores_output_vs_time_all.png")
-        with open(os.path.join(self.output_folder, 'pores_output_vs_time_all.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Pores Output Vs Time All',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'pores_output_vs_time_all.png', 'Pores Output Vs Time All')
         return plot
 
-    def plot_channel_output_all(self, d):
+    def plot_channel_output_all(self, t):
         """
         https://github.com/wdecoster/nanoplotter/blob/master/nanoplotter/spatial_heatmap.py#L69
         https://bioinformatics.stackexchange.com/questions/745/minion-channel-ids-from-albacore/749#749
 
-        :param d: Dictionary
+        :param t: ReadTable
         :return: png file
         """
 
-        channel_dict = defaultdict()
-        for seq_id, seq in d.items():
-            channel_number = int(seq.channel)
-            # Pass and fail apart
-            if channel_number not in channel_dict:
-                channel_dict[channel_number] = [0, 0]
-            if seq.flag == 'pass':
-                channel_dict[channel_number][0] += 1
-            else:  # seq.flag == b'fail':
-                channel_dict[channel_number][1] += 1
+        # Count pass and fail apart
+        pass_counts = t.channel_counts('pass')
+        fail_counts = t.channel_counts('fail')
+        channels = np.flatnonzero(pass_counts + fail_counts)  # Only the channels that produced reads
 
         # convert to Pandas dataframe
-        df = pd.DataFrame.from_dict(channel_dict, orient='index', columns=['Pass', 'Fail'])
+        df = pd.DataFrame({'Pass': pass_counts[channels], 'Fail': fail_counts[channels]}, index=channels)
         df_all = pd.DataFrame()
         df_all['All'] = df['Pass'] + df['Fail']
         df_pass = df[['Pass']]  # The double square brakets keep the column name
@@ -2387,88 +3704,31 @@ class NanoQC(object):
                         ax=axs[i])
             axs[i].set_title("{} reads output per channel".format(flag))
         plt.tight_layout()  # Get rid of extra margins around the plot
-        fig.savefig(self.output_folder + "/channel_output_all.png")
-        with open(os.path.join(self.output_folder, 'channel_output_all.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Channel Output All',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'channel_output_all.png', 'Channel Output All')
         return plot
 
-    def plot_gc_vs_time(self, d):
+    def plot_gc_vs_time(self, t):
         """
-        Quality vs time (bins of 1h). Violin plot
-        :param d: Dictionary
+        %GC vs time (bins of 1h). Violin plot
+        :param t: ReadTable
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
         fig, ax = plt.subplots(figsize=(10, 6))
 
-        ts_pass = list()
-        ts_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == 'pass':
-                #         average_phred = round(average_phred_full, 1)
-                ts_pass.append(tuple((seq.time_string, round(seq.gc, 1))))
-            else:
-                ts_fail.append(tuple((seq.time_string, round(seq.gc, 1))))
-
-        ts_zero_pass = None
-        ts_zero_fail = None
-        if ts_pass:
-            ts_zero_pass = min(ts_pass, key=lambda x: x[0])[0]  # looking for min of 1st elements of the tuple list
-
-        if ts_fail:
-            ts_zero_fail = min(ts_fail, key=lambda x: x[0])[0]  # looking for min of 1st elements of the tuple list
-
-        if ts_pass and ts_fail:
-            ts_zero = min(ts_zero_pass, ts_zero_fail)
-        elif ts_pass:
-            ts_zero = ts_zero_pass
-        else:  # elif ts_fail:
-            ts_zero = ts_zero_fail
-
-        ts_pass3 = list()
-        ts_fail3 = list()
-        if ts_pass:
-            ts_pass1 = [tuple(((x - ts_zero), y)) for x, y in ts_pass]  # Subtract t_zero for the all time points
-            ts_pass1.sort(key=lambda x: x[0])  # Sort according to first element in tuple
-            ts_pass2 = [tuple(((x.days * 24 + x.seconds / 3600), y)) for x, y in ts_pass1]  # Convert to hours (float)
-            ts_pass3 = [tuple((int(np.round(x)), y)) for x, y in ts_pass2]  # Round hours
-
-            # Convert to dataframe
-            df_pass = pd.DataFrame(list(ts_pass3), columns=['Sequencing time interval (h)', '%GC'])
-            df_pass['Flag'] = pd.Series('pass', index=df_pass.index)  # Add a 'Flag' column to the end with 'pass' value
-
-        if ts_fail:
-            ts_fail1 = [tuple(((x - ts_zero), y)) for x, y in ts_fail]
-            ts_fail1.sort(key=lambda x: x[0])
-            ts_fail2 = [tuple(((x.days * 24 + x.seconds / 3600), y)) for x, y in ts_fail1]
-            ts_fail3 = [tuple((int(np.round(x)), y)) for x, y in ts_fail2]
-
-            df_fail = pd.DataFrame(list(ts_fail3), columns=['Sequencing time interval (h)', '%GC'])
-            df_fail['Flag'] = pd.Series('fail', index=df_fail.index)  # Add a 'Flag' column to the end with 'fail' value
+        has_pass = t.flag_count('pass') > 0
+        has_fail = t.flag_count('fail') > 0
 
-        # Account if there is no fail data or no pass data
-        if ts_fail3 and ts_pass3:
-            frames = [df_pass, df_fail]
-            data = pd.concat(frames)  # Merge dataframes
-        elif ts_pass3:
-            data = df_pass
-        else:  # elif ts_fail3:
-            data = df_fail
+        # Violins drawn from the hourly histograms, whatever the number of reads
+        self.draw_binned_violins(ax, t, 'gc', '%GC')
 
         # Account if there is no fail data or no pass data
-        if ts_fail3 and ts_pass3:
-            g = sns.violinplot(x='Sequencing time interval (h)', y='%GC', data=data, hue='Flag',
-                               split=True, inner=None)
-            g.figure.suptitle('Sequence quality over time')
-        elif ts_pass3:
-            g = sns.violinplot(x='Sequencing time interval (h)', y='%GC', data=data, inner=None)
-            g.figure.suptitle('Sequence quality over time (pass only)')
-        else:  # elif ts_fail3:
-            g = sns.violinplot(x='Sequencing time interval (h)', y='%GC', data=data, inner=None)
-            g.figure.suptitle('Sequence quality over time (fail only)')
+        if has_fail and has_pass:
+            fig.suptitle('GC content over time')
+        elif has_pass:
+            fig.suptitle('GC content over time (pass only)')
+        else:  # elif has_fail:
+            fig.suptitle('GC content over time (fail only)')
 
         # Major ticks every 4 hours
         # https://jakevdp.github.io/PythonDataScienceHandbook/04.10-customizing-ticks.html
@@ -2480,38 +3740,32 @@ class NanoQC(object):
         ax.xaxis.set_major_formatter(FuncFormatter(my_formater))
         ax.xaxis.set_major_locator(MultipleLocator(4))
 
-        if ts_fail:
+        if has_fail:
             plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
 
         plt.tight_layout(rect=[0, 0, 1, 0.95])  # accounts for the "suptitile" [left, bottom, right, top]
-        fig.savefig(self.output_folder + "/gc_vs_time.png")
-        with open(os.path.join(self.output_folder, 'gc_vs_time.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='GC Vs Time',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'gc_vs_time.png', 'GC Vs Time')
         return plot
 
-    def plot_gc_vs_length_hex(self, d):
+    def plot_gc_vs_length_hex(self, t):
         """
-        seaborn jointplot (length vs quality)
-        :param d: Dictionary
+        seaborn jointplot (length vs %GC), from a sample of reads
+        :param t: ReadTable or ReadStats
         :return: png file
-        name, length, flag, average_phred, gc, time_string
         """
 
         sns.set(style="ticks")
 
-        my_dict = dict()
-        for seq_id, seq in d.items():
-            my_dict[seq_id] = [seq.length, seq.gc, seq.flag]
-
-        df = pd.DataFrame.from_dict(my_dict, orient='index', columns=['Length (bp)', '%GC', 'flag'])
-        df_pass = df.loc[df['flag'] == 'pass']
-        df_fail = df.loc[df['flag'] == 'fail']
+        # Lengths and %GC of the sampled reads
+        t = t.reservoir(self.sample_size, self.seed)
+        x_pass, y_pass = t.joint_distribution('gc', 'pass')
+        x_fail, y_fail = t.joint_distribution('gc', 'fail')
+        x_all = np.concatenate([x_pass, x_fail])
+        y_all = np.concatenate([y_pass, y_fail])
 
         # Set x-axis limits
-        min_len = min(df['Length (bp)'])
-        max_len = max(df['Length (bp)'])
+        min_len = x_all.min()
+        max_len = x_all.max()
         min_exp = np.log10(min_len)
         max_exp = np.log10(max_len)
         min_value = float(10 ** (min_exp - 0.1))
@@ -2521,37 +3775,31 @@ class NanoQC(object):
         len_logbins = np.logspace(min_exp, max_exp, 25)
 
         # Set y-axis limits
-        min_phred = min(df['%GC'])
-        max_phred = max(df['%GC'])
+        min_phred = y_all.min()
+        max_phred = y_all.max()
 
         # Set bin sized for histogram
         phred_bins = np.linspace(min_phred, max_phred, 15)
 
         # Create grid object
-        g = sns.JointGrid(x='Length (bp)', y='%GC', data=df, space=0)
+        g = sns.JointGrid(space=0)
+        g.set_axis_labels('Length (bp)', '%GC')
 
         # Plot Fail fist
-        if not df_fail.empty:
-            x = df_fail['Length (bp)']
-            y = df_fail['%GC']
-            g.x = df_fail['Length (bp)']
-            g.y = df_fail['%GC']
-
-            g.ax_joint.hexbin(x, y, gridsize=50, cmap="Reds", xscale='log', alpha=0.6, mincnt=1, edgecolor='none')
-            g.ax_marg_x.hist(x, histtype='stepfilled', color='red', alpha=0.6, bins=len_logbins)
-            g.ax_marg_y.hist(y, histtype='stepfilled', color='red', alpha=0.6, bins=phred_bins,
-                             orientation="horizontal")
+        if x_fail.size:
+            g.ax_joint.hexbin(x_fail, y_fail, gridsize=50, cmap="Reds", xscale='log', alpha=0.6, mincnt=1,
+                              edgecolor='none')
+            g.ax_marg_x.hist(x_fail, histtype='stepfilled', color='red', alpha=0.6, bins=len_logbins)
+            g.ax_marg_y.hist(y_fail, histtype='stepfilled', color='red', alpha=0.6,
+                             bins=phred_bins, orientation="horizontal")
 
         # Plot Pass second
-        x = df_pass['Length (bp)']
-        y = df_pass['%GC']
-        g.x = df_pass['Length (bp)']
-        g.y = df_pass['%GC']
-
-        g.ax_joint.hexbin(x, y, gridsize=50, cmap="Blues", xscale='log', alpha=0.6, mincnt=1, edgecolor='none')
+        g.ax_joint.hexbin(x_pass, y_pass, gridsize=50, cmap="Blues", xscale='log', alpha=0.6, mincnt=1,
+                          edgecolor='none')
         g.ax_joint.axis([min_value, max_value, min_phred, max_phred])
-        g.ax_marg_x.hist(x, histtype='stepfilled', color='blue', alpha=0.6, bins=len_logbins)
-        g.ax_marg_y.hist(y, histtype='stepfilled', color='blue', alpha=0.6, bins=phred_bins, orientation="horizontal")
+        g.ax_marg_x.hist(x_pass, histtype='stepfilled', color='blue', alpha=0.6, bins=len_logbins)
+        g.ax_marg_y.hist(y_pass, histtype='stepfilled', color='blue', alpha=0.6, bins=phred_bins,
+                         orientation="horizontal")
 
         # Set main plot x axis scale to log
         g.ax_joint.set_xscale('log')
@@ -2562,7 +3810,7 @@ class NanoQC(object):
         # https://matplotlib.org/tutorials/intermediate/legend_guide.html
         blue_patch = mpatches.Patch(color='blue', alpha=0.6, label='Pass')
         red_patch = mpatches.Patch(color='red', alpha=0.6, label='Fail')
-        if not df_fail.empty:
+        if x_fail.size:
             g.ax_joint.legend(handles=[blue_patch, red_patch], loc='best')
         else:
             g.ax_joint.legend(handles=[blue_patch], loc='best')
@@ -2572,66 +3820,15 @@ class NanoQC(object):
         g.fig.set_figheight(4)
 
         # Save figure to file
-        g.savefig(self.output_folder + "/gc_vs_length_hex.png")
-        with open(os.path.join(self.output_folder, 'gc_vs_length_hex.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='GC Vs Length Hex',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(g, 'gc_vs_length_hex.png', 'GC Vs Length Hex')
         return plot
 
-    def plot_pores_gc_output_vs_time_all(self, d):
+    def plot_pores_gc_output_vs_time_all(self, t):
 
         fig, ax = plt.subplots()
 
-        time_list_all = list()
-        time_list_pass = list()
-        time_list_fail = list()
-
-        for seq_id, seq in d.items():
-            time_string = seq.time_string
-            time_list_all.append(tuple((time_string, seq.gc)))
-            if seq.flag == 'pass':
-                time_list_pass.append(tuple((time_string, seq.gc)))
-            else:
-                time_list_fail.append(tuple((time_string, seq.gc)))
-
-        time_zero = min(time_list_all, key=lambda x: x[0])[0]  # looking for min of 1st elements of list of tuples
-
-        # Compute x_bins
-        time_list_all.sort(key=lambda x: x[0])  # order list
-        time_list_all[:] = [tuple((x - time_zero, y)) for x, y in time_list_all]  # Subtract t_zero
-        time_list_all[:] = [tuple((x.days * 24 + x.seconds / 3600, y)) for x, y in time_list_all]  # Convert to minutes
-        # time_list_all[:] = [tuple((int(np.round(x)), y)) for x, y in time_list_all]  # Round minutes
-        x = [x for x, y in time_list_all]
-        y = [y for x, y in time_list_all]
-
-        # How many bins to plot data
-        nbins = int(max(x)) + 1
-        # Create the bin boundaries
-        x_bins = np.linspace(min(x), max(x), nbins)
-
-        # Plot pass - Assume always pass reads present
-        time_list_pass.sort(key=lambda x: x[0])  # order list
-        time_list_pass[:] = [tuple((x - time_zero, y)) for x, y in time_list_pass]  # Subtract t_zero
-        time_list_pass[:] = [tuple((x.days * 24 + x.seconds / 3600, y)) for x, y in time_list_pass]  # Convert to min
-        x = [x for x, y in time_list_pass]
-        y = [y for x, y in time_list_pass]
-
-        sns.regplot(x=x, y=y, x_bins=x_bins, fit_reg=False, scatter_kws={'alpha': 0.6, 's': 30},
-                    label='Pass', color='blue')
-
-        # sns.scatterplot(x=x, y=y, x_bins=x_bins, alpha=0.8, cmap='Blues')
-
-        if time_list_fail:
-            time_list_fail.sort(key=lambda x: x[0])  # order list
-            time_list_fail[:] = [tuple((x - time_zero, y)) for x, y in time_list_fail]  # Subtract t_zero
-            time_list_fail[:] = [tuple((x.days * 24 + x.seconds / 3660, y)) for x, y in time_list_fail]
-            x = [x for x, y in time_list_fail]
-            y = [y for x, y in time_list_fail]
-
-            # Plot the data
-            sns.regplot(x=x, y=y, x_bins=x_bins, fit_reg=False, scatter_kws={'alpha': 0.6, 's': 30},
-                        label='Fail', color='red')
+        # Mean %GC per hour since t_zero, with the 95% confidence interval. Pass first.
+        self.draw_hourly_means(ax, t, 'gc')
 
         # Set major ticks every 4 h
         ax.xaxis.set_major_locator(MultipleLocator(4))  # Want every 4 hours
@@ -2643,11 +3840,7 @@ class NanoQC(object):
         plt.legend()
 
         plt.tight_layout()  # Get rid of extra margins around the plot
-        fig.savefig(self.output_folder + "/pores_gc_output_vs_time_all.png")
-        with open(os.path.join(self.output_folder, 'pores_gc_output_vs_time_all.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Pore GC Output Vs Time All',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'pores_gc_output_vs_time_all.png', 'Pore GC Output Vs Time All')
         return plot
 
     # @staticmethod
@@ -2678,83 +3871,46 @@ class NanoQC(object):
 
         return width, height
 
-    def plot_pores_gc_output_vs_time_per_sample(self, d):
-        my_dict = defaultdict()
-        for seq_id, seq in d.items():
-            my_dict[seq_id] = (seq.time_string, seq.gc, seq.flag, seq.name)
-
-        df = pd.DataFrame.from_dict(my_dict, orient='index', columns=['time_string', '%GC', 'flag', 'name'])
-
-        # convert datatime to elapsed hours
-        time_zero = min(df['time_string'])  # looking for min of 1st elements of list of tuples
-        df['time_string'] = df['time_string'] - time_zero
-        df['time_string'] = df['time_string'].dt.total_seconds() / 3600
-
-        # Compute x_bins
-        nbins = int(max(df['time_string'])) + 1  # How many bins to plot data
-        x_bins = np.linspace(min(df['time_string']), max(df['time_string']), nbins)  # Create the bin boundaries
-
-        sample_list = sorted((df['name'].unique()))
+    def draw_hourly_means(self, ax, t, column, sample=None):
+        """
+        Draw the mean of a metric per hour since the start of the run, with its 95% confidence interval. Pass reads
+        in blue, fail reads in red.
+        :param ax: matplotlib axes
+        :param t: ReadTable or ReadStats
+        :param column: 'gc'
+        :param sample: only the reads of this sample. All the samples if None.
+        """
+        for flag, color in [('pass', 'blue'), ('fail', 'red')]:
+            hours, means, ci = t.hourly_means(column, flag, sample=sample)
+            if hours.size:
+                ax.errorbar(hours, means, yerr=ci, fmt='o', markersize=5, alpha=0.6, color=color,
+                            label=flag.capitalize())
+
+    def plot_pores_gc_output_vs_time_per_sample(self, t):
+        sample_list = sorted(t.sample_names)
         n_sample = len(sample_list)
         width, height = NanoQC.find_best_matrix(n_sample)
         # print(n_sample, width, height)  # debug
 
-        # Make grid for all samples
+        # Make grid for all samples, always 2D, even with a single sample
         # https://jakevdp.github.io/PythonDataScienceHandbook/04.08-multiple-subplots.html
-        fig, ax = plt.subplots(height, width, sharex='col', sharey='row', figsize=(height*5, width*5))
-        sample_index = 0
-        # If only one sample present, the grid makes things crash, so don't use.
-        if n_sample == 1:
+        fig, ax = plt.subplots(height, width, sharex='col', sharey='row', figsize=(height*5, width*5),
+                               squeeze=False)
+        for sample_index, axis in enumerate(ax.flat):
+            if sample_index >= len(sample_list):
+                axis.axis('off')  # don't draw the plot is no more sample for the 'too big' matrix
+                continue
             sample_name = sample_list[sample_index]
-            tmp_df = df[df['name'].str.match(sample_name)]
-            # Pass
-            pass_df = tmp_df[tmp_df['flag'].str.match('pass')]
-            sns.regplot(x=pass_df['time_string'], y=pass_df['%GC'], x_bins=x_bins, ax=ax,
-                        fit_reg=False, scatter_kws={'alpha': 0.6, 's': 30},
-                        label='Pass', color='blue')  # capsize=4, capthick=1
-            # Fail
-            fail_df = tmp_df[tmp_df['flag'].str.match('fail')]
-            if not fail_df.empty:
-                sns.regplot(x=fail_df['time_string'], y=fail_df['%GC'], x_bins=x_bins, ax=ax,
-                            fit_reg=False, scatter_kws={'alpha': 0.6, 's': 30},
-                            label='Fail', color='red')
+
+            # Mean %GC per hour since the start of the run, pass and fail
+            self.draw_hourly_means(axis, t, 'gc', sample=sample_name)
 
             # Set major ticks every 4 h
-            ax.xaxis.set_major_locator(MultipleLocator(4))  # Want every 4 hours
+            axis.xaxis.set_major_locator(MultipleLocator(4))  # Want every 4 hours
 
             # Add sample name to graph
-            ax.set_title(sample_name)
-            ax.set_xlabel(None)
-        else:
-            for i in range(height):
-                for j in range(width):
-                    if sample_index >= len(sample_list):
-                        ax[i][j].axis('off')  # don't draw the plot is no more sample for the 'too big' matrix
-                        # break
-                    else:
-                        sample_name = sample_list[sample_index]
-                        tmp_df = df[df['name'].str.match(sample_name)]
-                        # Pass
-                        pass_df = tmp_df[tmp_df['flag'].str.match('pass')]
-                        sns.regplot(x=pass_df['time_string'], y=pass_df['%GC'], x_bins=x_bins, ax=ax[i, j],
-                                    fit_reg=False, scatter_kws={'alpha': 0.6, 's': 30},
-                                    label='Pass', color='blue')  # capsize=4, capthick=1
-                        # Fail
-                        fail_df = tmp_df[tmp_df['flag'].str.match('fail')]
-                        if not fail_df.empty:
-                            sns.regplot(x=fail_df['time_string'], y=fail_df['%GC'], x_bins=x_bins, ax=ax[i, j],
-                                        fit_reg=False, scatter_kws={'alpha': 0.6, 's': 30},
-                                        label='Fail', color='red')
-
-                        # Set major ticks every 4 h
-                        ax[i, j].xaxis.set_major_locator(MultipleLocator(4))  # Want every 4 hours
-
-                        # Add sample name to graph
-                        ax[i, j].set_title(sample_name)
-                        ax[i, j].set_xlabel(None)
-
-                    # Move to next sample
-                    sample_index += 1
+            axis.set_title(sample_name)
+            axis.set_xlabel(None)
 
         # Add label to axes
         fig.suptitle('%GC over time per sample', fontsize=24)
@@ -2766,851 +3922,199 @@ class NanoQC(object):
 
         # Create legend without duplicates
         # https://stackoverflow.com/questions/13588920/stop-matplotlib-repeating-labels-in-legend
-        handles, labels = plt.gca().get_legend_handles_labels()
+        handles, labels = ax.flat[0].get_legend_handles_labels()
         by_label = OrderedDict(zip(labels, handles))
         plt.figlegend(by_label.values(), by_label.keys())
 
         plt.tight_layout(rect=[0.02, 0.02, 1, 0.95])  # accounts for the "suptitile" [left, bottom, right, top]
-        fig.savefig(self.output_folder + "/pores_gc_output_vs_time_per_sample.png")
-        with open(os.path.join(self.output_folder, 'pores_gc_output_vs_time_per_sample.png'), 'rb') as image_file:
-            encoded_string = base64.b64encode(image_file.read())
-        plot = ImageForHTML(image_title='Pore GC Output Vs Time Per Sample',
-                            image_base64_string=encoded_string.decode('utf-8'))
+        plot = self.save_plot(fig, 'pores_gc_output_vs_time_per_sample.png', 'Pore GC Output Vs Time Per Sample')
         return plot
 
-    # Summary plots
+    # Summary file
 
-    def parse_summary(self, d):
+    def summary_columns(self, header):
         """
-        Parse "sequencing_summary.txt" file from Albacore
-        :param d: Empty summary dictionary
-        :return: Dictionary with info about
+        Find the columns to load from the header of a sequencing summary file
+        :param header: list of the column names
+        :return: dictionary of the ReadTable attribute: column name
         """
-
-        print("Parsing summary file...", end='', flush=True)
-        start_time = time()
-        with open(self.input_summary, 'rb', 1024 * 1024 * 8) as file_handle:
-            # fields = list()
-            read_counter = 0
-            next(file_handle)  # skip first line
-            for line in file_handle:
-                line = line.rstrip()
-                if not line:
-                    continue
-
-                fields = line.split(b'\t')
-
-                # Only keep  fields of interest
-                length = fields[12]
-                if length == b'0':
-                    continue  # skip zero-length reads
-                seq_id = fields[1]
-                channel = fields[3]
-                events = fields[6]
-                flag = fields[7]
-                name = fields[19]
-                time_stamp = fields[4]
-                average_phred = fields[13]
-
-                seq_summary = SummaryObjects(name, length, channel, events, average_phred, time_stamp, flag)
-
-                d[seq_id] = seq_summary
-                read_counter += 1
-
-        # Print read stats
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s for %d reads" % (self.elapsed_time(interval), read_counter))
-
-    def make_summary_plots(self, d):
-        print("\nMaking plots:")
-
-        print('\tPlotting total_reads_vs_time...', end="", flush=True)
-        start_time = time()
-        self.plot_total_reads_vs_time_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting total_bp_vs_time...', end="", flush=True)
-        start_time = time()
-        self.plot_total_bp_vs_time_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting reads_per_sample_vs_time...', end="", flush=True)
-        start_time = time()
-        self.plot_reads_per_sample_vs_time_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting bp_per_sample_vs_time...', end="", flush=True)
-        start_time = time()
-        self.plot_bp_per_sample_vs_time_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting length_distribution...', end="", flush=True)
-        start_time = time()
-        self.plot_length_distribution_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting phred_score_distribution...', end="", flush=True)
-        start_time = time()
-        self.plot_phred_score_distribution_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting quality_vs_length_hex...', end="", flush=True)
-        start_time = time()
-        self.plot_quality_vs_length_hex_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting reads_vs_bp_per_sample...', end="", flush=True)
-        start_time = time()
-        self.plot_reads_vs_bp_per_sample_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting pores_output_vs_time_all...', end="", flush=True)
-        start_time = time()
-        self.plot_pores_output_vs_time_all_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        # print('\tPlotting pores_output_vs_time...', end="", flush=True)
-        # start_time = time()
-        # self.plot_pores_output_vs_time_summary(d)
-        # end_time = time()
-        # interval = end_time - start_time
-        # print(" took %s" % self.elapsed_time(interval))
-
-        # print('\tPlotting channel_output_total...', end="", flush=True)
-        # start_time = time()
-        # self.plot_channel_output_total(d)
-        # end_time = time()
-        # interval = end_time - start_time
-        # print(" took %s" % self.elapsed_time(interval))
-        #
-        # print('\tPlotting channel_output_pass_fail...', end="", flush=True)
-        # start_time = time()
-        # self.plot_channel_output_pass_fail(d)
-        # end_time = time()
-        # interval = end_time - start_time
-        # print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting channel_output_all...', end="", flush=True)
-        start_time = time()
-        self.plot_channel_output_all_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-        print('\tPlotting quality_vs_time...', end="", flush=True)
-        start_time = time()
-        self.plot_quality_vs_time_summary(d)
-        end_time = time()
-        interval = end_time - start_time
-        print(" took %s" % self.elapsed_time(interval))
-
-    def plot_total_reads_vs_time_summary(self, d):
+        columns = dict()
+        for attribute, names in NanoQC.SUMMARY_COLUMNS.items():
+            found = [name for name in names if name in header]
+            if found:
+                columns[attribute] = found[0]
+            elif attribute not in NanoQC.OPTIONAL_SUMMARY_COLUMNS:
+                raise Exception('No "{}" column found in {}'.format('" or "'.join(names), self.input_summary))
+        return columns
+
+    def summary_ranges(self, f, start, size=None):
         """
-        Plot number of reads against running time. Both Pass and fail reads in the same graph
-        :param d: A dictionary to store the relevant information about each sequence
-        :return: A png file with the graph
-        TODO -> use numpy to handle the plot data, on row per sample?
-        # name, length, channel, events, average_phred, time_stamp, flag
+        Split a sequencing summary file in byte ranges ending at the end of a line
+        :param f: file path
+        :param start: position of the first line after the header
+        :param size: approximate size of the ranges. A few ranges per CPU if None.
+        :return: iterator of tuples of the start and length of every range
         """
+        file_end = os.path.getsize(f)
+        if size is None:
+            size = max(ceil((file_end - start) / (self.cpu * 4)), 1024 * 1024 * 64)
 
-        fig, ax = plt.subplots()
-        t_pass = list()  # time
-        t_fail = list()
-
-        for seq_id, seq in d.items():
-            t = seq.time_stamp
-            if seq.flag == b'True':
-                t_pass.append(t)
-            else:
-                t_fail.append(t)
-
-        # Prepare datetime value for plotting
-        # Convert time object in hours from beginning of run
-        y_pass = None
-        y_fail = None
-        if t_pass:
-            t_pass[:] = [float(x) / 3600 for x in t_pass]  # Convert to hours (float)
-            t_pass.sort()  # Sort
-            y_pass = range(1, len(t_pass) + 1, 1)  # Create range. 1 time point equals 1 read
-
-        if t_fail:
-            t_fail[:] = [float(x) / 3600 for x in t_fail]
-            t_fail.sort()
-            y_fail = range(1, len(t_fail) + 1, 1)
-
-        # Create plot
-        if t_pass and t_fail:
-            ax.plot(t_pass, y_pass, color='blue')
-            ax.plot(t_fail, y_fail, color='red')
-            ax.legend(['Pass', 'Fail'])
-        elif t_pass:
-            ax.plot(t_pass, y_pass, color='blue')
-            ax.legend(['Pass'])
-        elif t_fail:
-            ax.plot(t_fail, y_fail, color='red')
-            ax.legend(['Fail'])
-
-        ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        ax.set(xlabel='Time (h)', ylabel='Number of reads', title='Total read yield')
-        plt.tight_layout()
-        fig.savefig(self.output_folder + "/total_reads_vs_time.png")
-
-    def plot_reads_per_sample_vs_time_summary(self, d):
+        with open(f, 'rb', 1024 * 1024) as file_handle:
+            range_end = start
+            while range_end < file_end:
+                range_start = range_end
+                file_handle.seek(range_start + size)
+                file_handle.readline()  # Move to the start of the next line
+                range_end = min(file_handle.tell(), file_end)
+                yield range_start, range_end - range_start
+
+    def parse_summary_range(self, header, columns, start, length):
         """
-        Plot yield per sample. Just the pass reads
-        :param d: Dictionary
-        :return: png file
-        # name, length, channel, events, average_phred, time_stamp, flag
+        Parse a range of lines of the sequencing summary file
+        :param header: list of the column names, from the first line of the file
+        :param columns: dictionary of the ReadTable attribute: column name, from self.summary_columns
+        :param start: position of the first line of the range
+        :param length: length of the range in bytes
+        :return: ReadTable, or ReadStats in streaming mode
         """
-
-        # fig, ax = plt.subplots()
-        # plt.ticklabel_format(style='sci', axis='x', scilimits=(0, 0))
-        fig, ax = plt.subplots(figsize=(10, 6))  # In inches
-
-        # Fetch required information
-        my_sample_dict = defaultdict()
-        for seq_id, seq in d.items():
-            if seq.flag == b'True':
-                if seq.name not in my_sample_dict:
-                    my_sample_dict[seq.name] = defaultdict()
-                my_sample_dict[seq.name][seq_id] = seq.time_stamp
-
-        # Order the dictionary by keys
-        od = OrderedDict(sorted(my_sample_dict.items()))
-
-        # Make the plot
-        legend_names = list()
-        for name, seq_ids in od.items():
-            name = name.decode('ascii')
-            legend_names.append(name)
-            ts_pass = list()
-            for seq, time_tag in seq_ids.items():
-                ts_pass.append(time_tag)
-
-            ts_pass[:] = [float(x) / 3600 for x in ts_pass]  # Convert to hours (float)
-            ts_pass.sort()  # Sort
-            ys_pass = range(1, len(ts_pass) + 1, 1)  # Create range. 1 time point equals 1 read
-
-            # ax.plot(ts_pass, ys_pass)
-            ax.plot(ts_pass, ys_pass,
-                    label="%s (%s)" % (name, "{:,}".format(max(ys_pass))))
-            # ax.legend(legend_names)
-
-        plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-
-        ax.set(xlabel='Time (h)', ylabel='Number of reads', title='Pass reads per sample')
-        ax.ticklabel_format(style='plain')  # Disable the scientific notation on the y-axis
-        # comma-separated numbers to the y axis
-        ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        plt.tight_layout()  #
-        fig.savefig(self.output_folder + "/reads_per_sample_vs_time.png")
-
-    def plot_bp_per_sample_vs_time_summary(self, d):
+        t = self.parse_summary_lines(header, columns, self.read_chunk(self.input_summary, (start, length)))
+        if self.streaming:
+            stats = ReadStats(self.sample_size, self.seed)
+            stats.append(t)
+            return stats
+        return t
+
+    def parse_summary_lines(self, header, columns, data):
         """
-        Read length per sample vs time
-        :param d: Dictionary
-        :return: png file
-        # name, length, channel, events, average_phred, time_stamp, flag
+        Parse lines of the sequencing summary file
+        :param header: list of the column names, from the first line of the file
+        :param columns: dictionary of the ReadTable attribute: column name, from self.summary_columns
+        :param data: bytes of whole lines, without the header
+        :return: ReadTable
         """
+        dtypes = {'length': np.uint32, 'average_phred': np.float32, 'time_stamp': np.float64, 'channel': np.uint16,
+                  'flag': 'category', 'sample': 'category'}
+        df = pd.read_csv(io.BytesIO(data), sep='\t', header=None, names=header, usecols=list(columns.values()),
+                         dtype={name: dtypes[attribute] for attribute, name in columns.items()})
+        df = df[df[columns['length']] > 0]  # skip zero-length reads
+
+        if 'sample' in columns:
+            samples = df[columns['sample']].cat
+            sample = samples.codes.to_numpy().astype(np.uint16)
+            sample_names = [str(name) for name in samples.categories]
+        else:
+            sample = np.zeros(len(df), dtype=np.uint16)
+            sample_names = [os.path.basename(self.input_summary).split('.')[0]]
 
-        fig, ax = plt.subplots(figsize=(10, 6))  # In inches
-
-        # Fetch required information
-        my_sample_dict = defaultdict()
-        for seq_id, seq in d.items():
-            if seq.flag == b'True':
-                if seq.name not in my_sample_dict:
-                    my_sample_dict[seq.name] = defaultdict()
-                my_sample_dict[seq.name][seq_id] = (seq.time_stamp, seq.length)  # tuple
-
-        # Order the dictionary by keys
-        od = OrderedDict(sorted(my_sample_dict.items()))
-
-        # Make the plot
-        for name, seq_ids in od.items():
-            name = name.decode('ascii')
-            ts_pass = list()
-            for seq, data_tuple in seq_ids.items():
-                ts_pass.append(data_tuple)
-
-            # Prepare x values (time)
-            ts_pass[:] = [tuple(((float(x) / 3600), int(y))) for x, y in ts_pass]  # Convert to hours (float)
-            ts_pass.sort(key=lambda x: x[0])  # Sort according to first element in tuples
-            x_values = [x for x, y in ts_pass]  # Only get the fist value of the ordered tuples
-
-            # Prepare y values in a cumulative way
-            c = 0
-            y_values = list()
-            for x, y in ts_pass:
-                y = y + c
-                y_values.append(y)
-                c = y
-
-            # Plot values per sample
-            ax.plot(x_values, y_values,
-                    label="%s (%s)" % (name, "{:,}".format(max(y_values))))
+        if 'flag' in columns:
+            flags = df[columns['flag']].cat
+            passed = np.asarray(flags.categories.astype(str).str.lower() == 'true')
+            flag = np.where(passed[flags.codes.to_numpy()], 0, 1).astype(np.uint8)
+        else:
+            flag = np.zeros(len(df), dtype=np.uint8)
 
-        plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)  # New
-        # Add axes labels
-        ax.set(xlabel='Time (h)', ylabel='Number of base pairs', title='Yield per sample in base pair\n("pass" only)')
-        ax.ticklabel_format(style='plain')  # Disable the scientific notation on the y-axis
-        ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        plt.tight_layout()
-        # Save figure to file
-        fig.savefig(self.output_folder + "/bp_per_sample_vs_time.png")
+        return ReadTable(length=df[columns['length']].to_numpy(),
+                         average_phred=df[columns['average_phred']].to_numpy(),
+                         gc=np.full(len(df), np.nan, dtype=np.float32),  # Not in the summary
+                         time_stamp=np.floor(df[columns['time_stamp']].to_numpy()),
+                         channel=df[columns['channel']].to_numpy(),
+                         sample=sample, flag=flag, sample_names=sample_names, flag_names=['pass', 'fail'])
 
-    def plot_total_bp_vs_time_summary(self, d):
+    def parse_summary(self):
         """
-        Sequence length vs time
-        :param d: Dictionary
-        :return: png file
-        # name, length, channel, events, average_phred, time_stamp, flag
+        Parse the "sequencing_summary.txt" file from the basecaller.
+        The columns are found by name in the header and only these columns are loaded, in bulk, with their type.
+        Reads without a barcode column all belong to a sample named after the file. Reads without a
+        "passes_filtering" column are all "pass".
+        The file is split in ranges of lines parsed in parallel by a pool of workers. The header is only read here.
+        Compressed files (.gz, .bz2, .xz, .zst) can't be split: they are decompressed by a background thread while
+        the previous blocks of lines are parsed.
+        When the cache is enabled, the parsed columns are saved in a sidecar folder of the cache and memory-mapped by
+        the next runs instead of parsing the file again. Nothing is written next to the summary file.
+        In streaming mode, every range or block of lines is added to a ReadStats as soon as it is parsed, and no
+        sidecar is used.
+        :return: ReadTable, or ReadStats in streaming mode. The time stamps are in seconds since the start of the run.
         """
 
-        fig, ax = plt.subplots()
-
-        # Fetch required information
-        ts_pass = list()
-        ts_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == b'True':
-                ts_pass.append(tuple((seq.time_stamp, seq.length)))
+        print("Parsing summary file...", end='', flush=True)
+        start_time = time()
+        opener = GzipStream.opener(self.input_summary)
+        with (opener or open)(self.input_summary, 'rb') as file_handle:
+            header_line = file_handle.readline()
+            header_end = file_handle.tell()
+        header = header_line.decode().rstrip('\r\n').split('\t')
+        columns = self.summary_columns(header)
+
+        sidecar = None
+        if self.cache is not None and not self.streaming:
+            sidecar = SummarySidecar(self.cache, self.input_summary)
+        if sidecar is not None:
+            key = sidecar.key(header_line, (NanoQC.PARSER_VERSION,))
+            t = sidecar.load(key)
+        if sidecar is None or t is None:
+            if opener is not None:
+                with io.BufferedReader(GzipStream(self.input_summary, opener=opener), 1024 * 1024) as file_handle:
+                    file_handle.readline()  # Header
+                    tables = (self.parse_summary_lines(header, columns, data)
+                              for data in self.summary_blocks(file_handle))
+                    if self.streaming:
+                        t = ReadStats(self.sample_size, self.seed)
+                        for table in tables:
+                            t.append(table)
+                    else:
+                        t = ReadTable.concatenate(list(tables))
             else:
-                ts_fail.append(tuple((seq.time_stamp, seq.length)))
-
-        x_pass_values = None
-        y_pass_values = None
-        x_fail_values = None
-        y_fail_values = None
-        if ts_pass:
-            ts_pass[:] = [tuple(((float(x) / 3600), int(y))) for x, y in ts_pass]  # Convert to hours (float)
-            ts_pass.sort(key=lambda x: x[0])  # Sort according to first element in tuple
-            x_pass_values = [x for x, y in ts_pass]
-            c = 0
-            y_pass_values = list()
-            for x, y in ts_pass:
-                y = y + c
-                y_pass_values.append(y)
-                c = y
-        if ts_fail:
-            ts_fail[:] = [tuple(((float(x) / 3600), int(y))) for x, y in ts_fail]
-            ts_fail.sort(key=lambda x: x[0])
-            x_fail_values = [x for x, y in ts_fail]
-            c = 0
-            y_fail_values = list()
-            for x, y in ts_fail:
-                y = y + c
-                y_fail_values.append(y)
-                c = y
+                t = (ReadStats if self.streaming else ReadTable).concatenate(
+                    self.parse_summary_ranges(header, columns, header_end))
+            if sidecar is not None:
+                sidecar.save(key, t)
+                self.cache.evict()
 
-        # Print plot
-        if ts_pass and ts_fail:
-            ax.plot(x_pass_values, y_pass_values, color='blue')
-            ax.plot(x_fail_values, y_fail_values, color='red')
-            ax.legend(['Pass', 'Fail'])
-        elif ts_pass:
-            ax.plot(x_pass_values, y_pass_values, color='blue')
-            ax.legend(['Pass'])
-        else:  # elif ts_fail:
-            ax.plot(x_fail_values, y_fail_values, color='red')
-            ax.legend(['Fail'])
-        ax.set(xlabel='Time (h)', ylabel='Number of base pairs', title='Total yield in base pair')
-        ax.ticklabel_format(style='plain')  # Disable the scientific notation on the y-axis
-        ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        plt.tight_layout()
-        fig.savefig(self.output_folder + "/total_bp_vs_time.png")
-
-        def plot_quality_vs_time_summary(self, d):
-            """
-            Quality vs time (bins of 1h). Violin plot
-            :param d: Dictionary
-            :return: png file
-            name, length, flag, average_phred, gc, time_string
-            """
-
-            fig, ax = plt.subplots(figsize=(10, 4))
-
-            ts_pass = list()
-            ts_fail = list()
-            for seq_id, seq in d.items():
-                if seq.flag == 'pass':
-                    #         average_phred = round(average_phred_full, 1)
-                    ts_pass.append(tuple((seq.time_string, round(seq.average_phred, 1))))
-                else:
-                    ts_fail.append(tuple((seq.time_string, round(seq.average_phred, 1))))
-
-            ts_zero_pass = None
-            ts_zero_fail = None
-            if ts_pass:
-                ts_zero_pass = min(ts_pass, key=lambda x: x[0])[0]  # looking for min of 1st elements of the tuple list
-
-            if ts_fail:
-                ts_zero_fail = min(ts_fail, key=lambda x: x[0])[0]  # looking for min of 1st elements of the tuple list
-
-            if ts_pass and ts_fail:
-                ts_zero = min(ts_zero_pass, ts_zero_fail)
-            elif ts_pass:
-                ts_zero = ts_zero_pass
-            else:  # elif ts_fail:
-                ts_zero = ts_zero_fail
-
-            ts_pass3 = list()
-            ts_fail3 = list()
-            if ts_pass:
-                ts_pass1 = [tuple(((x - ts_zero), y)) for x, y in ts_pass]  # Subtract t_zero for the all time points
-                ts_pass1.sort(key=lambda x: x[0])  # Sort according to first element in tuple
-                ts_pass2 = [tuple(((x.days * 24 + x.seconds / 3600), y)) for x, y in ts_pass1]  # Convert to hours (float)
-                ts_pass3 = [tuple((int(np.round(x)), y)) for x, y in ts_pass2]  # Round hours
-
-                df_pass = pd.DataFrame(list(ts_pass3),
-                                       columns=['Sequencing time interval (h)', 'Phred score'])  # Convert to dataframe
-                df_pass['Flag'] = pd.Series('pass', index=df_pass.index)  # Add a 'Flag' column to the end with 'pass' value
-
-            if ts_fail:
-                ts_fail1 = [tuple(((x - ts_zero), y)) for x, y in ts_fail]
-                ts_fail1.sort(key=lambda x: x[0])
-                ts_fail2 = [tuple(((x.days * 24 + x.seconds / 3600), y)) for x, y in ts_fail1]
-                ts_fail3 = [tuple((int(np.round(x)), y)) for x, y in ts_fail2]
-
-                df_fail = pd.DataFrame(list(ts_fail3), columns=['Sequencing time interval (h)', 'Phred score'])
-                df_fail['Flag'] = pd.Series('fail', index=df_fail.index)  # Add a 'Flag' column to the end with 'fail' value
-
-            # Account if there is no fail data or no pass data
-            if ts_fail3 and ts_pass3:
-                frames = [df_pass, df_fail]
-                data = pd.concat(frames)  # Merge dataframes
-            elif ts_pass3:
-                data = df_pass
-            else:  # elif ts_fail3:
-                data = df_fail
-
-            # Account if there is no fail data or no pass data
-            if ts_fail3 and ts_pass3:
-                g = sns.violinplot(x='Sequencing time interval (h)', y='Phred score', data=data, hue='Flag', split=True,
-                                   inner=None)
-                g.figure.suptitle('Sequence quality over time')
-            elif ts_pass3:
-                g = sns.violinplot(x='Sequencing time interval (h)', y='Phred score', data=data, inner=None)
-                g.figure.suptitle('Sequence quality over time (pass only)')
-            else:  # elif ts_fail3:
-                g = sns.violinplot(x='Sequencing time interval (h)', y='Phred score', data=data, inner=None)
-                g.figure.suptitle('Sequence quality over time (fail only)')
-
-            # Major ticks every 4 hours
-            # https://jakevdp.github.io/PythonDataScienceHandbook/04.10-customizing-ticks.html
-            # https://matplotlib.org/2.0.2/examples/ticks_and_spines/tick-locators.html
-            def my_formater(val, pos):
-                val_str = '{}-{}'.format(int(val), int(val + 1))
-                return val_str
-
-            ax.xaxis.set_major_formatter(FuncFormatter(my_formater))
-            ax.xaxis.set_major_locator(MultipleLocator(4))
-
-            if ts_fail:
-                plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-
-            plt.tight_layout(rect=[0, 0, 1, 0.95])  # accounts for the "suptitile" [left, bottom, right, top]
-            fig.savefig(self.output_folder + "/quality_vs_time.png")
-
-    def plot_phred_score_distribution_summary(self, d):
+        # Print read stats
+        end_time = time()
+        interval = end_time - start_time
+        print(" took %s for %d reads" % (self.elapsed_time(interval), len(t)))
+        return t
+
+    def summary_blocks(self, file_handle, size=1024 * 1024 * 64):
         """
-        Frequency of phred scores
-        :param d: Dictionary
-        :return: png file
-        # name, length, channel, events, average_phred, time_stamp, flag
+        Read a stream by blocks of whole lines
+        :param file_handle: file opened in binary mode, after the header
+        :param size: approximate number of bytes per block
+        :return: iterator of bytes
         """
-
-        fig, ax = plt.subplots()
-
-        qual_pass = list()
-        qual_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == b'True':
-                qual_pass.append(round(float(seq.average_phred), 1))
-            else:
-                qual_fail.append(round(float(seq.average_phred), 1))
-
-        mean_pass_qual = None
-        mean_fail_qual = None
-        if qual_pass:
-            mean_pass_qual = np.round(np.mean(qual_pass), 1)
-
-        if qual_fail:
-            mean_fail_qual = np.round(np.mean(qual_fail), 1)
-
-        # Print plot
-        if qual_pass and qual_fail:
-            ax.hist([qual_pass, qual_fail],
-                    bins=np.arange(min(min(qual_pass), min(qual_fail)), max(max(qual_pass), max(qual_fail))),
-                    color=['blue', 'red'],
-                    label=["pass (Avg: %s)" % mean_pass_qual, "fail (Avg: %s)" % mean_fail_qual])
-        elif qual_pass:
-            ax.hist(qual_pass,
-                    bins=np.arange(min(qual_pass), max(qual_pass)),
-                    color='blue',
-                    label="pass (Avg: %s)" % mean_pass_qual)
-        else:
-            ax.hist(qual_fail,
-                    bins=np.arange(min(qual_fail), max(qual_fail)),
-                    color='red',
-                    label="fail (Avg: %s)" % mean_fail_qual)
-        plt.legend()
-        ax.set(xlabel='Phred score', ylabel='Frequency', title='Phred score distribution')
-        ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        plt.tight_layout()
-        fig.savefig(self.output_folder + "/phred_score_distribution.png")
-
-    def plot_length_distribution_summary(self, d):
+        rest = b''
+        while True:
+            data = file_handle.read(size)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1  # Keep the incomplete last line for the next block
+            rest = data[end:]
+            if end:
+                yield data[:end]
+        if rest:
+            yield rest
+
+    def parse_summary_ranges(self, header, columns, header_end):
         """
-        Frequency of sizes. Bins auto-sized based on length distribution. Log scale x-axis.
-        :param d: Dictionary
-        :return: png file
-        name, length, flag, average_phred, gc, time_string
+        Parse the ranges of lines of an uncompressed sequencing summary file, in parallel
+        :param header: list of the column names
+        :param columns: dictionary of the ReadTable attribute: column name
+        :param header_end: position of the first line after the header
+        :return: list of ReadTable, or of ReadStats in streaming mode
         """
-
-        size_pass = list()
-        size_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == b'True':
-                size_pass.append(int(seq.length))
-            else:
-                size_fail.append(int(seq.length))
-
-        mean_fail_size = None
-        mean_pass_size = None
-        if size_fail:  # assume "pass" always present
-            min_len = min(min(size_pass), min(size_fail))
-            max_len = max(max(size_pass), max(size_fail))
-            mean_pass_size = np.round(np.mean(size_pass), 1)
-            mean_fail_size = np.round(np.mean(size_fail), 1)
-        elif size_pass:
-            min_len = min(size_pass)
-            max_len = max(size_pass)
-            mean_pass_size = np.round(np.mean(size_pass), 1)
-        else:
-            print("No reads detected!")
-            return
-
-        # Print plot
-        fig, ax = plt.subplots()
-        binwidth = int(np.round(10 * np.log10(max_len - min_len)))
-        logbins = np.logspace(np.log10(min_len), np.log10(max_len), binwidth)
-        if size_fail:
-            plt.hist([size_pass, size_fail],
-                     bins=logbins,
-                     color=['blue', 'red'],
-                     label=["pass (Avg: %s)" % mean_pass_size, "fail (Avg: %s)" % mean_fail_size])
+        ranges = list(self.summary_ranges(self.input_summary, header_end))
+        if len(ranges) > 1 and self.cpu > 1:
+            pool = mp.Pool(self.cpu)
+            jobs = [pool.apply_async(self.parse_summary_range, [header, columns, start, length])
+                    for start, length in ranges]
+            tables = [job.get() for job in jobs]
+            pool.close()
+            pool.join()
         else:
-            plt.hist(size_pass, bins=logbins, color='blue', label="pass (Avg: %s)" % mean_pass_size)
-        plt.legend()
-        plt.xscale('log')
-        ax.set(xlabel='Read length (bp)', ylabel='Frequency', title='Read length distribution')
-        ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        plt.tight_layout()
-        fig.savefig(self.output_folder + "/length_distribution.png")
-
-    def plot_quality_vs_length_hex_summary(self, d):
-        """
-        seaborn jointplot (length vs quality)
-        :param d: Dictionary
-        :return: png file
-        name, length, flag, average_phred, gc, time_string
-        """
-
-        sns.set(style="ticks")
-
-        my_dict = dict()
-        for seq_id, seq in d.items():
-            my_dict[seq_id] = [int(seq.length), float(seq.average_phred), seq.flag.decode('ascii')]
-
-        df = pd.DataFrame.from_dict(my_dict, orient='index', columns=['Length (bp)', 'Phred score', 'flag'])
-        df_pass = df.loc[df['flag'] == 'True']
-        df_fail = df.loc[df['flag'] == 'False']
-
-        # Set x-axis limits
-        min_len = min(df['Length (bp)'])
-        max_len = max(df['Length (bp)'])
-        min_exp = np.log10(min_len)
-        max_exp = np.log10(max_len)
-        min_value = float(10 ** (min_exp - 0.1))
-        max_value = float(10 ** (max_exp + 0.1))
-
-        # Set bin sized for histogram
-        # len_logbins = np.logspace(min_exp, max_exp, 25)
-
-        # Set bin sized for histogram
-        len_logbins = np.logspace(min_exp, max_exp, 50)
-
-        # Set y-axis limits
-        min_phred = min(df['Phred score'])
-        max_phred = max(df['Phred score'])
-
-        # Set bin sized for histogram
-        phred_bins = np.linspace(min_phred, max_phred, 30)
-
-        # Do the Kernel Density Estimation (KDE)
-        x = df_pass['Length (bp)']
-        y = df_pass['Phred score']
-
-        # Create grid object
-        g = sns.JointGrid(x='Length (bp)', y='Phred score', data=df_pass, space=0)
-
-        g.ax_joint.hexbin(x, y, gridsize=50, cmap="Blues", xscale='log', alpha=0.6, mincnt=1, edgecolor='none')
-        g.ax_joint.axis([min_value, max_value, min_phred, max_phred])
-        g.ax_marg_x.hist(x, histtype='stepfilled', color='blue', alpha=0.6, bins=len_logbins)
-        g.ax_marg_y.hist(y, histtype='stepfilled', color='blue', alpha=0.6, bins=phred_bins, orientation="horizontal")
-
-        # Set main plot x axis scale to log
-        g.ax_joint.set_xscale('log')
-        g.ax_marg_x.set_xscale('log')
-        g.ax_joint.set_xlim((min_value, max_value))
-
-        ####
-        # Do the same for the fail reads
-        ####
-
-        if not df_fail.empty:
-            g.x = df_fail['Length (bp)']
-            g.y = df_fail['Phred score']
-
-            # Do the Kernel Density Estimation (KDE)
-            x = df_fail['Length (bp)']
-            y = df_fail['Phred score']
-
-            g.ax_joint.hexbin(x, y, gridsize=50, cmap="Reds", xscale='log', alpha=0.6, mincnt=1, edgecolor='none')
-            g.ax_marg_x.hist(x, histtype='stepfilled', color='red', alpha=0.6, bins=len_logbins)
-            g.ax_marg_y.hist(y, histtype='stepfilled', color='red', alpha=0.6, bins=phred_bins,
-                             orientation="horizontal")
-
-        # Add legend to the joint plot area
-        # https://matplotlib.org/tutorials/intermediate/legend_guide.html
-        blue_patch = mpatches.Patch(color='blue', alpha=0.6, label='Pass')
-        red_patch = mpatches.Patch(color='red', alpha=0.6, label='Fail')
-        if not df_fail.empty:
-            g.ax_joint.legend(handles=[blue_patch, red_patch], loc='upper left')
-        else:
-            g.ax_joint.legend(handles=[blue_patch], loc='upper left')
-
-        # Add legend to top margin_plot area
-        # g.ax_marg_x.legend(('pass', 'fail'), loc='upper right')
-
-        # Set figure size
-        g.fig.set_figwidth(8)
-        g.fig.set_figheight(4)
-
-        # Save figure to file
-        g.savefig(self.output_folder + "/quality_vs_length_hex.png")
-
-    def plot_reads_vs_bp_per_sample_summary(self, d):
-        # Fetch required information
-        my_sample_dict = defaultdict()  # to get the lengths (bp)
-        for seq_id, seq in d.items():
-            print(seq_id)
-            if seq.flag == b'True':
-                length = int(seq.length)
-                if length == 0:
-                    continue
-                name = seq.name.decode('ascii')
-                if name not in my_sample_dict:
-                    my_sample_dict[name] = defaultdict()
-                if not my_sample_dict[name]:
-                    my_sample_dict[name] = [length]
-                else:
-                    my_sample_dict[name].append(length)
-
-        # Order the dictionary by keys
-        od = OrderedDict(sorted(my_sample_dict.items()))
-
-        # Create pandas dataframe
-        df = pd.DataFrame(columns=['Sample', 'bp', 'reads'])
-        for name, size_list in od.items():
-            df = df.append({'Sample': name, 'bp': sum(size_list), 'reads': len(size_list)}, ignore_index=True)
-
-        fig, ax1 = plt.subplots(figsize=(10, 6))  # In inches
-
-        ind = np.arange(len(df['Sample']))
-        width = 0.35
-        p1 = ax1.bar(ind, df['bp'], width, color='#4B9BFF', bottom=0, edgecolor='black')
-
-        ax2 = ax1.twinx()
-        p2 = ax2.bar(ind+width, df['reads'], width, color='#FFB46E', bottom=0, edgecolor='black')
-
-        ax1.set_title('Total Size Versus Total Reads Per Sample')
-        ax1.set_xticks(ind + width / 2)
-        ax1.set_xticklabels(tuple(df['Sample']), rotation=45, ha='right')
-
-        ax1.grid(False)
-        ax2.grid(False)
-
-        ax1.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        ax2.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-
-        ax1.legend((p1[0], p2[0]), ('bp', 'reads'), bbox_to_anchor=(1.1, 1), loc=2)
-        ax1.yaxis.set_units('Total bp')
-        ax2.yaxis.set_units('Total reads')
-        ax1.autoscale_view()
-
-        plt.tight_layout()
-        fig.savefig(self.output_folder + "/reads_vs_bp_per_sample.png")
-
-    def plot_pores_output_vs_time_summary(self, d):
-
-        time_list = list()
-        for seq_id, seq in d.items():
-            time_list.append(seq.time_stamp)
-
-        time_list[:] = [float(x) / 60 for x in time_list]  # Convert to minutes (float)
-        time_list[:] = [int(np.round(x)) for x in time_list]  # Round minutes
-        # Check how many 15-minute bins are required to plot all the data
-        nbins = max(time_list) / 15 if max(time_list) % 15 == 0 else int(max(time_list) / 15) + 1
-        # Create the bin boundaries
-        x_bins = np.linspace(min(time_list), max(time_list), nbins)  # every 15 min
-
-        # Generate counts for each bin
-        hist, edges = np.histogram(time_list, bins=x_bins, density=False)
-
-        fig, ax = plt.subplots()
-
-        # Plot the data
-        g = sns.scatterplot(data=hist, x_bins=edges, legend=False, size=3, alpha=0.5, linewidth=0)
-
-        # Adjust format of numbers for y axis: "1000000" -> "1,000,000"
-        g.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-
-        # Change x axis labels chunk-of-15-min to hours
-        def numfmt(m, pos):  # your custom formatter function: divide by 100.0
-            h = '{}'.format(m / 4)
-            return h
-        ax.xaxis.set_major_formatter(FuncFormatter(numfmt))
-
-        # Major ticks every 4 hours
-        def my_formater(val, pos):
-            val_str = '{}'.format(int(val/4))
-            return val_str
-
-        # https://jakevdp.github.io/PythonDataScienceHandbook/04.10-customizing-ticks.html
-        # ticks = range(0, ceil(max(time_list3) / 60) + 4, 4)
-        ax.xaxis.set_major_formatter(FuncFormatter(my_formater))
-        # ax.xaxis.set_major_locator(MaxNLocator(len(ticks), integer=True))
-        ax.xaxis.set_major_locator(MultipleLocator(4 * 4))  # 4 block of 15 min per hour. Want every 4 hours
-
-        # Add label to axes
-        plt.title('Pores output over time')
-        plt.ylabel('Reads per 15 minutes')
-        plt.xlabel('Sequencing time (hours)')
-
-        plt.tight_layout()  # Get rid of extra margins around the plot
-        fig = g.get_figure()  # Get figure from FacetGrid
-        fig.savefig(self.output_folder + "/pores_output_vs_time.png")
-
-    def plot_pores_output_vs_time_all_summary(self, d):
-
-        import matplotlib.lines as mlines
-
-        fig, ax = plt.subplots()
-
-        time_list_all = list()
-        time_list_pass = list()
-        time_list_fail = list()
-
-        for seq_id, seq in d.items():
-            time_stamp = seq.time_stamp
-            time_list_all.append(time_stamp)
-            if seq.flag == b'True':
-                time_list_pass.append(time_stamp)
-            else:
-                time_list_fail.append(time_stamp)
-
-        time_zero = min(time_list_all)  # find smallest datetime value
-
-        # Plot all
-        time_list_all[:] = [float(x) / 60 for x in time_list_all]  # Convert to minutes (float)
-        time_list_all[:] = [int(np.round(x)) for x in time_list_all]  # Round minutes
-        # Check how many 15-minute bins are required to plot all the data
-        nbins = max(time_list_all) / 15 if max(time_list_all) % 15 == 0 else int(max(time_list_all) / 15) + 1
-        # Create the bin boundaries
-        x_bins = np.linspace(min(time_list_all), max(time_list_all), nbins)  # every 15 min
-
-        # If not fail, just draw the pass. Else, draw total, fail and pass
-        if time_list_fail:  # fail reads might be missing if plotting filtered reads for example.
-            # Plot pass - Assume always pass reads present
-            time_list_pass[:] = [float(x) / 60 for x in time_list_pass]
-            time_list_pass[:] = [int(np.round(x)) for x in time_list_pass]
-            hist, edges = np.histogram(time_list_pass, bins=x_bins, density=False)
-            sns.scatterplot(data=hist, x_bins=edges, size=3, alpha=0.5, linewidth=0, cmap='Blues')
-
-            # Plot fail
-            time_list_fail[:] = [float(x) / 60 for x in time_list_fail]
-            time_list_fail[:] = [int(np.round(x)) for x in time_list_fail]
-            hist, edges = np.histogram(time_list_fail, bins=x_bins, density=False)
-            sns.scatterplot(data=hist, x_bins=edges, size=3, alpha=0.5, linewidth=0, cmap='Reds')
-
-        # Plot all
-        hist, edges = np.histogram(time_list_all, bins=x_bins, density=False)
-        sns.scatterplot(data=hist, x_bins=edges, size=3, alpha=0.5, linewidth=0, cmap='Greens')
-
-        # Adjust format of numbers for y axis: "1000000" -> "1,000,000"
-        ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-
-        # Change x axis labels chunk-of-15-min to hours
-        def numfmt(m, pos):
-            h = '{}'.format(m / 4)
-            return h
-        ax.xaxis.set_major_formatter(FuncFormatter(numfmt))
-
-        # Major ticks every 4 hours
-        def my_formater(val, pos):
-            val_str = '{}'.format(int(val/4))
-            return val_str
-
-        # https://jakevdp.github.io/PythonDataScienceHandbook/04.10-customizing-ticks.html
-        ax.xaxis.set_major_formatter(FuncFormatter(my_formater))
-        ax.xaxis.set_major_locator(MultipleLocator(4 * 4))  # 4 block of 15 min per hour. Want every 4 hours
-
-        # Add legend to the plot area
-        # https://stackoverflow.com/questions/47391702/matplotlib-making-a-colored-markers-legend-from-scratch
-
-        all_marker = mlines.Line2D([], [], color='green', alpha=0.6, label='All', marker='o',
-                                   markersize=5, linestyle='None')
-        pass_marker = mlines.Line2D([], [], color='blue', alpha=0.6, label='Pass', marker='o',
-                                    markersize=5, linestyle='None')
-        fail_marker = mlines.Line2D([], [], color='red', alpha=0.6, label='Fail', marker='o',
-                                    markersize=5, linestyle='None')
-
-        if time_list_fail:
-            ax.legend(handles=[all_marker, pass_marker, fail_marker], loc='upper right')
-        else:
-            green_circle = mlines.Line2D([], [], color='green', alpha=0.6, label='Pass', marker='o',
-                                         markersize=5, linestyle='None')
-            ax.legend(handles=[all_marker], loc='upper right')
-
-        # Add label to axes
-        plt.title('Pores output over time')
-        plt.ylabel('Reads per 15 minutes')
-        plt.xlabel('Sequencing time (hours)')
-
-        plt.tight_layout()  # Get rid of extra margins around the plot
-        # fig = g.get_figure()  # Get figure from FacetGrid
-        fig.savefig(self.output_folder + "/pores_output_vs_time_all.png")
+            tables = [self.parse_summary_range(header, columns, start, length) for start, length in ranges]
+        return tables
 
     def make_layout(self, maxval):
         """Make the physical layout of the MinION flowcell.
@@ -3640,242 +4144,17 @@ class NanoQC(object):
                 xticks=range(1, 33),
                 yticks=range(1, 17))
 
-    def plot_channel_output_total(self, d):
-        """
-        https://github.com/wdecoster/nanoplotter/blob/master/nanoplotter/spatial_heatmap.py#L69
-        https://bioinformatics.stackexchange.com/questions/745/minion-channel-ids-from-albacore/749#749
-
-        :param d: Dictionary
-        :return: png file
-        """
-
-        channel_dict = defaultdict()
-        for seq_id, seq in d.items():
-            length = int(seq.length)
-            if length == 0:
-                continue
-            channel_number = int(seq.channel)
-            # Pass and fail appart
-            # if channel_number not in channel_dict:
-            #     channel_dict[channel_number] = [0, 0]
-            # if seq.flag == b'True':
-            #     channel_dict[channel_number][0] += 1
-            # else:  # seq.flag == b'False':
-            #     channel_dict[channel_number][1] += 1
-
-            # Pass and fail together
-            if channel_number not in channel_dict:
-                channel_dict[channel_number] = 0
-            channel_dict[channel_number] += 1
-
-        # convert to Pandas dataframe
-        df = pd.DataFrame.from_dict(channel_dict, orient='index', columns=['Reads'])
-        # Sort df on value
-        # df = df.sort_values(by='Reads', ascending=True)
-
-        # Plot
-
-        maxval = max(df.index)
-        layout = self.make_layout(maxval=maxval)
-        value_cts = pd.Series(df['Reads'])
-        for entry in value_cts.keys():
-            layout.template[np.where(layout.structure == entry)] = value_cts[entry]
-        plt.figure()
-        ax = sns.heatmap(data=pd.DataFrame(layout.template, index=layout.yticks, columns=layout.xticks),
-                         xticklabels="auto", yticklabels="auto",
-                         square=True,
-                         cbar_kws={"orientation": "horizontal"},
-                         cmap='Greens',
-                         linewidths=0.20)
-        plt.tight_layout()  # Get rid of extra margins around the plot
-        fig = ax.get_figure()  # Get figure from FacetGrid
-        fig.savefig(self.output_folder + "/channel_output_total.png")
-
-    def plot_channel_output_pass_fail(self, d):
-        """
-        https://github.com/wdecoster/nanoplotter/blob/master/nanoplotter/spatial_heatmap.py#L69
-        https://bioinformatics.stackexchange.com/questions/745/minion-channel-ids-from-albacore/749#749
-
-        :param d: Dictionary
-        :return: png file
-        """
-
-        channel_dict = defaultdict()
-        for seq_id, seq in d.items():
-            length = int(seq.length)
-            if length == 0:
-                continue
-            channel_number = int(seq.channel)
-            # Pass and fail apart
-            if channel_number not in channel_dict:
-                channel_dict[channel_number] = [0, 0]
-            if seq.flag == b'True':
-                channel_dict[channel_number][0] += 1
-            else:  # seq.flag == b'False':
-                channel_dict[channel_number][1] += 1
-
-        # convert to Pandas dataframe
-        df = pd.DataFrame.from_dict(channel_dict, orient='index', columns=['Pass', 'Fail'])
-        df_pass = df[['Pass']]  # The double square brakets keep the column name
-        df_fail = df[['Fail']]
-
-        # Plot
-        fig, axs = plt.subplots(nrows=2, figsize=(6, 8))
-
-        for i, my_tuple in enumerate([(df_pass, 'Pass', 'Blues'), (df_fail, 'Fail', 'Reds')]):
-            my_df = my_tuple[0]
-            flag = my_tuple[1]
-            cmap = my_tuple[2]
-            maxval = max(my_df.index)  # maximum channel value
-            layout = self.make_layout(maxval=maxval)
-            value_cts = pd.Series(my_df[flag])
-            for entry in value_cts.keys():
-                layout.template[np.where(layout.structure == entry)] = value_cts[entry]
-            sns.heatmap(data=pd.DataFrame(layout.template, index=layout.yticks, columns=layout.xticks),
-                        xticklabels="auto", yticklabels="auto",
-                        square=True,
-                        cbar_kws={"orientation": "horizontal"},
-                        cmap=cmap,
-                        linewidths=0.20,
-                        ax=axs[i])
-            axs[i].set_title("{} reads output per channel".format(flag))
-        plt.tight_layout()  # Get rid of extra margins around the plot
-        fig.savefig(self.output_folder + "/channel_output_pass_fail.png")
-
-    def plot_channel_output_all_summary(self, d):
-        """
-        https://github.com/wdecoster/nanoplotter/blob/master/nanoplotter/spatial_heatmap.py#L69
-        https://bioinformatics.stackexchange.com/questions/745/minion-channel-ids-from-albacore/749#749
-
-        :param d: Dictionary
-        :return: png file
-        """
-
-        channel_dict = defaultdict()
-        for seq_id, seq in d.items():
-            length = int(seq.length)
-            if length == 0:
-                continue
-            channel_number = int(seq.channel)
-            # Pass and fail apart
-            if channel_number not in channel_dict:
-                channel_dict[channel_number] = [0, 0]
-            if seq.flag == b'True':
-                channel_dict[channel_number][0] += 1
-            else:  # seq.flag == b'False':
-                channel_dict[channel_number][1] += 1
-
-        # convert to Pandas dataframe
-        df = pd.DataFrame.from_dict(channel_dict, orient='index', columns=['Pass', 'Fail'])
-        df_all = pd.DataFrame()
-        df_all['All'] = df['Pass'] + df['Fail']
-        df_pass = df[['Pass']]  # The double square brakets keep the column name
-        df_fail = df[['Fail']]
-
-        # Plot
-        fig, axs = plt.subplots(nrows=3, figsize=(6, 12))
-
-        for i, my_tuple in enumerate([(df_all, 'All', 'Greens'), (df_pass, 'Pass', 'Blues'), (df_fail, 'Fail', 'Reds')]):
-            my_df = my_tuple[0]
-            flag = my_tuple[1]
-            cmap = my_tuple[2]
-
-            maxval = max(my_df.index)  # maximum channel value
-            layout = self.make_layout(maxval=maxval)
-            value_cts = pd.Series(my_df[flag])
-            for entry in value_cts.keys():
-                layout.template[np.where(layout.structure == entry)] = value_cts[entry]
-            sns.heatmap(data=pd.DataFrame(layout.template, index=layout.yticks, columns=layout.xticks),
-                        xticklabels="auto", yticklabels="auto",
-                        square=True,
-                        cbar_kws={"orientation": "horizontal"},
-                        cmap=cmap,
-                        linewidths=0.20,
-                        ax=axs[i])
-            axs[i].set_title("{} reads output per channel".format(flag))
-        plt.tight_layout()  # Get rid of extra margins around the plot
-        fig.savefig(self.output_folder + "/channel_output_all.png")
-
-    def plot_quality_vs_time_summary(self, d):
-        """
-        Quality vs time (bins of 1h). Violin plot
-        :param d: Dictionary
-        :return: png file
-        name, length, flag, average_phred, gc, time_string
-        """
-
-        fig, ax = plt.subplots(figsize=(10, 6))
-
-        ts_pass = list()
-        ts_fail = list()
-        for seq_id, seq in d.items():
-            if seq.flag == b'True':
-                ts_pass.append(tuple((seq.time_stamp, round(float(seq.average_phred), 1))))
-            else:
-                ts_fail.append(tuple((seq.time_stamp, round(float(seq.average_phred), 1))))
-
-        if ts_pass:
-            ts_pass[:] = [tuple(((float(x) / 3600), y)) for x, y in ts_pass]  # Convert to hours (float)
-            ts_pass.sort(key=lambda x: x[0])  # Sort according to first element in tuple
-            ts_pass[:] = [tuple((int(np.round(x)), y)) for x, y in ts_pass]  # Round hours
-
-            df_pass = pd.DataFrame(list(ts_pass), columns=['Sequencing time interval (h)', 'Phred score'])  # Convert to dataframe
-            df_pass['Flag'] = pd.Series('pass', index=df_pass.index)  # Add a 'Flag' column to the end with 'pass' value
-
-        if ts_fail:
-            ts_fail[:] = [tuple(((float(x) / 3600), y)) for x, y in ts_fail]
-            ts_fail.sort(key=lambda x: x[0])
-            ts_fail[:] = [tuple((int(np.round(x)), y)) for x, y in ts_fail]
-
-            df_fail = pd.DataFrame(list(ts_fail), columns=['Sequencing time interval (h)', 'Phred score'])
-            df_fail['Flag'] = pd.Series('fail', index=df_fail.index)  # Add a 'Flag' column to the end with 'fail' value
-
-        # Account if there is no fail data or no pass data
-        if ts_fail and ts_pass:
-            frames = [df_pass, df_fail]
-            data = pd.concat(frames)  # Merge dataframes
-        elif ts_pass:
-            data = df_pass
-        else:  # elif ts_fail3:
-            data = df_fail
-
-        # Account if there is no fail data or no pass data
-        if ts_fail and ts_pass:
-            g = sns.violinplot(x='Sequencing time interval (h)', y='Phred score', data=data, hue='Flag', split=True, inner=None)
-            g.figure.suptitle('Sequence quality over time')
-        elif ts_pass:
-            g = sns.violinplot(x='Sequencing time interval (h)', y='Phred score', data=data, inner=None)
-            g.figure.suptitle('Sequence quality over time (pass only)')
-        else:  # elif ts_fail:
-            g = sns.violinplot(x='Sequencing time interval (h)', y='Phred score', data=data, inner=None)
-            g.figure.suptitle('Sequence quality over time (fail only)')
-
-        # Major ticks every 4 hours
-        # https://jakevdp.github.io/PythonDataScienceHandbook/04.10-customizing-ticks.html
-        # https://matplotlib.org/2.0.2/examples/ticks_and_spines/tick-locators.html
-        def my_formater(val, pos):
-            val_str = '{}-{}'.format(int(val), int(val + 1))
-            return val_str
-
-        ax.xaxis.set_major_formatter(FuncFormatter(my_formater))
-        ax.xaxis.set_major_locator(MultipleLocator(4))
-
-        if ts_fail:
-            plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
-
-        plt.tight_layout(rect=[0, 0, 1, 0.95])  # accounts for the "suptitile" [left, bottom, right, top]
-        fig.savefig(self.output_folder + "/quality_vs_time.png")
-
 
 if __name__ == '__main__':
 
     parser = ArgumentParser(description='Plot QC data from nanopore sequencing run')
     parser.add_argument('-f', '--fastq', metavar='/basecalled/folder/',
                         required=False,
-                        help='Input folder with fastq file(s),gzipped or not')
+                        help='Input folder with fastq file(s), gzipped or not, or unaligned BAM file(s)')
     parser.add_argument('-s', '--summary', metavar='sequencing_summary.txt',
                         required=False,
-                        help='The "sequencing_summary.txt" file produced by the Albacore basecaller')
+                        help='The "sequencing_summary.txt" file produced by the Albacore basecaller, compressed or not '
+                             '(.gz, .bz2, .xz, .zst)')
     parser.add_argument('-o', '--output', metavar='/qc/',
                         required=True,
                         help='Output folder')
@@ -3883,6 +4162,50 @@ if __name__ == '__main__':
                         type=int,
                         default=mp.cpu_count(),
                         help='Number or threads to run')
+    parser.add_argument('-q', '--quality-mode',
+                        choices=['probability', 'arithmetic'],
+                        default='probability',
+                        help='How the average phred score of the reads is computed. "probability" averages the '
+                             'error probabilities of the bases, like the basecallers. "arithmetic" averages the phred '
+                             'scores directly, like older versions of nanoQC. Default is "probability"')
+    parser.add_argument('--streaming',
+                        action='store_true',
+                        help='Aggregate the read metrics in fixed-size histograms and counters while parsing, '
+                             'instead of keeping every read in memory. Memory use no longer grows with the number '
+                             'of reads. The plots are drawn from the histograms, so they are binned')
+    parser.add_argument('--cache-folder', metavar='~/.cache/nanoqc/',
+                        default=os.path.join(os.path.expanduser('~'), '.cache', 'nanoqc'),
+                        help='Folder where the parsing results of the fastq and summary files are kept, so the '
+                             'files are not parsed again when nanoQC is rerun. Default is "~/.cache/nanoqc"')
+    parser.add_argument('--cache-size',
+                        type=int,
+                        default=2048,
+                        help='Maximum size of the cache folder in MB. The least recently used results are removed '
+                             'first. Default is 2048')
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help='Always parse the fastq and summary files, without reading or writing the cache')
+    parser.add_argument('--no-png',
+                        action='store_true',
+                        help='Only write the HTML report, which embeds the plots, without the PNG file of every plot')
+    parser.add_argument('--sample-size',
+                        type=int,
+                        default=200000,
+                        help='Number of reads randomly sampled for the plots drawing every read. The totals and '
+                             'distributions always use all the reads. Default is 200000')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='Seed of the random sampling of the reads. Default is 0')
+    parser.add_argument('-w', '--watch',
+                        action='store_true',
+                        help='Keep watching the fastq folder during a run. Only the new fastq files are parsed and '
+                             'the report is refreshed every interval, until stopped with Ctrl-C. Implies '
+                             '--streaming')
+    parser.add_argument('-i', '--interval',
+                        type=int,
+                        default=300,
+                        help='Seconds between two refreshes of the report in watch mode. Default is 300')
     logging.basicConfig(format='\033[92m \033[1m %(asctime)s \033[0m %(message)s ',
                         level=logging.INFO,
                         datefmt='%Y-%m-%d %H:%M:%S')
@@ -3892,5 +4215,14 @@ if __name__ == '__main__':
     nanoqc = NanoQC(input_folder=arguments.fastq,
                     sequencing_summary=arguments.summary,
                     output_folder=arguments.output,
-                    threads=arguments.threads)
+                    threads=arguments.threads,
+                    quality_mode=arguments.quality_mode,
+                    streaming=arguments.streaming,
+                    watch=arguments.watch,
+                    interval=arguments.interval,
+                    cache_folder=None if arguments.no_cache else arguments.cache_folder,
+                    cache_size=arguments.cache_size * 1024 * 1024,
+                    sample_size=arguments.sample_size,
+                    seed=arguments.seed,
+                    write_png=not arguments.no_png)
     nanoqc.run()
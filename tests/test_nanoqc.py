@@ -1,7 +1,18 @@
 #!/usr/bin/env python
 
 from nanoqc import nanoQC
+import os
+import io
+import base64
+import bz2
+import gzip
+import lzma
+import zlib
+import struct
+import numpy
 import pytest
+from dateutil.parser import parse
+from datetime import timezone
 
 
 def test_arg_check_no_input_or_summary_quits():
@@ -22,3 +33,745 @@ def test_exception_when_no_input_fastqs():
                            output_folder='asdf')
     with pytest.raises(Exception):
         nanoqc.find_fastq_files()
+
+
+def write_fastq(path, n_reads=50):
+    """Write a small ONT-like fastq file and return its entries as lists of lines"""
+    entries = list()
+    with open(path, 'wb') as f:
+        for i in range(n_reads):
+            length = 20 + (i * 37) % 400
+            seq = (b'ACGTTGCAAG' * (length // 10 + 1))[:length]
+            qual = bytes(33 + (i + j) % 40 for j in range(length))
+            header = b'@read%d runid=abc read=%d ch=%d start_time=2018-06-01T%02d:%02d:00Z' \
+                     % (i, i, i % 512 + 1, i % 24, i % 60)
+            entry = [header, seq, b'+', qual]
+            entries.append(entry)
+            f.write(b'\n'.join(entry) + b'\n')
+    return entries
+
+
+def write_bam(path, entries, block_size=1000):
+    """Write the reads of write_fastq as an unaligned BAM file made of small BGZF blocks"""
+    data = b'BAM\x01' + struct.pack('<i', 0) + struct.pack('<i', 0)
+    for header, seq, plus, qual in entries:
+        fields = dict(field.split(b'=') for field in header.split()[1:])
+        read_name = header.split()[0][1:] + b'\x00'
+        codes = [b'=ACMGRSVTWYHKDBN'.index(base) for base in seq] + [0]
+        packed = bytes(codes[i] << 4 | codes[i + 1] for i in range(0, len(seq), 2))
+        tags = b'qsi' + struct.pack('<i', 10) + b'stZ' + fields[b'start_time'] + b'\x00' \
+            + b'chS' + struct.pack('<H', int(fields[b'ch'])) + b'RGZabc\x00'
+        record = struct.pack('<iiBBHHHiiii', -1, -1, len(read_name), 0, 4680, 0, 4, len(seq), -1, -1, 0) \
+            + read_name + packed + bytes(c - 33 for c in qual) + tags
+        data += struct.pack('<i', len(record)) + record
+    with open(path, 'wb') as f:
+        for i in range(0, len(data) + 1, block_size):  # The last block is the empty end of file marker
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            chunk = data[i:i + block_size]
+            deflated = compressor.compress(chunk) + compressor.flush()
+            f.write(b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+                    + struct.pack('<H', len(deflated) + 25) + deflated
+                    + struct.pack('<II', zlib.crc32(chunk), len(chunk)))
+
+
+def test_block_parser_matches_line_parser(tmp_path):
+    fastq = str(tmp_path / 'sample_reads.fastq')
+    entries = write_fastq(fastq)
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path))
+    expected = dict()
+    for entry in entries:
+        nanoqc.parse_fastq_to_dict(entry, expected, 'sample', 'pass')
+
+    parsed = nanoqc.parse_file(fastq)
+    assert len(parsed) == len(expected)
+    assert parsed.length.tolist() == [seq.length for seq in expected.values()]
+    assert parsed.average_phred.tolist() == pytest.approx([seq.average_phred for seq in expected.values()], abs=1e-4)
+    assert parsed.gc.tolist() == pytest.approx([seq.gc for seq in expected.values()], abs=1e-4)
+    assert parsed.time_stamp.tolist() == [int(seq.time_string.timestamp()) for seq in expected.values()]
+    assert parsed.channel.tolist() == [int(seq.channel) for seq in expected.values()]
+    assert parsed.decoded_samples().tolist() == ['sample'] * len(expected)
+
+
+def test_chunks_resync_on_fastq_entries(tmp_path):
+    fastq = str(tmp_path / 'sample_reads.fastq')
+    write_fastq(fastq, n_reads=200)
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=4,
+                           output_folder=str(tmp_path))
+    expected = nanoqc.parse_file(fastq)
+
+    chunks = list(nanoqc.chunkify(fastq, size=1000))
+    assert len(chunks) > 1
+    with open(fastq, 'rb') as f:
+        for start, size in chunks:
+            f.seek(start)
+            assert f.read(1) == b'@'
+
+    parsed = nanoQC.ReadTable.concatenate([nanoqc.get_chunk_data(fastq, 'sample', 'pass', chunk_info)
+                                           for chunk_info in chunks])
+    assert len(parsed) == len(expected)
+    assert parsed.length.tolist() == expected.length.tolist()
+    assert parsed.time_stamp.tolist() == expected.time_stamp.tolist()
+    assert sum(size for start, size in chunks) == os.path.getsize(fastq)
+
+
+def test_parse_timestamps_matches_dateutil():
+    time_strings = [b'2018-06-01T13:42:07Z',
+                    b'2000-02-29T00:00:00Z',
+                    b'1999-12-31T23:59:59Z',
+                    b'2021-05-05T14:23:11.123456+00:00',
+                    b'2021-05-05T16:23:11+02:00',
+                    b'2021-05-05T10:23:11.9-04:30',
+                    b'2021-05-05T14:23:11.5Z',
+                    b'May 5 2021 14:23:11']  # Not an ISO format, uses the fallback
+    # Time stamps without a time zone are UTC, whatever the time zone of the host
+    expected = [int((parse(t) if parse(t).tzinfo else parse(t).replace(tzinfo=timezone.utc)).timestamp())
+                for t in time_strings]
+    assert nanoQC.NanoQC.parse_timestamps(time_strings).tolist() == expected
+
+
+def test_read_table_concatenate_recodes_samples_and_flags():
+    a = nanoQC.ReadTable.from_sample('s1', 'pass', [100, 200], [10.0, 12.0], [50.0, 40.0], [1, 2], [1, 2])
+    b = nanoQC.ReadTable.from_sample('s2', 'fail', [300], [8.0], [45.0], [3], [3])
+    c = nanoQC.ReadTable.from_sample('s1', 'fail', [400], [9.0], [55.0], [4], [4])
+    t = nanoQC.ReadTable.concatenate([a, b, c])
+    assert len(t) == 4
+    assert t.length.tolist() == [100, 200, 300, 400]
+    assert t.decoded_samples().tolist() == ['s1', 's1', 's2', 's1']
+    assert t.decoded_flags().tolist() == ['pass', 'pass', 'fail', 'fail']
+    assert t.flag_mask('pass').tolist() == [True, True, False, False]
+
+
+def test_gzip_stream_matches_plain_file(tmp_path):
+    fastq = str(tmp_path / 'sample_reads.fastq')
+    write_fastq(fastq, n_reads=200)
+    with open(fastq, 'rb') as f, gzip.open(fastq + '.gz', 'wb') as gz:
+        gz.write(f.read())
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path))
+    with nanoQC.GzipStream(fastq + '.gz', block_size=1000) as f:
+        assert b''.join(iter(lambda: f.read(300), b'')) == open(fastq, 'rb').read()
+
+    expected = nanoqc.parse_file(fastq)
+    parsed = nanoqc.parse_file(fastq + '.gz')
+    assert parsed.length.tolist() == expected.length.tolist()
+    assert parsed.time_stamp.tolist() == expected.time_stamp.tolist()
+
+
+def test_average_phred_probability_and_arithmetic_modes(tmp_path):
+    fastq = str(tmp_path / 'sample_reads.fastq')
+    with open(fastq, 'wb') as f:
+        f.write(b'@read1 runid=abc read=1 ch=1 start_time=2018-06-01T00:00:00Z\nAC\n+\n!I\n'
+                b'@read2 runid=abc read=2 ch=1 start_time=2018-06-01T00:00:00Z\nACGT\n+\n5555\n')
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path))
+    # Q0 and Q40 average to an error probability of ~0.5
+    assert nanoqc.parse_file(fastq).average_phred.tolist() == pytest.approx([3.0101, 20.0], abs=1e-3)
+    nanoqc.quality_mode = 'arithmetic'
+    assert nanoqc.parse_file(fastq).average_phred.tolist() == pytest.approx([20.0, 20.0])
+
+
+def test_mmap_parser_with_entries_bigger_than_blocks(tmp_path):
+    fastq = str(tmp_path / 'sample_reads.fastq')
+    write_fastq(fastq, n_reads=20)
+    with open(fastq, 'rb+') as f:
+        f.truncate(os.path.getsize(fastq) - 1)  # No new line at the end of the file
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path))
+    with open(fastq, 'rb') as f:
+        expected = nanoqc.parse_fastq_blocks(f, 'sample', 'pass')
+    parsed = nanoqc.parse_fastq_mmap(fastq, 'sample', 'pass', size=64)
+    assert len(parsed) == len(expected) == 20
+    assert parsed.length.tolist() == expected.length.tolist()
+    assert parsed.average_phred.tolist() == expected.average_phred.tolist()
+
+
+def test_header_fields_found_by_key(tmp_path):
+    fastq = str(tmp_path / 'sample_reads.fastq')
+    headers = [b'@read1 runid=abc read=1 ch=7 start_time=2018-06-01T00:00:10Z',
+               b'@read2 runid=abc sampleid=s read=2 start_time=2018-06-01T00:00:20Z flow_cell_id=FAK ch=8',
+               b'@read3\tqs:i:12\tch:i:9\tst:Z:2018-06-01T00:00:30Z',
+               b'@read4 runid=abc read=4 ch=10 start_time=2018-06-01T00:00:40Z']
+    with open(fastq, 'wb') as f:
+        for header in headers:
+            f.write(header + b'\nACGT\n+\n5555\n')
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path))
+    parsed = nanoqc.parse_file(fastq)
+    assert parsed.channel.tolist() == [7, 8, 9, 10]
+    assert (parsed.time_stamp - parsed.time_stamp[0]).tolist() == [0, 10, 20, 30]
+
+
+def test_plan_tasks_splits_big_files_and_groups_small_ones(tmp_path):
+    big = str(tmp_path / 'big_reads.fastq')
+    write_fastq(big, n_reads=200)
+    small = list()
+    for i in range(10):
+        small.append(str(tmp_path / 'small{}_reads.fastq'.format(i)))
+        write_fastq(small[-1], n_reads=2)
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path))
+    nanoqc.cpu = 1
+    tasks = nanoqc.plan_tasks(small + [big], min_size=os.path.getsize(big) // 4)
+
+    ranges = [r for task in tasks for r in task]
+    assert sorted(f for f, start, length in ranges if length is None) == sorted(small)
+    assert sum(length for f, start, length in ranges if f == big) == os.path.getsize(big)
+    assert len(tasks) < len(ranges)  # Small files grouped
+    sizes = [sum(length or os.path.getsize(f) for f, start, length in task) for task in tasks]
+    assert sizes[0] == max(sizes)
+
+    parsed = nanoQC.ReadTable.concatenate([nanoqc.parse_task(task) for task in tasks])
+    assert len(parsed) == 200 + 10 * 2
+
+
+def test_streaming_stats_match_read_table(tmp_path):
+    os.makedirs(str(tmp_path / 'pass'))
+    os.makedirs(str(tmp_path / 'fail'))
+    fastqs = [str(tmp_path / 'pass' / 'a_reads.fastq'), str(tmp_path / 'fail' / 'a_reads.fastq'),
+              str(tmp_path / 'pass' / 'b_reads.fastq')]
+    for i, fastq in enumerate(fastqs):
+        write_fastq(fastq, n_reads=60 + 20 * i)
+    results = dict()
+    for streaming in [False, True]:
+        nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                               sequencing_summary=None,
+                               threads=1,
+                               output_folder=str(tmp_path),
+                               streaming=streaming)
+        results[streaming] = nanoqc.parse_task([(f, 0, None) for f in fastqs])
+    table, stats = results[False], results[True]
+    assert isinstance(stats, nanoQC.ReadStats)
+
+    assert len(stats) == len(table)
+    assert stats.start_time() == table.start_time()  # Time stamps are whole minutes
+    for flag in ['pass', 'fail']:
+        assert stats.flag_count(flag) == table.flag_count(flag)
+        assert stats.channel_counts(flag).tolist() == table.channel_counts(flag).tolist()
+        names, reads, bases = table.sample_totals(flag)
+        assert dict(zip(*stats.sample_totals(flag)[:2])) == dict(zip(names, reads))
+        assert dict(zip(stats.sample_names, stats.sample_totals(flag)[2])) == dict(zip(names, bases))
+        for sample in [None, 'a', 'b']:
+            hours, counts = table.yield_curve(flag, sample=sample, bases=True)
+            stats_hours, stats_counts = stats.yield_curve(flag, sample=sample, bases=True)
+            if hours.size:
+                assert stats_counts[-1] == counts[-1]
+                assert stats_hours[-1] == pytest.approx(hours[-1])
+        hours, means, ci = table.hourly_means('gc', flag)
+        stats_hours, stats_means, stats_ci = stats.hourly_means('gc', flag)
+        assert stats_means.sum() == pytest.approx(means.sum(), rel=1e-4)
+
+    # Merging keeps the totals, whatever the time ranges of the parts
+    merged = nanoQC.ReadStats.concatenate([nanoqc.parse_task([(f, 0, None)]) for f in reversed(fastqs)])
+    assert len(merged) == len(table)
+    assert merged.flag_count('fail') == table.flag_count('fail')
+
+
+def test_watch_parses_only_new_complete_files(tmp_path):
+    os.makedirs(str(tmp_path / 'pass'))
+    old = str(tmp_path / 'pass' / 'a_reads0.fastq')
+    write_fastq(old, n_reads=30)
+    os.utime(old, (0, 0))  # Written long ago
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path / 'out'),
+                           watch=True,
+                           interval=3600)
+    assert nanoqc.streaming
+    assert nanoqc.poll_fastq_files() == ([old], [])
+
+    # A file still being written is parsed once its size stops changing
+    new = str(tmp_path / 'pass' / 'a_reads1.fastq')
+    write_fastq(new, n_reads=10)
+    assert nanoqc.poll_fastq_files() == ([], [])
+    assert nanoqc.poll_fastq_files() == ([new], [])
+    assert nanoqc.poll_fastq_files() == ([], [])
+
+
+def test_watch_parses_the_reads_appended_to_parsed_files(tmp_path):
+    os.makedirs(str(tmp_path / 'pass'))
+    fastq = str(tmp_path / 'pass' / 'a_reads.fastq')
+    write_fastq(fastq, n_reads=30)
+    more = str(tmp_path / 'more.fastq.tmp')
+    write_fastq(more, n_reads=12)
+    with open(more, 'rb') as f:
+        appended_reads = f.read()
+    with open(fastq, 'rb') as f, gzip.open(fastq + '.gz', 'wb') as gz:
+        gz.write(f.read())
+    for f in (fastq, fastq + '.gz'):
+        os.utime(f, (0, 0))
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path / 'pass'),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path / 'out'),
+                           watch=True,
+                           interval=3600)
+    assert sorted(nanoqc.poll_fastq_files()[0]) == sorted([fastq, fastq + '.gz'])
+
+    # Reads written to the files after they were parsed, a new gzip member for the gzipped file
+    sizes = {f: os.path.getsize(f) for f in (fastq, fastq + '.gz')}
+    with open(fastq, 'ab') as f:
+        f.write(appended_reads)
+    with gzip.open(fastq + '.gz', 'ab') as gz:
+        gz.write(appended_reads)
+    assert nanoqc.poll_fastq_files() == ([], [])
+    new_files, appended = nanoqc.poll_fastq_files()
+    assert new_files == []
+    assert sorted(appended) == sorted((f, sizes[f], os.path.getsize(f) - sizes[f]) for f in sizes)
+    for f, start, length in appended:
+        assert len(nanoqc.parse_range(f, start, length)) == 12
+    assert nanoqc.poll_fastq_files() == ([], [])
+
+
+def test_parse_cache_reuses_results_until_files_change(tmp_path):
+    fastqs = [str(tmp_path / 'a_reads.fastq'), str(tmp_path / 'b_reads.fastq')]
+    for fastq in fastqs:
+        write_fastq(fastq, n_reads=40)
+    for streaming in [False, True]:
+        nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                               sequencing_summary=None,
+                               threads=1,
+                               output_folder=str(tmp_path),
+                               streaming=streaming,
+                               cache_folder=str(tmp_path / 'cache'))
+        parsed = nanoqc.parse_range(fastqs[0], 0, None)
+        cached = nanoqc.parse_range(fastqs[0], 0, None)
+        assert len(cached) == len(parsed) == 40
+        assert cached.channel_counts('pass').tolist() == parsed.channel_counts('pass').tolist()
+
+    # Cached results are not used for a different file content
+    nanoqc.parse_fastq_mmap = None  # Cached results don't need the parser
+    assert len(nanoqc.parse_range(fastqs[0], 0, None)) == 40
+    write_fastq(fastqs[0], n_reads=45)
+    del nanoqc.parse_fastq_mmap
+    assert len(nanoqc.parse_range(fastqs[0], 0, None)) == 45
+
+    # Least recently used results removed first
+    cache = nanoqc.cache
+    cached_files = os.listdir(cache.folder)
+    for i, cached_file in enumerate(cached_files):
+        os.utime(os.path.join(cache.folder, cached_file), (i, i))
+    nanoqc.parse_range(fastqs[1], 0, None)
+    assert len(os.listdir(cache.folder)) == len(cached_files) + 1
+    recent = [cached_file for cached_file in os.listdir(cache.folder) if cached_file not in cached_files]
+    cache.max_size = os.path.getsize(os.path.join(cache.folder, recent[0]))
+    cache.evict()
+    assert os.listdir(cache.folder) == recent
+
+
+def test_parse_cache_hits_with_other_threads_and_files(tmp_path):
+    big = str(tmp_path / 'big_reads.fastq')
+    write_fastq(big, n_reads=200)
+    other = str(tmp_path / 'other_reads.fastq')
+    write_fastq(other, n_reads=20)
+    with open(other, 'rb') as f, gzip.open(other + '.gz', 'wb') as gz:
+        gz.write(f.read())
+    os.remove(other)
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path),
+                           cache_folder=str(tmp_path / 'cache'))
+    min_size = os.path.getsize(big) // 5
+    for task in nanoqc.plan_tasks([big], min_size=min_size):
+        nanoqc.parse_task(task)
+    cached_files = os.listdir(nanoqc.cache.folder)
+    assert len(cached_files) > 1  # Split in ranges
+
+    # Rerun with more threads and one more file: the ranges of the big file are loaded from the cache
+    nanoqc.cpu = 8
+    nanoqc.parse_fastq_mmap = None
+    parsed = nanoQC.ReadTable.concatenate([nanoqc.parse_task(task)
+                                           for task in nanoqc.plan_tasks([big, other + '.gz'], min_size=min_size)])
+    assert len(parsed) == 200 + 20
+    assert len(os.listdir(nanoqc.cache.folder)) == len(cached_files) + 1
+
+
+def test_reservoir_sample_same_in_streaming_and_table_modes(tmp_path):
+    fastqs = [str(tmp_path / 'a_reads.fastq'), str(tmp_path / 'b_reads.fastq')]
+    for i, fastq in enumerate(fastqs):
+        write_fastq(fastq, n_reads=100 + i)
+    samples = dict()
+    for streaming in [False, True]:
+        nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                               sequencing_summary=None,
+                               threads=1,
+                               output_folder=str(tmp_path),
+                               streaming=streaming,
+                               sample_size=30,
+                               seed=7)
+        # Parsed in separate tasks, merged in any order
+        parsed = [nanoqc.parse_task([(f, 0, None)]) for f in fastqs]
+        merged = type(parsed[0]).concatenate(parsed[::-1])
+        assert len(merged) == 201
+        samples[streaming] = merged.reservoir(30, 7)
+
+    assert len(samples[True]) == len(samples[False]) == 30
+    for table in samples.values():
+        assert sorted(table.sample_names) == ['a', 'b']
+    assert sorted(zip(samples[True].time_stamp, samples[True].length, samples[True].decoded_samples())) == \
+        sorted(zip(samples[False].time_stamp, samples[False].length, samples[False].decoded_samples()))
+    assert (samples[False].priority_keys(7) != samples[False].priority_keys(8)).all()
+
+
+def test_bam_matches_fastq_in_whole_file_and_ranges(tmp_path):
+    fastq = str(tmp_path / 'sample_reads.fastq')
+    bam = str(tmp_path / 'sample_reads.bam')
+    write_bam(bam, write_fastq(fastq, n_reads=200))
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=4,
+                           output_folder=str(tmp_path))
+    expected = nanoqc.parse_file(fastq)
+
+    parsed = nanoqc.parse_file(bam)
+    assert len(parsed) == len(expected)
+    assert parsed.length.tolist() == expected.length.tolist()
+    assert parsed.average_phred.tolist() == pytest.approx(expected.average_phred.tolist(), abs=1e-4)
+    assert parsed.gc.tolist() == expected.gc.tolist()
+    assert parsed.time_stamp.tolist() == expected.time_stamp.tolist()
+    assert parsed.channel.tolist() == expected.channel.tolist()
+
+    # Byte ranges cutting through blocks and records
+    size = os.path.getsize(bam)
+    ranges = [nanoqc.parse_range(bam, start, 1500) for start in range(0, size, 1500)]
+    assert len(ranges) > 2
+    assert nanoQC.ReadTable.concatenate(ranges).length.tolist() == expected.length.tolist()
+
+
+def write_summary(path, n_reads=100, columns=None):
+    """Write a small sequencing summary file and return its rows as dictionaries"""
+    columns = columns or ['filename', 'read_id', 'run_id', 'channel', 'start_time', 'duration', 'num_events',
+                          'passes_filtering', 'sequence_length_template', 'mean_qscore_template',
+                          'barcode_arrangement']
+    rows = list()
+    for i in range(n_reads):
+        rows.append({'filename': 'reads_%d.fast5' % (i // 10), 'read_id': 'read%d' % i, 'run_id': 'abc',
+                     'channel': str(i % 512 + 1), 'start_time': '%.5f' % (i * 97.3), 'duration': '1.5',
+                     'num_events': str(i * 7), 'passes_filtering': 'True' if i % 4 else 'False',
+                     'sequence_length_template': str((i * 37) % 400), 'mean_qscore_template': '%.6f' % (5 + i % 9),
+                     'barcode_arrangement': 'barcode%02d' % (i % 3 + 1)})
+    with open(path, 'w') as f:
+        f.write('\t'.join(columns) + '\n')
+        for row in rows:
+            f.write('\t'.join(row[column] for column in columns) + '\n')
+    return rows
+
+
+def test_parse_summary_finds_columns_by_name(tmp_path):
+    summary = str(tmp_path / 'sequencing_summary.txt')
+    rows = [row for row in write_summary(summary) if row['sequence_length_template'] != '0']
+    nanoqc = nanoQC.NanoQC(input_folder=None,
+                           sequencing_summary=summary,
+                           threads=1,
+                           output_folder=str(tmp_path))
+    t = nanoqc.parse_summary()
+    assert len(t) == len(rows)
+    assert t.length.tolist() == [int(row['sequence_length_template']) for row in rows]
+    assert t.average_phred.tolist() == [float(row['mean_qscore_template']) for row in rows]
+    assert t.time_stamp.tolist() == [int(float(row['start_time'])) for row in rows]
+    assert t.channel.tolist() == [int(row['channel']) for row in rows]
+    assert t.decoded_flags().tolist() == ['pass' if row['passes_filtering'] == 'True' else 'fail' for row in rows]
+    assert t.decoded_samples().tolist() == [row['barcode_arrangement'] for row in rows]
+
+    # Other column order, without barcodes
+    write_summary(summary, columns=['read_id', 'sequence_length_template', 'passes_filtering', 'channel',
+                                    'mean_qscore_template', 'start_time'])
+    t = nanoqc.parse_summary()
+    assert t.length.tolist() == [int(row['sequence_length_template']) for row in rows]
+    assert t.decoded_samples().tolist() == ['sequencing_summary'] * len(rows)
+
+
+def test_summary_ranges_end_at_lines_and_merge_to_whole_file(tmp_path):
+    summary = str(tmp_path / 'sequencing_summary.txt')
+    write_summary(summary, n_reads=300)
+    nanoqc = nanoQC.NanoQC(input_folder=None,
+                           sequencing_summary=summary,
+                           threads=4,
+                           output_folder=str(tmp_path))
+    expected = nanoqc.parse_summary()
+
+    with open(summary, 'rb') as f:
+        header = f.readline()
+        data = f.read()
+    ranges = list(nanoqc.summary_ranges(summary, len(header), size=1000))
+    assert len(ranges) > 2
+    assert sum(length for start, length in ranges) == len(data)
+    assert all(data[start + length - len(header) - 1] == ord('\n') for start, length in ranges)
+
+    names = header.decode().rstrip('\n').split('\t')
+    columns = nanoqc.summary_columns(names)
+    t = nanoQC.ReadTable.concatenate([nanoqc.parse_summary_range(names, columns, start, length)
+                                      for start, length in ranges])
+    assert t.length.tolist() == expected.length.tolist()
+    assert t.time_stamp.tolist() == expected.time_stamp.tolist()
+    assert t.decoded_samples().tolist() == expected.decoded_samples().tolist()
+    assert t.decoded_flags().tolist() == expected.decoded_flags().tolist()
+
+
+def test_compressed_summaries_match_plain_file(tmp_path):
+    summary = str(tmp_path / 'sequencing_summary.txt')
+    write_summary(summary, n_reads=300)
+    nanoqc = nanoQC.NanoQC(input_folder=None,
+                           sequencing_summary=summary,
+                           threads=1,
+                           output_folder=str(tmp_path))
+    expected = nanoqc.parse_summary()
+    with open(summary, 'rb') as f:
+        data = f.read()
+
+    for extension, module in (('.gz', gzip), ('.bz2', bz2), ('.xz', lzma)):
+        with module.open(summary + extension, 'wb') as f:
+            f.write(data)
+        nanoqc.input_summary = summary + extension
+        t = nanoqc.parse_summary()
+        assert t.length.tolist() == expected.length.tolist()
+        assert t.average_phred.tolist() == expected.average_phred.tolist()
+        assert t.decoded_samples().tolist() == expected.decoded_samples().tolist()
+
+    # Blocks of whole lines
+    blocks = list(nanoqc.summary_blocks(io.BytesIO(data), size=1000))
+    assert len(blocks) > 2
+    assert b''.join(blocks) == data
+    assert all(block.endswith(b'\n') for block in blocks)
+
+
+def test_streaming_summary_matches_read_table(tmp_path):
+    summary = str(tmp_path / 'sequencing_summary.txt')
+    write_summary(summary, n_reads=300)
+    with open(summary, 'rb') as f, gzip.open(summary + '.gz', 'wb') as gz:
+        gz.write(f.read())
+    nanoqc = nanoQC.NanoQC(input_folder=None,
+                           sequencing_summary=summary,
+                           threads=2,
+                           output_folder=str(tmp_path))
+    table = nanoqc.parse_summary()
+    nanoqc.streaming = True
+    for path in (summary, summary + '.gz'):
+        nanoqc.input_summary = path
+        stats = nanoqc.parse_summary()
+        assert isinstance(stats, nanoQC.ReadStats)
+        assert len(stats) == len(table)
+        for flag in ('pass', 'fail'):
+            assert stats.flag_count(flag) == table.flag_count(flag)
+            assert dict(zip(*stats.sample_totals(flag)[::2])) == dict(zip(*table.sample_totals(flag)[::2]))
+
+
+def test_summary_sidecar_is_memory_mapped_until_the_summary_changes(tmp_path):
+    summary = str(tmp_path / 'sequencing_summary.txt')
+    write_summary(summary, n_reads=100)
+    nanoqc = nanoQC.NanoQC(input_folder=None,
+                           sequencing_summary=summary,
+                           threads=1,
+                           output_folder=str(tmp_path),
+                           cache_folder=str(tmp_path / 'cache'))
+    expected = nanoqc.parse_summary()
+    assert sorted(os.listdir(str(tmp_path))) == ['cache', 'sequencing_summary.txt']  # Nothing written next to the summary
+    sidecars = os.listdir(nanoqc.cache.folder)
+    assert len(sidecars) == 1 and sidecars[0].endswith('.nanoqc')
+
+    t = nanoqc.parse_summary()
+    assert isinstance(t.length.base, numpy.memmap)
+    assert t.length.tolist() == expected.length.tolist()
+    assert t.decoded_samples().tolist() == expected.decoded_samples().tolist()
+
+    rows = write_summary(summary, n_reads=120)
+    t = nanoqc.parse_summary()
+    assert len(t) == len([row for row in rows if row['sequence_length_template'] != '0'])
+
+    # The sidecars count in the size of the cache, the least recently used removed first
+    assert len(os.listdir(nanoqc.cache.folder)) == 2
+    nanoqc.cache.max_size = 1
+    nanoqc.cache.evict()
+    assert os.listdir(nanoqc.cache.folder) == []
+
+
+def test_summary_report_uses_the_shared_plots(tmp_path):
+    summary = str(tmp_path / 'sequencing_summary.txt')
+    write_summary(summary, n_reads=200)
+    output = tmp_path / 'report'
+    output.mkdir()
+    nanoqc = nanoQC.NanoQC(input_folder=None,
+                           sequencing_summary=summary,
+                           threads=2,
+                           output_folder=str(output))
+    nanoqc.run()
+    assert sorted(os.listdir(str(output))) == sorted(['nanoQC_report.html'] + [name + '.png' for name in
+                                                                               nanoQC.NanoQC.SUMMARY_PLOTS])
+    assert list(nanoqc.plot_times) == list(nanoQC.NanoQC.SUMMARY_PLOTS)  # In the order of the report
+
+
+def test_fastq_report_in_table_and_streaming_modes(tmp_path):
+    fastqs = tmp_path / 'fastq'
+    for flag in ('pass', 'fail'):
+        os.makedirs(str(fastqs / flag))
+        for sample in ('s1', 's2'):
+            write_fastq(str(fastqs / flag / (sample + '_reads.fastq')), n_reads=100)
+    for streaming in (False, True):
+        output = tmp_path / ('report_%s' % streaming)
+        nanoqc = nanoQC.NanoQC(input_folder=str(fastqs),
+                               sequencing_summary=None,
+                               threads=2,
+                               output_folder=str(output),
+                               streaming=streaming,
+                               sample_size=50)
+        nanoqc.run()
+        assert isinstance(nanoqc.read_table, nanoQC.ReadStats if streaming else nanoQC.ReadTable)
+        assert len(nanoqc.read_table) == 400
+        assert sorted(os.listdir(str(output))) == sorted(['nanoQC_report.html'] + [name + '.png' for name in
+                                                                                   nanoQC.NanoQC.FASTQ_PLOTS])
+        assert list(nanoqc.plot_times) == list(nanoQC.NanoQC.FASTQ_PLOTS)
+
+
+def test_fastq_report_with_pass_reads_only(tmp_path):
+    fastqs = tmp_path / 'fastq'
+    os.makedirs(str(fastqs / 'pass'))
+    for sample in ('s1', 's2'):
+        write_fastq(str(fastqs / 'pass' / (sample + '_reads.fastq')), n_reads=100)
+    output = tmp_path / 'report'
+    nanoqc = nanoQC.NanoQC(input_folder=str(fastqs),
+                           sequencing_summary=None,
+                           threads=2,
+                           output_folder=str(output))
+    nanoqc.run()
+    assert len(nanoqc.read_table) == 200
+    assert sorted(os.listdir(str(output))) == sorted(['nanoQC_report.html'] + [name + '.png' for name in
+                                                                               nanoQC.NanoQC.FASTQ_PLOTS])
+
+
+def test_plot_inputs_match_read_table(tmp_path):
+    nanoqc = nanoQC.NanoQC(input_folder=str(tmp_path),
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=str(tmp_path))
+    for name in ('s1_pass', 's2_pass', 's1_fail'):
+        write_fastq(str(tmp_path / (name + '.fastq')), n_reads=150)
+    t = nanoQC.ReadTable.concatenate([nanoqc.parse_file(str(tmp_path / (name + '.fastq')))
+                                      for name in ('s1_pass', 's2_pass', 's1_fail')])
+    inputs = nanoQC.PlotInputs(t, set(need for needs in nanoQC.NanoQC.PLOT_INPUTS.values() for need in needs))
+
+    def same(a, b):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            if isinstance(x, numpy.ndarray):
+                numpy.testing.assert_allclose(x, y)
+            else:
+                assert x == y
+
+    assert inputs.run_hours().tolist() == t.run_hours().tolist()
+    sample = nanoQC.PlotInputs(t, {'reservoir'}, 100, 3).select({'reservoir'}).reservoir(100, 3)
+    assert len(sample) == 100
+    assert sample.time_stamp.tolist() == t.reservoir(100, 3).time_stamp.tolist()
+    for flag in ('pass', 'fail'):
+        assert inputs.flag_count(flag) == t.flag_count(flag)
+        same(inputs.sample_totals(flag), t.sample_totals(flag))
+        same(inputs.minute_counts(flag), t.minute_counts(flag))
+        assert inputs.channel_counts(flag).tolist() == t.channel_counts(flag).tolist()
+        for column in ('average_phred', 'gc'):
+            same(inputs.hourly_histograms(column, flag), t.hourly_histograms(column, flag))
+            assert t.hourly_histograms(column, flag)[2].sum() == t.flag_count(flag)
+        for sample in (None, 's1', 's2'):
+            same(inputs.hourly_means('gc', flag, sample=sample), t.hourly_means('gc', flag, sample=sample))
+            for bases in (False, True):
+                same(inputs.yield_curve(flag, sample=sample, bases=bases),
+                     t.yield_curve(flag, sample=sample, bases=bases))
+
+
+def test_plot_inputs_selected_for_a_plot_only_keep_its_columns():
+    t = nanoQC.ReadTable.from_sample('s1', 'pass', [100, 200, 300], [10.0, 12.0, 8.0], [50.0, 40.0, 45.0],
+                                     [0, 3600, 7200], [1, 2, 3])
+    inputs = nanoQC.PlotInputs(t, {'yields', ('column', 'length')})
+    selected = inputs.select({('column', 'length')})
+    assert selected.distribution('length', 'pass')[0].tolist() == [100, 200, 300]
+    assert len(selected) == 3
+    with pytest.raises(AttributeError):
+        selected.gc
+    with pytest.raises(AttributeError):
+        selected.sorted_seconds
+
+
+def test_read_stats_selected_for_a_plot_only_keep_its_accumulators():
+    t = nanoQC.ReadTable.from_sample('s1', 'pass', [100, 200, 300], [10.0, 12.0, 8.0], [50.0, 40.0, 45.0],
+                                     [0, 3600, 7200], [1, 2, 3])
+    stats = nanoQC.ReadStats()
+    stats.append(t)
+    selected = stats.select({('column', 'length'), ('hourly_histograms', 'gc')})
+    assert selected.distribution('length', 'pass')[1].tolist() == [1, 1, 1]
+    assert selected.hourly_histograms('gc', 'pass')[2].sum() == 3
+    assert len(selected) == 3
+    with pytest.raises(AttributeError):
+        selected.sampled_reads
+    with pytest.raises(AttributeError):
+        selected.channels
+
+
+def test_png_files_are_the_images_of_the_report_or_skipped(tmp_path):
+    summary = str(tmp_path / 'sequencing_summary.txt')
+    write_summary(summary, n_reads=200)
+    for write_png in (True, False):
+        output = tmp_path / ('report_%s' % write_png)
+        output.mkdir()
+        nanoqc = nanoQC.NanoQC(input_folder=None,
+                               sequencing_summary=summary,
+                               threads=1,
+                               output_folder=str(output),
+                               write_png=write_png)
+        t = nanoqc.parse_summary()
+        plots = nanoqc.make_plots(t, nanoQC.NanoQC.SUMMARY_PLOTS)
+        if write_png:
+            for name, plot in zip(nanoQC.NanoQC.SUMMARY_PLOTS, plots):
+                with open(str(output / (name + '.png')), 'rb') as f:
+                    assert base64.b64decode(plot.image_base64_string) == f.read()
+                assert plot.png is None
+        else:
+            assert os.listdir(str(output)) == []
+            assert all(plot.image_base64_string for plot in plots)
+
+
+def test_binned_violins_label_flags_missing_from_the_first_hour():
+    t = nanoQC.ReadTable.concatenate([
+        nanoQC.ReadTable.from_sample('s1', 'pass', [100, 200], [10.0, 12.0], [50.0, 40.0], [0, 3600], [1, 2]),
+        nanoQC.ReadTable.from_sample('s1', 'fail', [300], [8.0], [45.0], [7200], [3])])
+    nanoqc = nanoQC.NanoQC(input_folder=None,
+                           sequencing_summary=None,
+                           threads=1,
+                           output_folder=None)
+    fig, ax = nanoQC.plt.subplots()
+    nanoqc.draw_binned_violins(ax, t, 'gc', '%GC')
+    assert ax.get_legend_handles_labels()[1] == ['pass', 'fail']
+    assert ax.get_ylabel() == '%GC'
+    nanoQC.plt.close(fig)
+
+
+def test_decimate_keeps_the_shape_of_the_yield_curves():
+    rng = numpy.random.default_rng(0)
+    hours = numpy.sort(rng.uniform(0, 48, 100000))
+    reads = numpy.arange(1, hours.size + 1)
+    reads[50000:] += 10000  # A step
+
+    x, y = nanoQC.NanoQC.decimate(hours, reads, n_points=500)
+    assert x.size == y.size == 500
+    assert (x[0], y[0], x[-1], y[-1]) == (hours[0], reads[0], hours[-1], reads[-1])
+    assert numpy.all(numpy.diff(x) > 0)
+    kept = numpy.flatnonzero(numpy.isin(hours, x))
+    assert kept.size == 500
+    assert 49999 in kept or 50000 in kept  # The step is not smoothed out
+
+    # Short curves are drawn as they are
+    x, y = nanoQC.NanoQC.decimate(hours[:100], reads[:100], n_points=500)
+    assert x.size == 100